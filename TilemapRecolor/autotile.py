@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+import recolor_kernels
+from palette_config import SpritePaletteConfig
+
+# Neighbour bits of a blob mask, clockwise from north
+N, NE, E, SE, S, SW, W, NW = (1 << i for i in range(8))
+# Template tiles left to right; each one supplies the quadrants of its case
+TEMPLATE_CASES = ('outer', 'horizontal', 'vertical', 'inner', 'fill')
+OUTER, HORIZONTAL, VERTICAL, INNER, FILL = range(len(TEMPLATE_CASES))
+SHEET_COLUMNS = 8
+
+
+def canonical_masks(masks):
+    """Drop diagonal bits whose two neighbouring sides are not both set
+
+    A corner only matters when both sides next to it connect, which folds
+    the 256 raw masks into the 47 distinct blob tiles.
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    keep = N | E | S | W
+    for corner, a, b in ((NE, N, E), (SE, S, E), (SW, S, W), (NW, N, W)):
+        keep = np.where(((masks & a) != 0) & ((masks & b) != 0), keep | corner, keep)
+    return masks & keep
+
+
+def blob_masks():
+    """The 47 canonical masks in ascending order and the 256-entry raw mask to tile index table"""
+    canonical = canonical_masks(np.arange(256))
+    masks, lookup = np.unique(canonical, return_inverse=True)
+    return masks, lookup.astype(np.int32)
+
+
+def quadrant_cases(masks):
+    """(len(masks), 2, 2) template case for every quadrant (row, column) of every tile"""
+    masks = np.asarray(masks, dtype=np.int64)
+    cases = np.empty((len(masks), 2, 2), dtype=np.int64)
+    for qy, vertical_bit in ((0, N), (1, S)):
+        for qx, horizontal_bit, diagonal_bit in ((0, W, NW if qy == 0 else SW), (1, E, NE if qy == 0 else SE)):
+            v = (masks & vertical_bit) != 0
+            h = (masks & horizontal_bit) != 0
+            d = (masks & diagonal_bit) != 0
+            cases[:, qy, qx] = np.select(
+                [~h & ~v, h & ~v, ~h & v, h & v & ~d],
+                [OUTER, HORIZONTAL, VERTICAL, INNER],
+                FILL)
+    return cases
+
+
+def template_quadrants(templates, tile_size):
+    """Split (S, tile_size, 5 * tile_size, C) templates into (S, 5, 2, 2, half, half, C) quadrants"""
+    templates = np.asarray(templates)
+    if tile_size % 2:
+        raise ValueError(f"Tile size must be even to split into quadrants, got {tile_size}")
+    count, height, width, channels = templates.shape
+    if height != tile_size or width != len(TEMPLATE_CASES) * tile_size:
+        raise ValueError(f"Template must be {len(TEMPLATE_CASES) * tile_size}x{tile_size} "
+                         f"({', '.join(TEMPLATE_CASES)}), got {width}x{height}")
+    half = tile_size // 2
+    quadrants = templates.reshape(count, 2, half, len(TEMPLATE_CASES), 2, half, channels)
+    return quadrants.transpose(0, 3, 1, 4, 2, 5, 6)
+
+
+@dataclass
+class AutotileSet:
+    sheet: np.ndarray  # (rows * tile_size, SHEET_COLUMNS * tile_size, C)
+    masks: np.ndarray  # canonical mask of every tile, in sheet order
+    lookup: np.ndarray  # (256,) raw neighbour mask -> tile index
+    tile_size: int
+    variants: Dict[str, np.ndarray] = field(default_factory=dict)  # palette name -> recolored sheet
+
+    def tile_for(self, mask):
+        return int(self.lookup[mask & 0xFF])
+
+    def lookup_table(self):
+        return {
+            "tile_size": self.tile_size,
+            "columns": SHEET_COLUMNS,
+            "bits": {"N": N, "NE": NE, "E": E, "SE": SE, "S": S, "SW": SW, "W": W, "NW": NW},
+            "tiles": [int(m) for m in self.masks],
+            "lookup": [int(i) for i in self.lookup]
+        }
+
+    def save(self, sheet_path, lookup_path=None):
+        """Write the sheet, every palette variant as <sheet>_<name>.png and the JSON lookup table"""
+        Image.fromarray(self.sheet).save(sheet_path)
+        stem, ext = os.path.splitext(sheet_path)
+        for name, variant in self.variants.items():
+            Image.fromarray(variant).save(f"{stem}_{name}{ext}")
+        if lookup_path:
+            with open(lookup_path, 'w') as f:
+                json.dump(self.lookup_table(), f, indent=2)
+
+
+def build_autotiles(templates, tile_size):
+    """Compose the 47 blob tiles for a batch of templates at once
+
+    templates is one (tile_size, 5 * tile_size, C) template or a stack of
+    them. Returns (sheets, masks, lookup) where sheets has one sheet per
+    template.
+    """
+    templates = np.asarray(templates)
+    single = templates.ndim == 3
+    if single:
+        templates = templates[None]
+    quadrants = template_quadrants(templates, tile_size)
+    masks, lookup = blob_masks()
+    cases = quadrant_cases(masks)
+    qy = np.arange(2)[None, :, None]
+    qx = np.arange(2)[None, None, :]
+    # (S, tiles, 2, 2, half, half, C) gathered in one fancy-index pass
+    tiles = quadrants[:, cases, qy, qx]
+    count, tile_count = tiles.shape[:2]
+    half, channels = tiles.shape[4], tiles.shape[-1]
+    rows = -(-tile_count // SHEET_COLUMNS)
+    padded = np.zeros((count, rows * SHEET_COLUMNS) + tiles.shape[2:], dtype=tiles.dtype)
+    padded[:, :tile_count] = tiles
+    sheets = (padded.reshape(count, rows, SHEET_COLUMNS, 2, 2, half, half, channels)
+              .transpose(0, 1, 3, 5, 2, 4, 6, 7)
+              .reshape(count, rows * tile_size, SHEET_COLUMNS * tile_size, channels))
+    return (sheets[0] if single else sheets), masks, lookup
+
+
+def palette_variants(config):
+    """{palette name: color mapping} from a SpritePaletteConfig
+
+    Every section's first palette is the base; palettes with the same name
+    across sections are merged into one mapping.
+    """
+    variants = {}
+    for section in config.sections.values():
+        if not section.palettes:
+            continue
+        base = section.palettes[0].colors
+        for palette in section.palettes[1:]:
+            if len(palette.colors) != len(base):
+                raise ValueError(f"Palette {palette.name} of section {section.name} has {len(palette.colors)} colors, expected {len(base)}")
+            variants.setdefault(palette.name, {}).update(
+                {tuple(b): tuple(c) for b, c in zip(base, palette.colors)})
+    return variants
+
+
+def autotile_sets(templates, tile_size, palettes=None, backend='auto'):
+    """AutotileSet for every template, each recolored with every {name: mapping} in palettes"""
+    sheets, masks, lookup = build_autotiles(np.asarray(templates), tile_size)
+    results = [AutotileSet(sheet, masks, lookup, tile_size) for sheet in sheets]
+    for name, mapping in (palettes or {}).items():
+        # The whole batch is recolored as one tall image
+        recolored = recolor_kernels.recolor(sheets.reshape((-1,) + sheets.shape[2:]), mapping, backend)
+        for result, variant in zip(results, recolored.reshape(sheets.shape)):
+            result.variants[name] = variant
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Generate 47-tile blob autotile sets from 5-tile templates')
+    parser.add_argument('templates', nargs='+', help=f"template sheets, tiles left to right: {', '.join(TEMPLATE_CASES)}")
+    parser.add_argument('--tile', type=int, default=16, help='tile size in pixels (even)')
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('--config', help='palette config JSON; every palette becomes a recolored variant')
+    args = parser.parse_args(argv)
+
+    palettes = None
+    if args.config:
+        palettes = palette_variants(SpritePaletteConfig.load_from_file(args.config))
+    os.makedirs(args.out, exist_ok=True)
+    # Same-sized templates are composed together in one batch
+    templates = [np.array(Image.open(path).convert('RGB')) for path in args.templates]
+    by_shape = {}
+    for path, template in zip(args.templates, templates):
+        by_shape.setdefault(template.shape, []).append((path, template))
+    for group in by_shape.values():
+        results = autotile_sets(np.stack([template for _, template in group]), args.tile, palettes)
+        for (path, _), result in zip(group, results):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            result.save(os.path.join(args.out, f"{stem}_autotile.png"), os.path.join(args.out, f"{stem}_autotile.json"))
+    print(f"{len(templates)} autotile sets written to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import numpy as np
+
+# Above this many pixels a dense 2**24 histogram beats sorting
+DENSE_UNIQUE_THRESHOLD = 1 << 20
+
+
+def pack_colors(pixels):
+    """Pack an (..., 3) uint8 RGB array into (...) uint32 0xRRGGBB keys"""
+    pixels = np.asarray(pixels)
+    return ((pixels[..., 0].astype(np.uint32) << 16)
+            | (pixels[..., 1].astype(np.uint32) << 8)
+            | pixels[..., 2].astype(np.uint32))
+
+
+def unpack_colors(keys):
+    """Unpack uint32 0xRRGGBB keys into an (..., 3) uint8 RGB array"""
+    keys = np.asarray(keys, dtype=np.uint32)
+    return np.stack([(keys >> 16) & 0xFF, (keys >> 8) & 0xFF, keys & 0xFF], axis=-1).astype(np.uint8)
+
+
+def unique_colors(keys):
+    """Return (unique_keys, inverse, counts) for a flat array of packed colors
+
+    Large inputs use a dense histogram over the 24-bit color space instead of
+    sorting, which is several times faster for multi-megapixel sheets.
+    """
+    keys = np.asarray(keys, dtype=np.uint32).ravel()
+    if keys.size < DENSE_UNIQUE_THRESHOLD:
+        unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        return unique.astype(np.uint32), inverse.ravel(), counts
+    histogram = np.bincount(keys, minlength=1 << 24)
+    unique = np.flatnonzero(histogram).astype(np.uint32)
+    lookup = np.empty(1 << 24, dtype=np.int32)
+    lookup[unique] = np.arange(unique.size, dtype=np.int32)
+    return unique, lookup[keys], histogram[unique]
+
+
+def slot_index_map(slot_colors, colors):
+    """Slot of every pixel of an (h, w, 3) block in slot_colors, appending unseen colors
+
+    Returns (slot_colors, index_map). Missing colors are found with one
+    isin and appended with one concatenate; duplicate slot colors resolve
+    to their first slot.
+    """
+    slot_colors = np.asarray(slot_colors, dtype=np.uint8).reshape(-1, 3)
+    colors = np.asarray(colors)
+    unique, inverse, _ = unique_colors(pack_colors(colors))
+    known = pack_colors(slot_colors)
+    missing = unique[~np.isin(unique, known)]
+    if len(missing):
+        slot_colors = np.concatenate([slot_colors, unpack_colors(missing)])
+        known = np.concatenate([known, missing])
+    order = np.argsort(known, kind='stable')
+    slots = order[np.searchsorted(known[order], unique)].astype(np.int32)
+    return slot_colors, slots[inverse].reshape(colors.shape[:2])
+
+
+def nearest_colors(colors, palette, chunk_size=65536):
+    """Index of the nearest palette entry (squared RGB distance) for each color"""
+    colors = np.asarray(colors, dtype=np.float32).reshape(-1, 3)
+    palette = np.asarray(palette, dtype=np.float32).reshape(-1, 3)
+    palette_norm = (palette ** 2).sum(axis=1)
+    result = np.empty(len(colors), dtype=np.int32)
+    for start in range(0, len(colors), chunk_size):
+        block = colors[start:start + chunk_size]
+        # |c - p|^2 without the |c|^2 term, which does not change the argmin
+        distances = palette_norm[None, :] - 2.0 * (block @ palette.T)
+        result[start:start + chunk_size] = distances.argmin(axis=1)
+    return result
+
+
+def palette_candidates(palette, bits=4, chunk_size=4096):
+    """Palette entries that can be nearest to some point of each RGB grid cell
+
+    The color cube is split into 2**bits cells per channel. An entry is a
+    candidate for a cell when its distance to the cell box is at most the
+    smallest farthest-corner distance of any entry, so the exact nearest
+    entry of every point inside the cell is always among them. Returns a
+    (cells, K) int32 table padded by repeating each cell's first candidate.
+    """
+    palette = np.asarray(palette, dtype=np.float32).reshape(-1, 3)
+    width = 256 >> bits
+    lows = np.arange(1 << bits, dtype=np.float32) * width
+    cells = np.stack(np.meshgrid(lows, lows, lows, indexing='ij'), axis=-1).reshape(-1, 3)
+    rows = []
+    for start in range(0, len(cells), chunk_size):
+        low = cells[start:start + chunk_size, None, :]
+        high = low + width
+        # Distance to the box (0 inside) and to its farthest corner
+        near = np.maximum(np.maximum(low - palette, palette - high), 0.0)
+        far = np.maximum(np.abs(palette - low), np.abs(palette - high))
+        near_sq = (near ** 2).sum(axis=-1)
+        bound = (far ** 2).sum(axis=-1).min(axis=1, keepdims=True)
+        rows.append(near_sq <= bound)
+    mask = np.concatenate(rows)
+    counts = mask.sum(axis=1)
+    table = np.empty((len(mask), int(counts.max())), dtype=np.int32)
+    # Stable sort keeps candidates in palette order, so ties resolve like nearest_colors
+    order = np.argsort(~mask, axis=1, kind='stable')[:, :table.shape[1]]
+    table[:] = order
+    padding = np.arange(table.shape[1])[None, :] >= counts[:, None]
+    table[padding] = np.broadcast_to(table[:, :1], table.shape)[padding]
+    return table
+
+
+def nearest_colors_grid(colors, palette, bits=4, chunk_size=65536):
+    """Exact nearest_colors for many colors, with a cost that barely grows with the palette
+
+    Colors are grouped by grid cell (a radix argsort of the cell ids) and
+    each group is only compared with its cell's candidates (see
+    palette_candidates).
+    """
+    colors = np.asarray(colors, dtype=np.float32).reshape(-1, 3)
+    palette = np.asarray(palette, dtype=np.float32).reshape(-1, 3)
+    table = palette_candidates(palette, bits)
+    palette_norm = (palette ** 2).sum(axis=1)
+    shift = 8 - bits
+    cell = np.minimum(colors, 255).astype(np.uint16) >> shift
+    cell_ids = (cell[:, 0] << (2 * bits)) | (cell[:, 1] << bits) | cell[:, 2]
+    order = np.argsort(cell_ids, kind='stable')
+    bounds = np.searchsorted(cell_ids[order], np.arange(len(table) + 1))
+    result = np.empty(len(colors), dtype=np.int32)
+    for cell_id in np.flatnonzero(np.diff(bounds)):
+        candidates = np.unique(table[cell_id])
+        for start in range(bounds[cell_id], bounds[cell_id + 1], chunk_size):
+            members = order[start:min(start + chunk_size, bounds[cell_id + 1])]
+            # Same |p|^2 - 2 c.p form as nearest_colors
+            distances = palette_norm[candidates] - 2.0 * (colors[members] @ palette[candidates].T)
+            result[members] = candidates[distances.argmin(axis=1)]
+    return result
+
+
+def rgb_to_lab(colors):
+    """Convert (..., 3) sRGB colors (0-255) to CIE L*a*b* (D65) as float32"""
+    rgb = np.asarray(colors, dtype=np.float32) / 255.0
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array([[0.4124564, 0.2126729, 0.0193339],
+                             [0.3575761, 0.7151522, 0.1191920],
+                             [0.1804375, 0.0721750, 0.9503041]], dtype=np.float32)
+    xyz /= np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    lab = np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+    return lab.astype(np.float32)
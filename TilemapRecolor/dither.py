@@ -0,0 +1,109 @@
+from functools import lru_cache
+
+import numpy as np
+
+from color_utils import nearest_colors, nearest_colors_grid
+
+DITHER_METHODS = ('bayer', 'blue_noise')
+# Above these sizes pixels are matched against per-cell palette candidates
+# instead of the whole palette (same result, cost no longer grows with it)
+GRID_MIN_PALETTE = 48
+GRID_MIN_PIXELS = 1 << 16
+
+
+@lru_cache(maxsize=None)
+def bayer_matrix(size=8):
+    """Bayer threshold matrix of a power-of-two size, values in [-0.5, 0.5)"""
+    if size < 2 or size & (size - 1):
+        raise ValueError(f"Bayer matrix size must be a power of two, got {size}")
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while len(matrix) < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    thresholds = ((matrix + 0.5) / matrix.size - 0.5).astype(np.float32)
+    thresholds.flags.writeable = False
+    return thresholds
+
+
+@lru_cache(maxsize=None)
+def blue_noise_matrix(size=64, seed=0):
+    """Tileable blue-noise threshold matrix, values in [-0.5, 0.5)
+
+    White noise is high-pass filtered in the frequency domain (which wraps,
+    so the tile repeats seamlessly) and then rank-ordered so every
+    threshold level appears equally often.
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.standard_normal((size, size))
+    fy = np.fft.fftfreq(size)[:, None]
+    fx = np.fft.fftfreq(size)[None, :]
+    radius = np.sqrt(fx * fx + fy * fy)
+    # Smooth high-pass: drop low frequencies that read as blotches
+    response = 1.0 - np.exp(-(radius / 0.2) ** 2)
+    filtered = np.real(np.fft.ifft2(np.fft.fft2(noise) * response))
+    ranks = np.empty(size * size, dtype=np.float64)
+    ranks[np.argsort(filtered, axis=None, kind='stable')] = np.arange(size * size)
+    thresholds = ((ranks + 0.5) / (size * size) - 0.5).reshape(size, size).astype(np.float32)
+    thresholds.flags.writeable = False
+    return thresholds
+
+
+def threshold_matrix(method='bayer', size=None):
+    if method == 'bayer':
+        return bayer_matrix(size or 8)
+    if method == 'blue_noise':
+        return blue_noise_matrix(size or 64)
+    raise ValueError(f"Unknown dither method: {method}")
+
+
+def palette_spread(palette):
+    """Typical RGB distance between neighbouring palette colors
+
+    The dither offset is scaled by this, so a strength of 1 mixes adjacent
+    palette entries without jumping over any.
+    """
+    palette = np.asarray(palette, dtype=np.float32).reshape(-1, 3)
+    if len(palette) < 2:
+        return 0.0
+    distances = np.sqrt(((palette[:, None] - palette[None]) ** 2).sum(axis=-1))
+    np.fill_diagonal(distances, np.inf)
+    return float(np.median(distances.min(axis=1)))
+
+
+def section_strength_map(config, width, height, default=1.0, img_array=None):
+    """(height, width) float32 dither strength from per-section settings
+
+    Sections without a dither_strength, and pixels outside every section,
+    get default. img_array is needed for color-set sections.
+    """
+    labels, names = config.label_map(width, height, img_array)
+    strengths = [default] + [
+        default if config.sections[name].dither_strength is None else config.sections[name].dither_strength
+        for name in names
+    ]
+    return np.array(strengths, dtype=np.float32)[labels]
+
+
+def dither_array(img_array, palette, method='bayer', strength=1.0, matrix_size=None):
+    """Map an (H, W, 3) array onto palette with ordered dithering
+
+    strength is a scalar or an (H, W) array (see section_strength_map); 0
+    gives plain nearest-color mapping. Returns (index_map, rgb) where
+    index_map holds a palette index for every pixel.
+    """
+    palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+    if not len(palette):
+        raise ValueError("Empty palette")
+    height, width = img_array.shape[:2]
+    matrix = threshold_matrix(method, matrix_size)
+    size = len(matrix)
+    thresholds = np.tile(matrix, (-(-height // size), -(-width // size)))[:height, :width]
+    offset = thresholds * (np.asarray(strength, dtype=np.float32) * palette_spread(palette))
+    shifted = img_array.astype(np.float32) + offset[..., None]
+    np.clip(shifted, 0, 255, out=shifted)
+    index_type = np.uint8 if len(palette) <= 256 else np.int32
+    if len(palette) >= GRID_MIN_PALETTE and height * width >= GRID_MIN_PIXELS:
+        nearest = nearest_colors_grid(shifted, palette)
+    else:
+        nearest = nearest_colors(shifted, palette)
+    index_map = nearest.reshape(height, width).astype(index_type)
+    return index_map, palette[index_map]
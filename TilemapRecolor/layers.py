@@ -0,0 +1,213 @@
+import json
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_LAYER_NAMES = ('base', 'shading', 'outline', 'overlay')
+
+
+class LayerLockedError(Exception):
+    pass
+
+
+@dataclass
+class Layer:
+    name: str
+    pixels: Optional[np.ndarray] = None  # (H, W, 4) uint8 RGBA; None until first painted
+    visible: bool = True
+    opacity: float = 1.0
+    locked: bool = False
+    # Bounding box (x0, y0, x1, y1) of everything ever painted; None while empty
+    bbox: Optional[Tuple[int, int, int, int]] = None
+
+    def grow_bbox(self, x0, y0, x1, y1):
+        if self.bbox is None:
+            self.bbox = (x0, y0, x1, y1)
+        else:
+            bx0, by0, bx1, by1 = self.bbox
+            self.bbox = (min(bx0, x0), min(by0, y0), max(bx1, x1), max(by1, y1))
+
+
+def alpha_bbox(alpha):
+    """Bounding box of the nonzero pixels of an alpha channel, or None"""
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if not len(rows):
+        return None
+    columns = np.flatnonzero(alpha.any(axis=0))
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+class LayerDocument:
+    """A stack of RGBA layers with a cached flattened RGB composite
+
+    Layers are blended bottom to top with straight alpha times the layer
+    opacity over an opaque background. Every change recomposites only the
+    rect it touches, so painting on a big sheet costs a few pixels of
+    blending, not the whole stack. Layer pixels are only allocated once
+    something is painted on them.
+    """
+
+    def __init__(self, width, height, layer_names=DEFAULT_LAYER_NAMES, background=(0, 0, 0)):
+        self.width = width
+        self.height = height
+        self.background = tuple(background)
+        self.layers: List[Layer] = [Layer(name) for name in layer_names]
+        self.composite = np.empty((height, width, 3), dtype=np.uint8)
+        self.composite[:] = self.background
+
+    @classmethod
+    def from_rgb(cls, img_array, layer_names=DEFAULT_LAYER_NAMES):
+        """Document whose first layer is an opaque copy of an (H, W, 3) sheet"""
+        height, width = img_array.shape[:2]
+        document = cls(width, height, layer_names)
+        base = document.layers[0]
+        base.pixels = np.empty((height, width, 4), dtype=np.uint8)
+        base.pixels[..., :3] = img_array
+        base.pixels[..., 3] = 255
+        base.bbox = (0, 0, width, height)
+        document.composite[:] = img_array
+        return document
+
+    def layer_index(self, name):
+        for i, layer in enumerate(self.layers):
+            if layer.name == name:
+                return i
+        raise ValueError(f"Layer {name} does not exist")
+
+    def add_layer(self, name, index=None):
+        layer = Layer(name)
+        self.layers.insert(len(self.layers) if index is None else index, layer)
+        return self.layers.index(layer)
+
+    def remove_layer(self, index):
+        layer = self.layers.pop(index)
+        if layer.bbox is not None:
+            self.recomposite(*layer.bbox)
+        return layer
+
+    def recomposite(self, x0=0, y0=0, x1=None, y1=None):
+        """Re-blend the stack inside [x0, x1) x [y0, y1) into the composite; returns that region"""
+        x1 = self.width if x1 is None else x1
+        y1 = self.height if y1 is None else y1
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(self.width, x1), min(self.height, y1)
+        if x0 >= x1 or y0 >= y1:
+            return self.composite[y0:y0, x0:x0]
+        out = np.empty((y1 - y0, x1 - x0, 3), dtype=np.float32)
+        out[:] = self.background
+        for layer in self.layers:
+            if not layer.visible or layer.opacity <= 0 or layer.bbox is None:
+                continue
+            bx0, by0, bx1, by1 = layer.bbox
+            # Only the overlap with what the layer ever painted can change anything
+            ox0, oy0, ox1, oy1 = max(x0, bx0), max(y0, by0), min(x1, bx1), min(y1, by1)
+            if ox0 >= ox1 or oy0 >= oy1:
+                continue
+            source = layer.pixels[oy0:oy1, ox0:ox1]
+            alpha = source[..., 3:4].astype(np.float32) * (layer.opacity / 255.0)
+            target = out[oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0]
+            target += (source[..., :3] - target) * alpha
+        region = self.composite[y0:y1, x0:x1]
+        np.rint(out, out=out)
+        region[:] = out
+        return region
+
+    def _check_unlocked(self, index):
+        layer = self.layers[index]
+        if layer.locked:
+            raise LayerLockedError(f"Layer {layer.name} is locked")
+        return layer
+
+    def _allocate(self, layer):
+        """Pixels of a layer, allocating the transparent buffer on first use"""
+        if layer.pixels is None:
+            layer.pixels = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        return layer.pixels
+
+    def pixel(self, index, x, y):
+        """RGBA tuple of one layer pixel; unpainted layers are transparent"""
+        pixels = self.layers[index].pixels
+        return (0, 0, 0, 0) if pixels is None else tuple(int(c) for c in pixels[y, x])
+
+    def paint(self, index, x, y, rgba):
+        """Set one pixel of a layer; returns the previous RGBA value"""
+        layer = self._check_unlocked(index)
+        old = self.pixel(index, x, y)
+        self._allocate(layer)[y, x] = rgba
+        layer.grow_bbox(x, y, x + 1, y + 1)
+        self.recomposite(x, y, x + 1, y + 1)
+        return old
+
+    def paint_block(self, index, x, y, block):
+        """Write an (h, w, 4) RGBA block into a layer at (x, y); returns the previous block"""
+        layer = self._check_unlocked(index)
+        h, w = block.shape[:2]
+        pixels = self._allocate(layer)
+        old = pixels[y:y + h, x:x + w].copy()
+        pixels[y:y + h, x:x + w] = block
+        layer.grow_bbox(x, y, x + w, y + h)
+        self.recomposite(x, y, x + w, y + h)
+        return old
+
+    def set_visible(self, index, visible):
+        return self._set_property(index, 'visible', bool(visible))
+
+    def set_opacity(self, index, opacity):
+        return self._set_property(index, 'opacity', float(min(1.0, max(0.0, opacity))))
+
+    def set_locked(self, index, locked):
+        self.layers[index].locked = bool(locked)
+
+    def _set_property(self, index, name, value):
+        """Change a blend property; returns the rect recomposited (None when nothing changed)"""
+        layer = self.layers[index]
+        if getattr(layer, name) == value:
+            return None
+        setattr(layer, name, value)
+        if layer.bbox is None:
+            return None
+        self.recomposite(*layer.bbox)
+        return layer.bbox
+
+    def save(self, file_path):
+        """Save as a compressed .npz: JSON metadata plus each layer cropped to its bbox"""
+        arrays = {}
+        bboxes = []
+        for i, layer in enumerate(self.layers):
+            # Tighten to what is still painted; erased areas are not stored.
+            # The document itself keeps its bboxes and buffers.
+            bbox = alpha_bbox(layer.pixels[..., 3]) if layer.bbox is not None else None
+            if bbox is not None:
+                x0, y0, x1, y1 = bbox
+                arrays[f"layer_{i}"] = layer.pixels[y0:y1, x0:x1]
+            bboxes.append(bbox)
+        meta = {
+            "width": self.width,
+            "height": self.height,
+            "background": list(self.background),
+            "layers": [
+                {"name": layer.name, "visible": layer.visible, "opacity": layer.opacity,
+                 "locked": layer.locked, "bbox": list(bbox) if bbox else None}
+                for layer, bbox in zip(self.layers, bboxes)
+            ]
+        }
+        with open(file_path, 'wb') as f:
+            np.savez_compressed(f, meta=np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8), **arrays)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+            document = cls(meta["width"], meta["height"], [entry["name"] for entry in meta["layers"]],
+                           meta.get("background", (0, 0, 0)))
+            for i, (layer, entry) in enumerate(zip(document.layers, meta["layers"])):
+                layer.visible = entry["visible"]
+                layer.opacity = entry["opacity"]
+                layer.locked = entry["locked"]
+                if entry["bbox"] is not None:
+                    x0, y0, x1, y1 = entry["bbox"]
+                    document._allocate(layer)[y0:y1, x0:x1] = data[f"layer_{i}"]
+                    layer.bbox = tuple(entry["bbox"])
+        document.recomposite()
+        return document
@@ -0,0 +1,46 @@
+import numpy as np
+
+
+def area_downsample(img_array, factor):
+    """Average factor x factor blocks of an (H, W, C) array; edge blocks average only real pixels"""
+    height, width, channels = img_array.shape
+    rows, columns = -(-height // factor), -(-width // factor)
+    padded = np.zeros((rows * factor, columns * factor, channels), dtype=np.uint32)
+    padded[:height, :width] = img_array
+    sums = padded.reshape(rows, factor, columns, factor, channels).sum(axis=(1, 3))
+    # Pixels per block, smaller along the right and bottom edges
+    block_h = np.minimum(factor, height - np.arange(rows) * factor)
+    block_w = np.minimum(factor, width - np.arange(columns) * factor)
+    area = (block_h[:, None] * block_w[None, :])[..., None]
+    return ((sums + area // 2) // area).astype(np.uint8)
+
+
+class Overview:
+    """Downsampled copy of a sheet that is patched from dirty rects
+
+    The whole sheet is area-averaged once; after that an edit only
+    re-averages the overview blocks its rect touches.
+    """
+
+    def __init__(self, img_array, max_size=256):
+        self.max_size = max_size
+        self.rebuild(img_array)
+
+    def rebuild(self, img_array):
+        height, width = img_array.shape[:2]
+        self.source_size = (width, height)
+        self.factor = max(1, -(-max(width, height) // self.max_size))
+        self.array = np.ascontiguousarray(area_downsample(img_array, self.factor))
+
+    def patch(self, img_array, x0, y0, x1, y1):
+        """Re-average the blocks covering source rect [x0, x1) x [y0, y1); returns them as an overview rect"""
+        f = self.factor
+        bx0, by0 = x0 // f, y0 // f
+        bx1, by1 = -(-x1 // f), -(-y1 // f)
+        source = img_array[by0 * f:by1 * f, bx0 * f:bx1 * f]
+        self.array[by0:by1, bx0:bx1] = area_downsample(source, f)
+        return bx0, by0, bx1, by1
+
+    @property
+    def size(self):
+        return self.array.shape[1], self.array.shape[0]
@@ -0,0 +1,126 @@
+import numpy as np
+from PIL import Image
+
+from color_utils import pack_colors, unpack_colors, unique_colors
+
+
+class PaletteAnimator:
+    """Renders frames of an indexed sheet where only the palette changes
+
+    The sheet is kept as an index map, so each frame is one gather of a
+    (P, 3) palette through it. Palette sequences are (K, P, 3) arrays built
+    with cycle_palettes, blend_palettes or by hand.
+    """
+
+    def __init__(self, index_map, palette):
+        self.index_map = np.asarray(index_map)
+        self.palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+        if self.index_map.size and self.index_map.max() >= len(self.palette):
+            raise ValueError("Index map refers to colors outside the palette")
+
+    @classmethod
+    def from_array(cls, img_array):
+        """Index an (H, W, 3) array exactly by its unique colors"""
+        unique, inverse, _ = unique_colors(pack_colors(img_array))
+        index_type = np.uint8 if len(unique) <= 256 else np.int32
+        return cls(inverse.reshape(img_array.shape[:2]).astype(index_type), unpack_colors(unique))
+
+    def palette_index(self, color):
+        """Index of an RGB color in the base palette"""
+        hits = np.flatnonzero((self.palette == np.array(color, dtype=np.uint8)).all(axis=1))
+        if not len(hits):
+            raise ValueError(f"Color {color} is not in the palette")
+        return int(hits[0])
+
+    def cycle_palettes(self, indices, frames, step=1):
+        """Rotate the palette entries at indices by step positions per frame
+
+        indices is the ordered list of entries that cycle (e.g. water
+        shades); every other entry stays fixed.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        palettes = np.broadcast_to(self.palette, (frames,) + self.palette.shape).copy()
+        shifts = (np.arange(frames)[:, None] * step + np.arange(len(indices))[None, :]) % len(indices)
+        palettes[:, indices] = self.palette[indices[shifts]]
+        return palettes
+
+    def blend_palettes(self, target, frames, ping_pong=False):
+        """Interpolate from the base palette to target over frames
+
+        With ping_pong the sequence returns to the base palette, which loops
+        cleanly for day/night cycles.
+        """
+        target = np.asarray(target, dtype=np.float32).reshape(self.palette.shape)
+        if ping_pong:
+            t = 1.0 - np.abs(np.linspace(-1.0, 1.0, frames, endpoint=False))
+        else:
+            t = np.linspace(0.0, 1.0, frames)
+        base = self.palette.astype(np.float32)
+        palettes = base[None] + (target - base)[None] * t[:, None, None]
+        return np.clip(np.rint(palettes), 0, 255).astype(np.uint8)
+
+    def tinted_palette(self, color, strength=1.0):
+        """Multiply-tint the base palette toward color (e.g. a night blue)"""
+        base = self.palette.astype(np.float32)
+        tinted = base * (np.asarray(color, dtype=np.float32) / 255.0)
+        return np.clip(np.rint(base + (tinted - base) * strength), 0, 255).astype(np.uint8)
+
+    def render(self, palettes):
+        """All frames as one (K, H, W, 3) array"""
+        frames = np.ascontiguousarray(np.take(_packed_palettes(palettes), self.index_map, axis=1))
+        return _unpack_frames(frames)
+
+    def iter_frames(self, palettes):
+        """Yield frames one at a time to keep memory flat for long sequences"""
+        for palette in _packed_palettes(palettes):
+            yield _unpack_frames(np.take(palette, self.index_map))
+
+    def _indexed_frames(self, palettes):
+        """Paletted PIL frames; only possible with at most 256 colors"""
+        if len(self.palette) > 256:
+            return None
+        indices = self.index_map.astype(np.uint8)
+        frames = []
+        for palette in np.asarray(palettes, dtype=np.uint8):
+            frame = Image.fromarray(indices, 'P')
+            frame.putpalette(palette.ravel().tolist())
+            frames.append(frame)
+        return frames
+
+    def save_frames(self, palettes, pattern):
+        """Save every frame as its own file; pattern is like 'water_{:03d}.png'"""
+        paths = []
+        for i, frame in enumerate(self.iter_frames(palettes)):
+            path = pattern.format(i)
+            Image.fromarray(frame).save(path)
+            paths.append(path)
+        return paths
+
+    def save_animation(self, palettes, file_path, duration=50, loop=0):
+        """Save a GIF or APNG (by extension) with duration milliseconds per frame"""
+        frames = self._indexed_frames(palettes)
+        if frames is None:
+            if file_path.lower().endswith('.gif'):
+                raise ValueError("GIF export needs at most 256 colors")
+            frames = [Image.fromarray(frame) for frame in self.iter_frames(palettes)]
+        options = {'save_all': True, 'append_images': frames[1:], 'duration': duration, 'loop': loop}
+        if file_path.lower().endswith('.gif'):
+            options['disposal'] = 1
+        frames[0].save(file_path, **options)
+
+    def save_lut_strip(self, palettes, file_path):
+        """Save the palette sequence as a LUT image with one row per frame"""
+        Image.fromarray(np.asarray(palettes, dtype=np.uint8), 'RGB').save(file_path)
+
+
+def _packed_palettes(palettes):
+    """(K, P, 3) palettes as (K, P) uint32 so a frame is a 4-byte-per-pixel gather"""
+    palettes = np.asarray(palettes, dtype=np.uint8)
+    packed = np.zeros(palettes.shape[:-1] + (4,), dtype=np.uint8)
+    packed[..., :3] = palettes
+    return packed.view(np.uint32)[..., 0]
+
+
+def _unpack_frames(frames):
+    frames = np.ascontiguousarray(frames)
+    return frames.view(np.uint8).reshape(frames.shape + (4,))[..., :3]
@@ -1,6 +1,36 @@
-from dataclasses import dataclass
-from typing import List, Dict, Tuple
+from collections.abc import MutableMapping
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Tuple
+import base64
 import json
+import struct
+import numpy as np
+
+from color_utils import pack_colors
+
+# Compact binary config: header, section table, palette table, packed colors,
+# packed section masks (version 2), names
+BINARY_MAGIC = b'SPAL'
+BINARY_VERSION = 2
+BINARY_EXTENSION = '.palcfg'
+BINARY_HEADER = struct.Struct('<4sHHIIII')  # magic, version, reserved, sections, palettes, colors, name bytes
+MASK_HEADER = struct.Struct('<I')  # version 2: mask bytes
+SECTION_DTYPE_V1 = np.dtype([
+    ('name_offset', '<u4'), ('name_length', '<u4'),
+    ('x', '<i4'), ('y', '<i4'), ('width', '<i4'), ('height', '<i4'),
+    ('dither_strength', '<f8'),  # NaN: None
+    ('palette_start', '<u4'), ('palette_count', '<u4')
+])
+SECTION_DTYPE = np.dtype(SECTION_DTYPE_V1.descr + [
+    ('priority', '<i4'), ('flags', '<u4'),
+    ('mask_offset', '<u4'), ('mask_length', '<u4'),
+    ('color_set_start', '<u4'), ('color_set_count', '<u4')
+])
+HAS_MASK, HAS_COLOR_SET = 1, 2
+PALETTE_DTYPE = np.dtype([
+    ('name_offset', '<u4'), ('name_length', '<u4'),
+    ('color_start', '<u4'), ('color_count', '<u4')
+])
 
 @dataclass
 class ColorPalette:
@@ -15,14 +45,181 @@ class SpriteSection:
     width: int
     height: int
     palettes: List[ColorPalette]
+    dither_strength: Optional[float] = None  # None: use the dither call's default
+    # Narrow the rectangle down to the pixels of a (height, width) bool mask
+    # and/or to pixels of these colors; None keeps the whole rectangle
+    mask: Optional[np.ndarray] = field(default=None, compare=False)
+    color_set: Optional[List[Tuple[int, int, int]]] = None
+    priority: int = 0  # overlapping sections: higher priority wins, then the one added later
+
+    def region_mask(self, x0, y0, x1, y1, region_keys=None):
+        """Pixels of the clipped rect [x0, x1) x [y0, y1) the section owns, or None for all
+
+        region_keys are the packed colors of that rect; color-set sections
+        need them.
+        """
+        selected = None
+        if self.mask is not None:
+            selected = self.mask[y0 - self.y:y1 - self.y, x0 - self.x:x1 - self.x]
+        if self.color_set is not None:
+            if region_keys is None:
+                raise ValueError(f"Section {self.name} selects by color; the image is needed")
+            in_set = np.isin(region_keys, pack_colors(np.array(self.color_set, dtype=np.uint8).reshape(-1, 3)))
+            selected = in_set if selected is None else selected & in_set
+        return selected
+
+
+def pack_mask(mask):
+    """Bool mask as packed bits, 8 pixels per byte in row-major order"""
+    return np.packbits(np.asarray(mask, dtype=bool), axis=None).tobytes()
+
+
+def unpack_mask(data, width, height):
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=width * height)
+    return bits.reshape(height, width).astype(bool)
+
+class LazySections(MutableMapping):
+    """Section mapping over the tables of a binary config
+
+    Only the names are decoded up front; a SpriteSection (with its
+    palettes) is built the first time it is accessed and kept, so edits to
+    it stick like with a plain dict.
+    """
+
+    def __init__(self, table, palettes, colors, names_blob, masks_blob=b'', source=None):
+        self._source = source  # file contents, rewritten as is while nothing changed
+        self._table = table
+        self._palettes = palettes
+        self._colors = colors
+        self._names_blob = names_blob
+        self._masks_blob = masks_blob
+        offsets, lengths = table['name_offset'].tolist(), table['name_length'].tolist()
+        self._names = [names_blob[o:o + n].decode('utf-8') for o, n in zip(offsets, lengths)]
+        self._rows = {name: i for i, name in enumerate(self._names)}
+        self._loaded: Dict[str, SpriteSection] = {}
+
+    def _decode(self, offset, length):
+        return self._names_blob[offset:offset + length].decode('utf-8')
+
+    def _fields(self, entry):
+        """Rect, dither, priority, packed mask bytes and color set range of a table row"""
+        dither = float(entry['dither_strength'])
+        fields = {
+            'x': int(entry['x']), 'y': int(entry['y']),
+            'width': int(entry['width']), 'height': int(entry['height']),
+            'dither_strength': None if np.isnan(dither) else dither,
+            'priority': 0, 'mask_bits': None, 'color_set': None
+        }
+        if 'priority' in entry.dtype.names:  # version 2
+            fields['priority'] = int(entry['priority'])
+            flags = int(entry['flags'])
+            if flags & HAS_MASK:
+                offset = int(entry['mask_offset'])
+                fields['mask_bits'] = self._masks_blob[offset:offset + int(entry['mask_length'])]
+            if flags & HAS_COLOR_SET:
+                fields['color_set'] = (int(entry['color_set_start']), int(entry['color_set_count']))
+        return fields
+
+    def _build(self, row):
+        entry = self._table[row]
+        start, count = int(entry['palette_start']), int(entry['palette_count'])
+        palettes = []
+        for palette in self._palettes[start:start + count]:
+            first, length = int(palette['color_start']), int(palette['color_count'])
+            colors = [tuple(color) for color in self._colors[first:first + length].tolist()]
+            palettes.append(ColorPalette(self._decode(int(palette['name_offset']), int(palette['name_length'])), colors))
+        fields = self._fields(entry)
+        name = self._decode(int(entry['name_offset']), int(entry['name_length']))
+        mask = None
+        if fields['mask_bits'] is not None:
+            mask = unpack_mask(fields['mask_bits'], fields['width'], fields['height'])
+        color_set = None
+        if fields['color_set'] is not None:
+            first, length = fields['color_set']
+            color_set = [tuple(color) for color in self._colors[first:first + length].tolist()]
+        return SpriteSection(name, fields['x'], fields['y'], fields['width'], fields['height'], palettes,
+                             fields['dither_strength'], mask, color_set, fields['priority'])
+
+    def raw_section(self, name):
+        """Fields of a never-accessed section straight from the tables, else None
+
+        Returns (fields, [(palette name, color_start, color_count)]) where
+        fields is a dict of the rect, dither_strength, priority, packed
+        mask_bits and a color_set range; color ranges index self.colors.
+        Lets the binary writer copy untouched sections without building
+        them.
+        """
+        if name in self._loaded:
+            return None
+        entry = self._table[self._rows[name]]
+        start, count = int(entry['palette_start']), int(entry['palette_count'])
+        palettes = [
+            (self._decode(offset, length), color_start, color_count)
+            for offset, length, color_start, color_count in self._palettes[start:start + count].tolist()
+        ]
+        return self._fields(entry), palettes
+
+    @property
+    def colors(self):
+        return self._colors
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def pristine(self):
+        """True while no section has been accessed, added or removed"""
+        return self._source is not None and not self._loaded and len(self._names) == len(self._table)
+
+    def __getitem__(self, name):
+        section = self._loaded.get(name)
+        if section is None:
+            section = self._loaded[name] = self._build(self._rows[name])
+        return section
+
+    def __setitem__(self, name, section):
+        if name not in self._rows and name not in self._loaded:
+            self._names.append(name)
+        self._loaded[name] = section
+
+    def __delitem__(self, name):
+        if name not in self._rows and name not in self._loaded:
+            raise KeyError(name)
+        self._names.remove(name)
+        self._rows.pop(name, None)
+        self._loaded.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._rows or name in self._loaded
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
 
 class SpritePaletteConfig:
     def __init__(self):
         self.sections: Dict[str, SpriteSection] = {}
     
-    def add_section(self, name: str, x: int, y: int, width: int, height: int):
-        """Add a new section to the sprite configuration"""
-        self.sections[name] = SpriteSection(name, x, y, width, height, [])
+    def add_section(self, name: str, x: int, y: int, width: int, height: int, dither_strength: Optional[float] = None,
+                    mask: Optional[np.ndarray] = None, color_set: Optional[List[Tuple[int, int, int]]] = None,
+                    priority: int = 0):
+        """Add a new section to the sprite configuration
+
+        mask is a (height, width) bool array limiting the section to some
+        pixels of its rectangle; color_set limits it to pixels of those
+        colors.
+        """
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            if mask.shape != (height, width):
+                raise ValueError(f"Mask of section {name} is {mask.shape[1]}x{mask.shape[0]}, expected {width}x{height}")
+        if color_set is not None:
+            color_set = [tuple(color) for color in color_set]
+        self.sections[name] = SpriteSection(name, x, y, width, height, [], dither_strength, mask, color_set, priority)
     
     def add_palette_to_section(self, section_name: str, palette_name: str, colors: List[Tuple[int, int, int]]):
         """Add a color palette to a specific section"""
@@ -32,8 +229,44 @@ class SpritePaletteConfig:
         palette = ColorPalette(palette_name, colors)
         self.sections[section_name].palettes.append(palette)
     
+    def label_map(self, width: int, height: int, img_array: Optional[np.ndarray] = None) -> Tuple[np.ndarray, List[str]]:
+        """Rasterize all sections into one (height, width) label array
+
+        Label 0 means unassigned, label i + 1 is the i-th name in the returned
+        list. Mask and color-set sections only claim their pixels; color sets
+        need img_array. Where sections overlap, the higher priority wins and
+        among equal priorities the section added later.
+
+        The result is meant to be computed once per sheet: recoloring with
+        any number of sections is then a single gather (see palette_lut).
+        """
+        labels = np.zeros((height, width), dtype=np.int32)
+        names = list(self.sections)
+        keys = pack_colors(img_array) if img_array is not None else None
+        # Stable sort: equal priorities keep insertion order
+        order = sorted(range(len(names)), key=lambda i: self.sections[names[i]].priority)
+        for i in order:
+            section = self.sections[names[i]]
+            y0, y1 = max(0, section.y), min(height, section.y + section.height)
+            x0, x1 = max(0, section.x), min(width, section.x + section.width)
+            if y0 >= y1 or x0 >= x1:
+                continue
+            selected = section.region_mask(x0, y0, x1, y1, keys[y0:y1, x0:x1] if keys is not None else None)
+            if selected is None:
+                labels[y0:y1, x0:x1] = i + 1
+            else:
+                labels[y0:y1, x0:x1][selected] = i + 1
+        return labels, names
+
+    @property
+    def uses_color_sets(self):
+        """True if any section selects pixels by color, so labels depend on the image"""
+        return any(section.color_set is not None for section in self.sections.values())
+
     def save_to_file(self, filename: str):
-        """Save the configuration to a JSON file"""
+        """Save the configuration to a JSON file, or a binary one for the .palcfg extension"""
+        if filename.lower().endswith(BINARY_EXTENSION):
+            return self.save_binary(filename)
         config_data = {
             "sections": {
                 name: {
@@ -52,16 +285,163 @@ class SpritePaletteConfig:
                 for name, section in self.sections.items()
             }
         }
+        for name, section in self.sections.items():
+            if section.dither_strength is not None:
+                config_data["sections"][name]["dither_strength"] = section.dither_strength
+            if section.mask is not None:
+                # Packed bits, base64 encoded
+                config_data["sections"][name]["mask"] = base64.b64encode(pack_mask(section.mask)).decode('ascii')
+            if section.color_set is not None:
+                config_data["sections"][name]["color_set"] = section.color_set
+            if section.priority:
+                config_data["sections"][name]["priority"] = section.priority
         
         with open(filename, 'w') as f:
             json.dump(config_data, f, indent=2)
-    
+
+    def save_binary(self, filename: str):
+        """Save the configuration in the compact binary format (see load_binary)"""
+        lazy = self.sections if isinstance(self.sections, LazySections) else None
+        if lazy is not None and lazy.pristine:
+            with open(filename, 'wb') as f:
+                f.write(lazy.source)
+            return
+        section_rows = []
+        palette_rows = []
+        raw_ranges = []  # color ranges copied from a lazily loaded config
+        raw_size = 0
+        listed_colors = []
+        name_parts = []
+        name_size = 0
+        mask_parts = []
+        mask_size = 0
+
+        def add_name(name):
+            nonlocal name_size
+            encoded = name.encode('utf-8')
+            name_parts.append(encoded)
+            name_size += len(encoded)
+            return name_size - len(encoded), len(encoded)
+
+        def add_mask(bits):
+            nonlocal mask_size
+            mask_parts.append(bits)
+            mask_size += len(bits)
+            return mask_size - len(bits), len(bits)
+
+        def add_colors(colors, raw):
+            """Start and count of colors; raw ones are (start, count) ranges into the lazy colors"""
+            nonlocal raw_size
+            if raw:
+                raw_ranges.append(colors)
+                raw_size += colors[1]
+                return raw_size - colors[1], colors[1], True
+            listed_colors.extend(colors)
+            return len(listed_colors) - len(colors), len(colors), False
+
+        # Copied colors come first, listed ones after them: starts are fixed up below
+        listed_palette_rows, listed_section_rows = [], []
+        for name in self.sections:
+            raw = lazy.raw_section(name) if lazy is not None else None
+            if raw is not None:
+                fields, palettes = raw
+                mask_bits = fields['mask_bits']
+                color_set = fields['color_set']
+                palettes = [(palette_name, (start, count), True) for palette_name, start, count in palettes]
+            else:
+                section = self.sections[name]
+                fields = {'x': section.x, 'y': section.y, 'width': section.width, 'height': section.height,
+                          'dither_strength': section.dither_strength, 'priority': section.priority}
+                mask_bits = pack_mask(section.mask) if section.mask is not None else None
+                color_set = section.color_set
+                palettes = [(palette.name, palette.colors, False) for palette in section.palettes]
+            flags = 0
+            mask_offset = mask_length = set_start = set_count = 0
+            if mask_bits is not None:
+                flags |= HAS_MASK
+                mask_offset, mask_length = add_mask(mask_bits)
+            if color_set is not None:
+                flags |= HAS_COLOR_SET
+                set_start, set_count, copied = add_colors(color_set, raw is not None)
+                if not copied:
+                    listed_section_rows.append(len(section_rows))
+            dither = fields['dither_strength']
+            section_rows.append(add_name(name) + (
+                fields['x'], fields['y'], fields['width'], fields['height'],
+                np.nan if dither is None else dither, len(palette_rows), len(palettes),
+                fields['priority'], flags, mask_offset, mask_length, set_start, set_count))
+            for palette_name, colors, copied in palettes:
+                start, count, copied = add_colors(colors, copied)
+                if not copied:
+                    listed_palette_rows.append(len(palette_rows))
+                palette_rows.append(add_name(palette_name) + (start, count))
+
+        table = np.array(section_rows, dtype=SECTION_DTYPE)
+        palette_table = np.array(palette_rows, dtype=PALETTE_DTYPE)
+        palette_table['color_start'][listed_palette_rows] += raw_size
+        table['color_set_start'][listed_section_rows] += raw_size
+        if raw_ranges:
+            starts, counts = np.array(raw_ranges, dtype=np.int64).T
+            gather = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(raw_size)
+            raw_colors = lazy.colors[gather]
+        else:
+            raw_colors = np.zeros((0, 3), dtype=np.uint8)
+        colors = np.concatenate([raw_colors, np.array(listed_colors, dtype=np.uint8).reshape(-1, 3)])
+        with open(filename, 'wb') as f:
+            f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(table), len(palette_table),
+                                       len(colors), name_size))
+            f.write(MASK_HEADER.pack(mask_size))
+            f.write(table.tobytes())
+            f.write(palette_table.tobytes())
+            f.write(colors.tobytes())
+            f.write(b''.join(mask_parts))
+            f.write(b''.join(name_parts))
+
+    @classmethod
+    def load_binary(cls, filename: str) -> 'SpritePaletteConfig':
+        """Load a binary configuration; sections are decoded on first access"""
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if len(data) < BINARY_HEADER.size:
+            raise ValueError(f"{filename} is too short for a binary palette config")
+        magic, version, _, section_count, palette_count, color_count, name_size = BINARY_HEADER.unpack_from(data)
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"{filename} is not a binary palette config")
+        if version not in (1, BINARY_VERSION):
+            raise ValueError(f"Unsupported binary palette config version {version}")
+        offset = BINARY_HEADER.size
+        mask_size = 0
+        if version >= 2:
+            mask_size, = MASK_HEADER.unpack_from(data, offset)
+            offset += MASK_HEADER.size
+        section_dtype = SECTION_DTYPE if version >= 2 else SECTION_DTYPE_V1
+        table = np.frombuffer(data, dtype=section_dtype, count=section_count, offset=offset)
+        offset += table.nbytes
+        palettes = np.frombuffer(data, dtype=PALETTE_DTYPE, count=palette_count, offset=offset)
+        offset += palettes.nbytes
+        colors = np.frombuffer(data, dtype=np.uint8, count=color_count * 3, offset=offset).reshape(-1, 3)
+        offset += colors.nbytes
+        if len(data) < offset + mask_size + name_size:
+            raise ValueError(f"{filename} is truncated")
+        masks = data[offset:offset + mask_size]
+        offset += mask_size
+        config = cls()
+        config.sections = LazySections(table, palettes, colors, data[offset:offset + name_size], masks, data)
+        return config
+
     @classmethod
     def load_from_file(cls, filename: str) -> 'SpritePaletteConfig':
-        """Load configuration from a JSON file"""
+        """Load configuration from a JSON file or, detected by its magic, a binary one"""
+        with open(filename, 'rb') as f:
+            if f.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+                return cls.load_binary(filename)
         with open(filename, 'r') as f:
             config_data = json.load(f)
-        
+        return cls.from_dict(config_data)
+
+    @classmethod
+    def from_dict(cls, config_data) -> 'SpritePaletteConfig':
+        """Build a configuration from data in the JSON file layout"""
         config = cls()
         for section_name, section_data in config_data["sections"].items():
             config.add_section(
@@ -69,7 +449,12 @@ class SpritePaletteConfig:
                 section_data["x"],
                 section_data["y"],
                 section_data["width"],
-                section_data["height"]
+                section_data["height"],
+                section_data.get("dither_strength"),
+                unpack_mask(base64.b64decode(section_data["mask"]), section_data["width"], section_data["height"])
+                if "mask" in section_data else None,
+                section_data.get("color_set"),
+                section_data.get("priority", 0)
             )
             
             for palette_data in section_data["palettes"]:
@@ -0,0 +1,211 @@
+import argparse
+import json
+import logging
+import sys
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from color_utils import rgb_to_lab
+from palette_config import SpritePaletteConfig
+
+# Every palette is resampled to this many colors, so palettes of different
+# lengths share one feature space
+FEATURE_COLORS = 8
+# Rows per block when comparing the whole library against itself
+DUPLICATE_BLOCK_SIZE = 1024
+
+
+@dataclass
+class PaletteEntry:
+    source: str  # config file (or any label given to add_config)
+    section: str
+    name: str
+    colors: List[Tuple[int, int, int]]
+
+
+def palette_features(palettes):
+    """Perceptual feature vectors for a list of palettes, as an (N, 3 * FEATURE_COLORS) float32 array
+
+    Each palette is converted to Lab, sorted by lightness and linearly
+    resampled to FEATURE_COLORS colors. Vectors are scaled so that the
+    Euclidean distance between two of them is the RMS Lab distance (about
+    Delta E 1976) between the resampled colors, and the mean of the L
+    components over the vector equals the palette's mean lightness.
+    """
+    features = np.zeros((len(palettes), 3 * FEATURE_COLORS), dtype=np.float32)
+    by_length = {}
+    for i, colors in enumerate(palettes):
+        by_length.setdefault(len(colors), []).append(i)
+    positions = np.linspace(0.0, 1.0, FEATURE_COLORS)
+    for length, rows in by_length.items():
+        if length == 0:
+            raise ValueError("Cannot index an empty palette")
+        lab = rgb_to_lab(np.array([palettes[i] for i in rows], dtype=np.uint8).reshape(len(rows), length, 3))
+        order = np.argsort(lab[..., 0], axis=1, kind='stable')
+        lab = np.take_along_axis(lab, order[..., None], axis=1)
+        t = positions * (length - 1)
+        lo = np.floor(t).astype(np.int64)
+        hi = np.minimum(lo + 1, length - 1)
+        frac = (t - lo).astype(np.float32)[None, :, None]
+        resampled = lab[:, lo] * (1 - frac) + lab[:, hi] * frac
+        features[rows] = resampled.reshape(len(rows), -1) / np.sqrt(FEATURE_COLORS)
+    return features
+
+
+class PaletteLibrary:
+    """Searchable collection of palettes from many SpritePaletteConfig files
+
+    Searches are brute force over one contiguous float32 matrix, which keeps
+    a query against 50k palettes to a single small matrix-vector product.
+    """
+
+    def __init__(self):
+        self.entries: List[PaletteEntry] = []
+        self._features = None
+        self._norms = None
+
+    @classmethod
+    def from_files(cls, paths):
+        library = cls()
+        for path in paths:
+            try:
+                library.add_config(SpritePaletteConfig.load_from_file(path), path)
+            except (OSError, ValueError, KeyError) as e:
+                logging.error(f"Skipping palette config {path}: {str(e)}")
+        return library
+
+    def add_config(self, config, source=''):
+        for section in config.sections.values():
+            for palette in section.palettes:
+                self.add_palette(palette.colors, palette.name, section.name, source)
+
+    def add_palette(self, colors, name='', section='', source=''):
+        if not colors:
+            return
+        self.entries.append(PaletteEntry(source, section, name, [tuple(int(c) for c in color) for color in colors]))
+        self._features = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def features(self):
+        """Feature matrix, rebuilt lazily after palettes are added"""
+        if self._features is None:
+            self._features = palette_features([entry.colors for entry in self.entries])
+            self._norms = (self._features ** 2).sum(axis=1)
+        return self._features
+
+    def distances(self, colors):
+        """Feature distance from a palette to every entry"""
+        features = self.features
+        query = palette_features([list(colors)])[0]
+        squared = self._norms + (query @ query) - 2.0 * (features @ query)
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def nearest(self, colors, k=5):
+        """The k closest entries as [(entry, distance)], closest first"""
+        if not self.entries:
+            return []
+        distances = self.distances(colors)
+        k = min(k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind='stable')]
+        return [(self.entries[i], float(distances[i])) for i in top]
+
+    def within(self, colors, threshold):
+        """All entries within threshold of a palette as [(entry, distance)], closest first"""
+        if not self.entries:
+            return []
+        distances = self.distances(colors)
+        hits = np.flatnonzero(distances <= threshold)
+        hits = hits[np.argsort(distances[hits], kind='stable')]
+        return [(self.entries[i], float(distances[i])) for i in hits]
+
+    def near_duplicate_pairs(self, threshold, block_size=DUPLICATE_BLOCK_SIZE):
+        """Index pairs (a, b) with a < b whose features are within threshold
+
+        Entries are compared block against block in order of mean lightness.
+        Two palettes whose mean lightness differs by more than threshold can
+        not be within threshold, so block pairs past that gap are skipped.
+        """
+        features = self.features
+        count = len(features)
+        mean_l = features[:, 0::3].mean(axis=1) * np.sqrt(FEATURE_COLORS)
+        order = np.argsort(mean_l, kind='stable')
+        features, norms, mean_l = features[order], self._norms[order], mean_l[order]
+        limit = threshold * threshold
+        pairs = []
+        for i0 in range(0, count, block_size):
+            i1 = min(count, i0 + block_size)
+            for j0 in range(i0, count, block_size):
+                if mean_l[j0] - mean_l[i1 - 1] > threshold:
+                    break
+                j1 = min(count, j0 + block_size)
+                squared = features[i0:i1] @ features[j0:j1].T
+                squared *= -2.0
+                squared += norms[i0:i1, None]
+                squared += norms[None, j0:j1]
+                close = squared <= limit
+                if not close.any():
+                    continue
+                a, b = np.nonzero(close)
+                a, b = a + i0, b + j0
+                keep = a < b
+                pairs.append(np.stack([a[keep], b[keep]], axis=1))
+        if not pairs:
+            return np.empty((0, 2), dtype=np.int64)
+        pairs = order[np.concatenate(pairs)]
+        return np.sort(pairs, axis=1)
+
+    def duplicate_clusters(self, threshold=2.0, block_size=DUPLICATE_BLOCK_SIZE):
+        """Groups of entries linked by near-duplicate pairs, largest first
+
+        threshold is in feature distance units (about Delta E); 2 is roughly
+        the smallest difference that is visible side by side.
+        """
+        pairs = self.near_duplicate_pairs(threshold, block_size)
+        if not len(pairs):
+            return []
+        labels = np.arange(len(self.entries))
+        a, b = pairs[:, 0], pairs[:, 1]
+        # Min-label propagation with pointer jumping gives connected components
+        while True:
+            smallest = np.minimum(labels[a], labels[b])
+            updated = labels.copy()
+            np.minimum.at(updated, a, smallest)
+            np.minimum.at(updated, b, smallest)
+            updated = updated[updated]
+            if np.array_equal(updated, labels):
+                break
+            labels = updated
+        members = np.unique(pairs)
+        groups = {}
+        for i in members:
+            groups.setdefault(int(labels[i]), []).append(self.entries[i])
+        return sorted(groups.values(), key=len, reverse=True)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Index palette configs and report near-duplicate palettes')
+    parser.add_argument('configs', nargs='+', help='palette config JSON files')
+    parser.add_argument('--threshold', type=float, default=2.0, help='feature distance counted as a duplicate (about Delta E)')
+    parser.add_argument('--json', action='store_true', help='print the clusters as JSON')
+    args = parser.parse_args(argv)
+
+    library = PaletteLibrary.from_files(args.configs)
+    clusters = library.duplicate_clusters(args.threshold)
+    if args.json:
+        json.dump([[{"source": e.source, "section": e.section, "name": e.name} for e in cluster] for cluster in clusters],
+                  sys.stdout, indent=2)
+    else:
+        print(f"{len(library)} palettes, {len(clusters)} near-duplicate clusters")
+        for cluster in clusters:
+            print(f"  {len(cluster)} palettes: " + ', '.join(f"{e.source}:{e.section}/{e.name}" for e in cluster[:5]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
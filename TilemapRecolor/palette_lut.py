@@ -0,0 +1,131 @@
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from color_utils import pack_colors, unpack_colors, unique_colors
+
+
+@dataclass
+class PaletteLUT:
+    """Index texture plus one LUT row per palette name
+
+    index_map holds a LUT column for every pixel. Columns [0, static_count)
+    are colors outside every section and are identical in all rows; each
+    section owns the column range in section_ranges, filled from the
+    section's palette with the row's name (or its first palette if it has
+    none with that name).
+    """
+    index_map: np.ndarray
+    lut: np.ndarray  # (rows, width, 3) uint8
+    row_names: List[str]
+    static_count: int
+    section_ranges: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+
+    @property
+    def width(self):
+        return self.lut.shape[1]
+
+    @property
+    def encoding(self):
+        return 'r8' if self.width <= 256 else 'rg16'
+
+    def index_image(self):
+        """Index texture: 8-bit grayscale, or index split into R (low) and G (high)"""
+        if self.encoding == 'r8':
+            return Image.fromarray(self.index_map.astype(np.uint8), 'L')
+        encoded = np.zeros(self.index_map.shape + (3,), dtype=np.uint8)
+        encoded[..., 0] = self.index_map & 0xFF
+        encoded[..., 1] = self.index_map >> 8
+        return Image.fromarray(encoded, 'RGB')
+
+    def render(self, row_name):
+        """The sheet recolored with one LUT row: a single gather over the index map"""
+        return self.lut[self.row_names.index(row_name)][self.index_map]
+
+    def lut_image(self):
+        return Image.fromarray(self.lut, 'RGB')
+
+    def metadata(self):
+        return {
+            "encoding": self.encoding,
+            "lut_width": self.width,
+            "rows": self.row_names,
+            "static_count": self.static_count,
+            "sections": {name: {"offset": start, "count": count} for name, (start, count) in self.section_ranges.items()}
+        }
+
+    def save(self, index_path, lut_path, metadata_path=None):
+        """Write the index texture, the LUT texture and optional JSON metadata"""
+        self.index_image().save(index_path)
+        self.lut_image().save(lut_path)
+        if metadata_path:
+            with open(metadata_path, 'w') as f:
+                json.dump(self.metadata(), f, indent=2)
+
+
+def build_palette_lut(img_array, config):
+    """Build a PaletteLUT for an (H, W, 3) image and a SpritePaletteConfig"""
+    sections = [s for s in config.sections.values() if s.palettes]
+    if not sections:
+        raise ValueError("Config has no sections with palettes")
+    height, width = img_array.shape[:2]
+    keys = pack_colors(img_array)
+    labels, names = config.label_map(width, height, img_array)
+    label_of = {name: i + 1 for i, name in enumerate(names)}
+    section_index = np.full((height, width), -1, dtype=np.int32)
+    local_index = np.zeros((height, width), dtype=np.int32)
+
+    for i, section in enumerate(sections):
+        y0, y1 = max(0, section.y), min(height, section.y + section.height)
+        x0, x1 = max(0, section.x), min(width, section.x + section.width)
+        if y0 >= y1 or x0 >= x1:
+            continue
+        base = pack_colors(np.array(section.palettes[0].colors, dtype=np.uint8).reshape(-1, 3))
+        order = np.argsort(base, kind='stable')
+        sorted_base = base[order]
+        region = keys[y0:y1, x0:x1]
+        pos = np.minimum(np.searchsorted(sorted_base, region), len(sorted_base) - 1)
+        # Only pixels this section owns in the label map, and only its base colors
+        matched = (sorted_base[pos] == region) & (labels[y0:y1, x0:x1] == label_of[section.name])
+        section_index[y0:y1, x0:x1][matched] = i
+        local_index[y0:y1, x0:x1][matched] = order[pos[matched]]
+
+    unassigned = section_index < 0
+    static_keys, static_inverse, _ = unique_colors(keys[unassigned])
+    static_count = len(static_keys)
+
+    offsets = []
+    section_ranges = {}
+    column = static_count
+    for section in sections:
+        offsets.append(column)
+        section_ranges[section.name] = (column, len(section.palettes[0].colors))
+        column += len(section.palettes[0].colors)
+    offsets = np.array(offsets, dtype=np.int32)
+    if column > 1 << 16:
+        raise ValueError(f"LUT needs {column} columns, more than a 16-bit index texture can address")
+
+    index_map = np.empty((height, width), dtype=np.int32)
+    index_map[unassigned] = static_inverse
+    index_map[~unassigned] = offsets[section_index[~unassigned]] + local_index[~unassigned]
+
+    row_names = []
+    for section in sections:
+        for palette in section.palettes:
+            if palette.name not in row_names:
+                row_names.append(palette.name)
+
+    lut = np.zeros((len(row_names), column, 3), dtype=np.uint8)
+    lut[:, :static_count] = unpack_colors(static_keys)
+    for section, offset in zip(sections, offsets):
+        by_name = {palette.name: palette for palette in section.palettes}
+        base_count = len(section.palettes[0].colors)
+        for row, name in enumerate(row_names):
+            palette = by_name.get(name, section.palettes[0])
+            if len(palette.colors) != base_count:
+                raise ValueError(f"Palette {name} of section {section.name} has {len(palette.colors)} colors, expected {base_count}")
+            lut[row, offset:offset + base_count] = np.array(palette.colors, dtype=np.uint8).reshape(-1, 3)
+    return PaletteLUT(index_map, lut, row_names, static_count, section_ranges)
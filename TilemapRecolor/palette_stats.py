@@ -0,0 +1,60 @@
+import numpy as np
+
+import recolor_kernels
+from color_utils import pack_colors, unpack_colors
+
+
+class ColorUsage:
+    """Pixel count per color, kept current by edits instead of rescans
+
+    Build it once with from_array, then report every change through
+    replace (single pixels, O(1)) or replace_many (fills and other bulk
+    edits, O(changed pixels)).
+    """
+
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+
+    @classmethod
+    def from_array(cls, img_array, backend='auto'):
+        colors, counts = recolor_kernels.count_colors(img_array, backend)
+        return cls({tuple(int(c) for c in color): int(n) for color, n in zip(colors, counts)})
+
+    def replace(self, old_color, new_color, n=1):
+        """Record n pixels changing from old_color to new_color"""
+        old_color, new_color = tuple(old_color), tuple(new_color)
+        if old_color == new_color:
+            return
+        remaining = self.counts.get(old_color, 0) - n
+        if remaining > 0:
+            self.counts[old_color] = remaining
+        else:
+            self.counts.pop(old_color, None)
+        self.counts[new_color] = self.counts.get(new_color, 0) + n
+
+    def replace_many(self, old_pixels, new_pixels):
+        """Record a bulk edit: old_pixels (N, 3) became new_pixels, an (N, 3) array or one color"""
+        old_keys = pack_colors(np.asarray(old_pixels, dtype=np.uint8).reshape(-1, 3)).astype(np.uint64)
+        if not len(old_keys):
+            return
+        new_keys = pack_colors(np.asarray(new_pixels, dtype=np.uint8).reshape(-1, 3)).astype(np.uint64)
+        new_keys = np.broadcast_to(new_keys, old_keys.shape)
+        changed = old_keys != new_keys
+        # Her (eski, yeni) çifti tek bir 48 bitlik anahtar
+        pairs, counts = np.unique(old_keys[changed] << 24 | new_keys[changed], return_counts=True)
+        for old, new, n in zip(unpack_colors(pairs >> 24), unpack_colors(pairs & 0xFFFFFF), counts):
+            self.replace(tuple(int(c) for c in old), tuple(int(c) for c in new), int(n))
+
+    def count(self, color):
+        return self.counts.get(tuple(color), 0)
+
+    def colors_in_use(self):
+        return len(self.counts)
+
+    def unused(self, palette):
+        """Palette entries that no pixel uses"""
+        return [color for color in palette if self.counts.get(tuple(color), 0) == 0]
+
+    def over_budget(self, budget):
+        """How many colors in use exceed budget (0 when within it)"""
+        return max(0, len(self.counts) - budget)
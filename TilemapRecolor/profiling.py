@@ -0,0 +1,148 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.record(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+class _Metric:
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self, max_samples):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+
+class Profiler:
+    """Collects timing spans into per-name histograms and a trace buffer
+
+    When disabled, span() returns a shared no-op context manager, so the
+    instrumented hot paths only pay for an attribute check.
+    """
+
+    def __init__(self, enabled=False, max_samples=4096, max_events=100000):
+        self.enabled = enabled
+        self.max_samples = max_samples
+        self._metrics = {}
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def span(self, name):
+        """Context manager timing the enclosed block under name"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name):
+        """Decorator timing every call of a function under name"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Span(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name, start, duration):
+        """Add one measurement (seconds) for name"""
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = _Metric(self.max_samples)
+            metric.count += 1
+            metric.total += duration
+            if duration > metric.max:
+                metric.max = duration
+            metric.samples.append(duration)
+            self._events.append((name, start, duration, threading.get_ident()))
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+            self._events.clear()
+
+    def stats(self):
+        """Return {name: {count, total_ms, p50_ms, p95_ms, max_ms}}
+
+        Count, total and max cover every call; percentiles are computed over
+        the most recent max_samples calls.
+        """
+        with self._lock:
+            snapshot = {name: (m.count, m.total, m.max, sorted(m.samples)) for name, m in self._metrics.items()}
+        result = {}
+        for name, (count, total, max_duration, samples) in snapshot.items():
+            result[name] = {
+                "count": count,
+                "total_ms": total * 1000.0,
+                "p50_ms": _percentile(samples, 50) * 1000.0,
+                "p95_ms": _percentile(samples, 95) * 1000.0,
+                "max_ms": max_duration * 1000.0
+            }
+        return result
+
+    def dump_json(self, filename):
+        """Write the aggregated stats as JSON"""
+        with open(filename, 'w') as f:
+            json.dump(self.stats(), f, indent=2)
+
+    def dump_chrome_trace(self, filename):
+        """Write recorded spans in Chrome trace event format (chrome://tracing)"""
+        with self._lock:
+            events = list(self._events)
+        pid = os.getpid()
+        trace = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": tid
+            }
+            for name, start, duration, tid in events
+        ]
+        with open(filename, 'w') as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+def _percentile(sorted_samples, percent):
+    if not sorted_samples:
+        return 0.0
+    rank = int(round(percent / 100.0 * (len(sorted_samples) - 1)))
+    return sorted_samples[rank]
+
+
+profiler = Profiler(enabled=os.environ.get('TILESET_RECOLOR_PROFILE', '') not in ('', '0'))
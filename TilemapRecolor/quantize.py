@@ -0,0 +1,169 @@
+import numpy as np
+
+from color_utils import pack_colors, unpack_colors, unique_colors, nearest_colors
+
+QUANTIZE_METHODS = ('median_cut', 'kmeans')
+
+# Median cut pre-bins colors to 5 bits per channel above this many colors
+COARSE_BIN_BITS = 5
+
+
+def median_cut(colors, weights, n_colors):
+    """Split weighted colors into at most n_colors boxes
+
+    Returns (palette, labels) where palette is an (n, 3) float array of the
+    weighted box means and labels maps every input color to its box.
+    """
+    colors = np.asarray(colors, dtype=np.int32)
+    weights = np.asarray(weights, dtype=np.float64)
+    if len(colors) > 1 << (3 * COARSE_BIN_BITS):
+        # Split boxes over a coarse histogram, then average the real colors
+        shift = 8 - COARSE_BIN_BITS
+        bins = ((colors[:, 0] >> shift) << (2 * COARSE_BIN_BITS)) | ((colors[:, 1] >> shift) << COARSE_BIN_BITS) | (colors[:, 2] >> shift)
+        bin_labels = _weighted_means(bins, colors, weights, 1 << (3 * COARSE_BIN_BITS))
+        used = np.flatnonzero(bin_labels[1] > 0)
+        _, box_labels = median_cut(np.rint(bin_labels[0][used]), bin_labels[1][used], n_colors)
+        lookup = np.zeros(1 << (3 * COARSE_BIN_BITS), dtype=np.int32)
+        lookup[used] = box_labels
+        labels = lookup[bins]
+        palette, _ = _weighted_means(labels, colors, weights, int(labels.max()) + 1)
+        return palette, labels
+    boxes = [np.arange(len(colors))]
+    ranges = [_box_range(colors[boxes[0]])]
+    totals = [weights.sum()]
+    while len(boxes) < n_colors:
+        # Split the box with the widest channel, scaled by its population
+        scores = [r[1] * t if len(b) > 1 else -1 for b, r, t in zip(boxes, ranges, totals)]
+        target = int(np.argmax(scores))
+        if scores[target] <= 0:
+            break
+        members = boxes[target]
+        channel = ranges[target][0]
+        order = members[np.argsort(colors[members, channel], kind='stable')]
+        cumulative = np.cumsum(weights[order])
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2.0))
+        split = min(max(split, 1), len(order) - 1)
+        # Keep identical channel values on one side of the cut
+        values = colors[order, channel]
+        while split < len(order) and values[split] == values[split - 1]:
+            split += 1
+        if split == len(order):
+            split = int(np.searchsorted(values, values[-1], side='left'))
+        left, right = order[:split], order[split:]
+        boxes[target:target + 1] = [left, right]
+        ranges[target:target + 1] = [_box_range(colors[left]), _box_range(colors[right])]
+        totals[target:target + 1] = [cumulative[split - 1], cumulative[-1] - cumulative[split - 1]]
+    labels = np.empty(len(colors), dtype=np.int32)
+    for i, members in enumerate(boxes):
+        labels[members] = i
+    palette, _ = _weighted_means(labels, colors, weights, len(boxes))
+    return palette, labels
+
+
+def _weighted_means(labels, colors, weights, n_labels):
+    totals = np.bincount(labels, weights, minlength=n_labels)
+    means = np.stack([np.bincount(labels, weights * colors[:, c], minlength=n_labels) for c in range(3)], axis=1)
+    return means / np.maximum(totals, 1e-12)[:, None], totals
+
+
+def _box_range(colors):
+    spans = colors.max(axis=0) - colors.min(axis=0)
+    channel = int(np.argmax(spans))
+    return channel, int(spans[channel])
+
+
+def kmeans(colors, weights, n_colors, batch_size=4096, iterations=50, seed=0, init=None):
+    """Mini-batch k-means over weighted colors
+
+    Batches are drawn with probability proportional to the weights, so a
+    color used by many pixels pulls its center harder. Centers start from a
+    median-cut palette unless init is given.
+    """
+    colors = np.asarray(colors, dtype=np.float32)
+    weights = np.asarray(weights, dtype=np.float64)
+    if init is None:
+        init, _ = median_cut(colors, weights, n_colors)
+    centers = np.array(init, dtype=np.float32)
+    k = len(centers)
+    seen = np.zeros(k, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    cumulative = np.cumsum(weights)
+    draws = rng.random((iterations, batch_size)) * cumulative[-1]
+    for draw in draws:
+        batch = colors[np.minimum(np.searchsorted(cumulative, draw, side='right'), len(colors) - 1)]
+        assigned = nearest_colors(batch, centers)
+        batch_counts = np.bincount(assigned, minlength=k).astype(np.float64)
+        sums = np.stack([np.bincount(assigned, batch[:, c], minlength=k) for c in range(3)], axis=1)
+        updated = batch_counts > 0
+        seen[updated] += batch_counts[updated]
+        rate = (batch_counts[updated] / seen[updated])[:, None]
+        means = sums[updated] / batch_counts[updated][:, None]
+        centers[updated] += (rate * (means - centers[updated])).astype(np.float32)
+    labels = nearest_colors(colors, centers)
+    return centers, labels
+
+
+def coarse_nearest(colors, palette):
+    """Nearest palette entry for each of many colors, via their coarse bins
+
+    Above 2**15 colors only the 5-bit bin centres are matched against the
+    palette and every color takes its bin's answer, so the cost no longer
+    grows with the number of colors.
+    """
+    colors = np.asarray(colors, dtype=np.int32)
+    if len(colors) <= 1 << (3 * COARSE_BIN_BITS):
+        return nearest_colors(colors, palette)
+    shift = 8 - COARSE_BIN_BITS
+    levels = (np.arange(1 << COARSE_BIN_BITS) << shift) + (1 << (shift - 1))
+    centres = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 3)
+    lookup = nearest_colors(centres, palette)
+    bins = ((colors[:, 0] >> shift) << (2 * COARSE_BIN_BITS)) | ((colors[:, 1] >> shift) << COARSE_BIN_BITS) | (colors[:, 2] >> shift)
+    return lookup[bins]
+
+
+def quantize_array(img_array, n_colors, method='median_cut', sample_size=None, seed=0):
+    """Reduce an (H, W, 3) uint8 array to at most n_colors colors
+
+    Returns (palette, index_map): palette is a list of RGB tuples sorted by
+    brightness like extract_palette, index_map is an (H, W) array of palette
+    indices. With sample_size set, the palette is estimated from that many
+    randomly sampled pixels and every pixel is then mapped to the palette
+    entry nearest its color (or, for sheets with many colors, its coarse
+    bin's centre).
+    """
+    if method not in QUANTIZE_METHODS:
+        raise ValueError(f"Unknown quantization method: {method}")
+    if n_colors < 1:
+        raise ValueError("n_colors must be at least 1")
+    height, width = img_array.shape[:2]
+    keys = pack_colors(img_array.reshape(-1, 3))
+    unique, inverse, counts = unique_colors(keys)
+    colors = unpack_colors(unique)
+
+    if len(unique) <= n_colors:
+        palette = colors.astype(np.float64)
+        labels = np.arange(len(unique), dtype=np.int32)
+    else:
+        fit_colors, fit_weights = colors, counts
+        if sample_size is not None and sample_size < keys.size:
+            rng = np.random.default_rng(seed)
+            sample = keys[rng.integers(0, keys.size, size=sample_size)]
+            sample_unique, _, fit_weights = unique_colors(sample)
+            fit_colors = unpack_colors(sample_unique)
+        if method == 'median_cut':
+            palette, labels = median_cut(fit_colors, fit_weights, n_colors)
+        else:
+            palette, labels = kmeans(fit_colors, fit_weights, n_colors, seed=seed)
+        if fit_colors is not colors:
+            labels = coarse_nearest(colors, palette)
+
+    # Rounding can merge entries; keep one slot per color
+    palette, merged = np.unique(np.clip(np.rint(palette), 0, 255).astype(np.uint8), axis=0, return_inverse=True)
+    labels = merged.ravel()[labels]
+    # Drop unused entries and order by brightness
+    used = np.unique(labels)
+    order = used[np.argsort(palette[used].astype(np.int32).sum(axis=1), kind='stable')]
+    remap = np.zeros(len(palette), dtype=np.int32)
+    remap[order] = np.arange(len(order), dtype=np.int32)
+    index_map = remap[labels][inverse].reshape(height, width)
+    return [tuple(int(c) for c in color) for color in palette[order]], index_map
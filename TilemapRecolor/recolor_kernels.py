@@ -0,0 +1,188 @@
+import logging
+import threading
+
+import numpy as np
+
+from color_utils import DENSE_UNIQUE_THRESHOLD, pack_colors, unpack_colors, unique_colors
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ('numpy', 'numba')
+
+# numba's parallel kernels must not be launched from several threads at once
+# (GUI workers, service pool); their calls are serialized, each one already
+# uses every core
+_parallel_lock = threading.Lock()
+if numba is not None:
+    # Start the threading layer on the importing (main) thread: TBB first
+    # started from a worker thread hangs interpreter exit
+    numba.get_num_threads()
+
+
+def available_backends():
+    return [name for name in BACKENDS if name == 'numpy' or numba is not None]
+
+
+def resolve_backend(backend='auto'):
+    """Pick 'numba' when installed for 'auto', otherwise validate the name"""
+    if backend == 'auto':
+        return 'numba' if numba is not None else 'numpy'
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    if backend == 'numba' and numba is None:
+        logging.warning("numba is not installed, falling back to the numpy backend")
+        return 'numpy'
+    return backend
+
+
+def _mapping_arrays(color_mapping):
+    """Sorted packed source keys and the matching target colors"""
+    if not color_mapping:
+        return np.empty(0, dtype=np.uint32), np.empty((0, 3), dtype=np.uint8)
+    src = pack_colors(np.array(list(color_mapping.keys()), dtype=np.uint8).reshape(-1, 3))
+    dst = np.array(list(color_mapping.values()), dtype=np.uint8).reshape(-1, 3)
+    order = np.argsort(src, kind='stable')
+    return src[order], dst[order]
+
+
+def recolor(img_array, color_mapping, backend='auto'):
+    """Return a copy of an (H, W, 3) uint8 array with colors replaced per mapping"""
+    img_array = np.ascontiguousarray(img_array, dtype=np.uint8)
+    src, dst = _mapping_arrays(color_mapping)
+    if len(src) == 0:
+        return img_array.copy()
+    if resolve_backend(backend) == 'numba':
+        out = np.empty_like(img_array)
+        with _parallel_lock:
+            _recolor_numba(img_array.reshape(-1, 3), src, dst, out.reshape(-1, 3))
+        return out
+    keys = pack_colors(img_array)
+    pos = np.minimum(np.searchsorted(src, keys), len(src) - 1)
+    matched = src[pos] == keys
+    out = img_array.copy()
+    out[matched] = dst[pos[matched]]
+    return out
+
+
+def count_colors(img_array, backend='auto'):
+    """Unique colors of an (H, W, 3) array as ((U, 3) uint8, (U,) counts), sorted by packed value"""
+    flat = np.ascontiguousarray(img_array, dtype=np.uint8).reshape(-1, 3)
+    if resolve_backend(backend) == 'numba':
+        keys, counts = _count_numba(flat)
+    else:
+        keys, _, counts = unique_colors(pack_colors(flat))
+    return unpack_colors(keys), counts.astype(np.int64)
+
+
+def remap(index_map, lut, backend='auto'):
+    """Gather lut[index_map] into a new (H, W, C) array"""
+    index_map = np.ascontiguousarray(index_map)
+    lut = np.ascontiguousarray(lut)
+    if resolve_backend(backend) == 'numba':
+        out = np.empty(index_map.shape + lut.shape[1:], dtype=lut.dtype)
+        with _parallel_lock:
+            _remap_numba(index_map.reshape(-1), lut.reshape(len(lut), -1), out.reshape(index_map.size, -1))
+        return out
+    return lut[index_map]
+
+
+if numba is not None:
+    # Single pass kernels: no packed-key, mask or index temporaries the size
+    # of the image, apart from the key buffer count needs for sorting small
+    # inputs (large ones use a dense histogram like unique_colors).
+
+    @numba.njit(cache=True, nogil=True, parallel=True)
+    def _recolor_numba(pixels, src, dst, out):
+        n = len(src)
+        for i in numba.prange(pixels.shape[0]):
+            key = (np.uint32(pixels[i, 0]) << 16) | (np.uint32(pixels[i, 1]) << 8) | np.uint32(pixels[i, 2])
+            lo, hi = 0, n
+            while lo < hi:
+                mid = (lo + hi) >> 1
+                if src[mid] < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo < n and src[lo] == key:
+                out[i, 0] = dst[lo, 0]
+                out[i, 1] = dst[lo, 1]
+                out[i, 2] = dst[lo, 2]
+            else:
+                out[i, 0] = pixels[i, 0]
+                out[i, 1] = pixels[i, 1]
+                out[i, 2] = pixels[i, 2]
+
+    @numba.njit(cache=True, nogil=True)
+    def _count_numba(pixels):
+        n = pixels.shape[0]
+        if n >= DENSE_UNIQUE_THRESHOLD:
+            histogram = np.zeros(1 << 24, dtype=np.uint32)
+            for i in range(n):
+                histogram[(np.uint32(pixels[i, 0]) << 16) | (np.uint32(pixels[i, 1]) << 8) | np.uint32(pixels[i, 2])] += 1
+            unique = np.flatnonzero(histogram).astype(np.uint32)
+            counts = np.empty(len(unique), dtype=np.int64)
+            for u in range(len(unique)):
+                counts[u] = histogram[unique[u]]
+            return unique, counts
+        keys = np.empty(n, dtype=np.uint32)
+        for i in range(n):
+            keys[i] = (np.uint32(pixels[i, 0]) << 16) | (np.uint32(pixels[i, 1]) << 8) | np.uint32(pixels[i, 2])
+        keys.sort()
+        unique = np.empty(n, dtype=np.uint32)
+        counts = np.empty(n, dtype=np.int64)
+        u = -1
+        for i in range(n):
+            if u < 0 or keys[i] != unique[u]:
+                u += 1
+                unique[u] = keys[i]
+                counts[u] = 0
+            counts[u] += 1
+        return unique[:u + 1].copy(), counts[:u + 1].copy()
+
+    @numba.njit(cache=True, nogil=True, parallel=True)
+    def _remap_numba(indices, lut, out):
+        channels = lut.shape[1]
+        for i in numba.prange(indices.shape[0]):
+            entry = indices[i]
+            for c in range(channels):
+                out[i, c] = lut[entry, c]
+
+
+def verify_backends(sizes=((257, 311), (1031, 1031)), colors=40, seed=0):
+    """Check that every installed backend matches the numpy backend exactly
+
+    The default sizes cover both the sorting and the dense histogram paths.
+    Returns a list of mismatch descriptions; empty means all backends agree.
+    """
+    rng = np.random.default_rng(seed)
+    problems = []
+    for size in sizes:
+        base = rng.integers(0, 256, size=(colors, 3), dtype=np.uint8)
+        img = base[rng.integers(0, colors, size=size)]
+        mapping = {tuple(int(v) for v in c): tuple(int(v) for v in rng.integers(0, 256, 3)) for c in base[::2]}
+        index_map = rng.integers(0, colors, size=size).astype(np.int32)
+        reference = (recolor(img, mapping, 'numpy'), count_colors(img, 'numpy'), remap(index_map, base, 'numpy'))
+        for backend in available_backends():
+            if backend == 'numpy':
+                continue
+            recolored = recolor(img, mapping, backend)
+            counted, counts = count_colors(img, backend)
+            remapped = remap(index_map, base, backend)
+            if not np.array_equal(recolored, reference[0]):
+                problems.append(f"{backend} {size}: recolor differs")
+            if not (np.array_equal(counted, reference[1][0]) and np.array_equal(counts, reference[1][1])):
+                problems.append(f"{backend} {size}: count_colors differs")
+            if not np.array_equal(remapped, reference[2]):
+                problems.append(f"{backend} {size}: remap differs")
+    return problems
+
+
+if __name__ == '__main__':
+    problems = verify_backends()
+    print(f"Backends checked: {', '.join(available_backends())}")
+    for problem in problems:
+        print(problem)
+    raise SystemExit(1 if problems else 0)
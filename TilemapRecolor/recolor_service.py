@@ -0,0 +1,417 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+import recolor_kernels
+from palette_config import SpritePaletteConfig
+from palette_lut import build_palette_lut
+from profiling import Profiler
+
+# Only the loopback interface is served; the API reads and writes local paths
+HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 64 << 20
+TOKEN_HEADER = 'X-Recolor-Token'
+
+
+class RequestError(Exception):
+    """A bad request; the message is sent back with a 400"""
+
+
+class LRUCache:
+    """Thread-safe LRU dict with hit and miss counters"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def _is_channel(value):
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 255
+
+
+def parse_mapping(pairs):
+    """{source: target} RGB tuples from [[[r, g, b], [r, g, b]], ...]; raises RequestError"""
+    error = RequestError("mapping must be a list of [[r, g, b], [r, g, b]] pairs with channels in 0..255")
+    if not isinstance(pairs, list):
+        raise error
+    mapping = {}
+    for pair in pairs:
+        if not isinstance(pair, list) or len(pair) != 2:
+            raise error
+        for color in pair:
+            if not isinstance(color, list) or len(color) != 3 or not all(_is_channel(c) for c in color):
+                raise error
+        mapping[tuple(pair[0])] = tuple(pair[1])
+    return mapping
+
+
+def parse_compress_level(value):
+    if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= 9:
+        raise RequestError(f"compress_level must be an integer in 0..9, got {value!r}")
+    return value
+
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def encode_png(img_array, compress_level=1):
+    buffer = io.BytesIO()
+    Image.fromarray(img_array).save(buffer, format='PNG', compress_level=compress_level)
+    return buffer.getvalue()
+
+
+class RecolorService:
+    """Recolors sheets for API requests on a worker pool
+
+    Decoded sheets are cached by path and file signature (or by the hash of
+    uploaded bytes), and config recolors cache the index map and LUT built
+    for each (sheet, config) pair, so repeated requests only pay for the
+    final gather. Every path a request names must lie inside root.
+    """
+
+    def __init__(self, workers=None, cache_size=32, backend='numpy', root='.'):
+        # recolor_kernels serializes numba's parallel kernels across threads
+        self.backend = recolor_kernels.resolve_backend(backend)
+        self.root = os.path.realpath(root)
+        self.executor = ThreadPoolExecutor(max_workers=workers or max(2, (os.cpu_count() or 2) // 2))
+        self.sheets = LRUCache(cache_size)
+        self.index_maps = LRUCache(cache_size)
+        self.profiler = Profiler(enabled=True)
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.pixels = 0
+
+    def resolve_path(self, path):
+        """Real path of a request path, relative paths taken from root; outside root is an error"""
+        if not isinstance(path, str):
+            raise RequestError(f"Path must be a string, got {path!r}")
+        resolved = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([self.root, resolved]) != self.root:
+            raise RequestError(f"Path {path} is outside the service root")
+        return resolved
+
+    def sheet(self, request):
+        """(cache key, (H, W, 3) array) for the request's image or path"""
+        if 'image' in request:
+            if not isinstance(request['image'], str):
+                raise RequestError("image must be a base64 string")
+            try:
+                data = base64.b64decode(request['image'], validate=True)
+            except ValueError as e:
+                raise RequestError(f"image is not valid base64: {str(e)}")
+            key = ('bytes', _digest(data))
+            source = io.BytesIO(data)
+        elif 'path' in request:
+            path = self.resolve_path(request['path'])
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                raise RequestError(f"Cannot read {path}: {str(e)}")
+            key = ('path', path, stat.st_mtime_ns, stat.st_size)
+            source = path
+        else:
+            raise RequestError("Request needs an image (base64) or a path")
+        img_array = self.sheets.get(key)
+        if img_array is None:
+            with self.profiler.span('decode'):
+                try:
+                    with Image.open(source) as image:
+                        img_array = np.array(image.convert('RGB'))
+                except (OSError, Image.DecompressionBombError) as e:
+                    raise RequestError(f"Cannot decode image: {str(e)}")
+            img_array.flags.writeable = False
+            self.sheets.put(key, img_array)
+        return key, img_array
+
+    def config(self, request):
+        """(cache key, loader) for an inline config or a config_path
+
+        The key comes from the config's digest or the file signature alone;
+        loader() parses the SpritePaletteConfig and is only called on a miss.
+        """
+        if 'config' in request:
+            config_data = request['config']
+            key = ('inline', _digest(json.dumps(config_data, sort_keys=True).encode('utf-8')))
+
+            def load():
+                try:
+                    return SpritePaletteConfig.from_dict(config_data)
+                except (KeyError, TypeError, ValueError) as e:
+                    raise RequestError(f"Invalid config: {str(e)}")
+            return key, load
+        path = self.resolve_path(request['config_path'])
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            raise RequestError(f"Cannot load config {path}: {str(e)}")
+
+        def load():
+            try:
+                return SpritePaletteConfig.load_from_file(path)
+            except (OSError, KeyError, ValueError) as e:
+                raise RequestError(f"Cannot load config {path}: {str(e)}")
+        return ('path', path, stat.st_mtime_ns, stat.st_size), load
+
+    def recolor(self, request):
+        """Handle one /recolor request body; runs on the worker pool"""
+        compress_level = parse_compress_level(request.get('compress_level', 1))
+        mapping = parse_mapping(request['mapping']) if 'mapping' in request else None
+        output_path = self.resolve_path(request['output_path']) if 'output_path' in request else None
+        if output_path is not None and not os.path.isdir(os.path.dirname(output_path)):
+            raise RequestError(f"Output directory {os.path.dirname(output_path)} does not exist")
+        sheet_key, img_array = self.sheet(request)
+        if mapping is not None:
+            with self.profiler.span('recolor_mapping'):
+                result = recolor_kernels.recolor(img_array, mapping, self.backend)
+        elif 'config' in request or 'config_path' in request:
+            if 'palette' not in request:
+                raise RequestError("A config recolor needs a palette name")
+            config_key, load_config = self.config(request)
+            key = (sheet_key, config_key)
+            palette_lut = self.index_maps.get(key)
+            if palette_lut is None:
+                with self.profiler.span('config'):
+                    config = load_config()
+                with self.profiler.span('index_map'):
+                    try:
+                        palette_lut = build_palette_lut(img_array, config)
+                    except ValueError as e:
+                        raise RequestError(str(e))
+                self.index_maps.put(key, palette_lut)
+            if request['palette'] not in palette_lut.row_names:
+                raise RequestError(f"Config has no palette named {request['palette']}")
+            with self.profiler.span('recolor_config'):
+                result = palette_lut.render(request['palette'])
+        else:
+            raise RequestError("Request needs a mapping, a config or a config_path")
+
+        with self._lock:
+            self.pixels += result.shape[0] * result.shape[1]
+        with self.profiler.span('encode'):
+            png = encode_png(result, compress_level)
+        if output_path is not None:
+            try:
+                fd, temp_path = tempfile.mkstemp(suffix='.part', dir=os.path.dirname(output_path))
+            except OSError as e:
+                raise RequestError(f"Cannot write {output_path}: {str(e)}")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(png)
+                os.replace(temp_path, output_path)
+            except BaseException as e:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                if isinstance(e, OSError):
+                    raise RequestError(f"Cannot write {output_path}: {str(e)}")
+                raise
+            return {"path": output_path, "width": result.shape[1], "height": result.shape[0]}
+        return {"image": base64.b64encode(png).decode('ascii'), "width": result.shape[1], "height": result.shape[0]}
+
+    def submit(self, request):
+        """Run a /recolor request on the pool and wait for it"""
+        return self.executor.submit(self.recolor, request).result()
+
+    def count_request(self, failed=False):
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+
+    def stats(self):
+        uptime = time.time() - self.started
+        with self._lock:
+            requests, errors, pixels = self.requests, self.errors, self.pixels
+        return {
+            "uptime_s": uptime,
+            "requests": requests,
+            "errors": errors,
+            "requests_per_s": requests / uptime if uptime > 0 else 0.0,
+            "megapixels": pixels / 1e6,
+            "megapixels_per_s": pixels / 1e6 / uptime if uptime > 0 else 0.0,
+            "backend": self.backend,
+            "cache": {"sheets": self.sheets.stats(), "index_maps": self.index_maps.stats()},
+            "latency": self.profiler.stats()
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class RecolorRequestHandler(BaseHTTPRequestHandler):
+    service: RecolorService = None  # set by make_server
+    token: str = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        """Check the shared token header; sends a 401 and returns False when it does not match"""
+        given = self.headers.get(TOKEN_HEADER, '')
+        if self.token and hmac.compare_digest(given.encode('utf-8'), self.token.encode('utf-8')):
+            return True
+        self.send_json(401, {"error": f"Missing or wrong {TOKEN_HEADER} header"})
+        return False
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {"status": "ok"})
+        elif not self.authorized():
+            return
+        elif self.path == '/stats':
+            self.send_json(200, self.service.stats())
+        else:
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/recolor':
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        if not self.authorized():
+            self.close_connection = True
+            return
+        # Browsers may send text/plain and form posts cross-origin without a
+        # preflight; only a JSON content type is accepted
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            self.send_json(415, {"error": "Content-Type must be application/json"})
+            self.close_connection = True
+            return
+        # rfile.read would block on a negative length, so the header is checked first
+        header = self.headers.get('Content-Length')
+        if header is None:
+            self.send_json(411, {"error": "Content-Length header is required"})
+            self.close_connection = True
+            return
+        try:
+            length = int(header)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_json(400, {"error": f"Content-Length must be a non-negative integer, got {header!r}"})
+            self.close_connection = True
+            return
+        start = time.perf_counter()
+        try:
+            if length > MAX_BODY_BYTES:
+                self.send_json(413, {"error": f"Request body over {MAX_BODY_BYTES} bytes"})
+                self.close_connection = True
+                return
+            try:
+                request = json.loads(self.rfile.read(length))
+            except ValueError as e:
+                raise RequestError(f"Body is not valid JSON: {str(e)}")
+            if not isinstance(request, dict):
+                raise RequestError("Body must be a JSON object")
+            response = self.service.submit(request)
+        except RequestError as e:
+            self.service.count_request(failed=True)
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            logging.error("Recolor request failed", exc_info=True)
+            self.service.count_request(failed=True)
+            self.send_json(500, {"error": str(e)})
+            return
+        elapsed = time.perf_counter() - start
+        self.service.profiler.record('request', start, elapsed)
+        self.service.count_request()
+        response["elapsed_ms"] = elapsed * 1000.0
+        self.send_json(200, response)
+
+
+def make_server(service, token, port=DEFAULT_PORT):
+    """ThreadingHTTPServer on the loopback interface; port 0 picks a free port
+
+    Requests other than /health must send token in the X-Recolor-Token header.
+    """
+    if not token:
+        raise ValueError("The service needs a non-empty token")
+    handler = type('Handler', (RecolorRequestHandler,), {'service': service, 'token': token})
+    server = ThreadingHTTPServer((HOST, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Serve recolors over a local HTTP/JSON API')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, help='recolor worker threads')
+    parser.add_argument('--cache', type=int, default=32, help='decoded sheets and index maps kept in memory')
+    parser.add_argument('--backend', default='numpy', choices=('auto',) + recolor_kernels.BACKENDS)
+    parser.add_argument('--root', default='.', help='directory that request paths must stay inside')
+    parser.add_argument('--token', help=f'shared secret for the {TOKEN_HEADER} header (default: RECOLOR_TOKEN or a random one)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    token = args.token or os.environ.get('RECOLOR_TOKEN') or secrets.token_urlsafe(24)
+    service = RecolorService(args.workers, args.cache, args.backend, args.root)
+    server = make_server(service, token, args.port)
+    logging.info(f"Recolor service listening on http://{HOST}:{server.server_address[1]}, root {service.root}")
+    if not (args.token or os.environ.get('RECOLOR_TOKEN')):
+        print(f"{TOKEN_HEADER}: {token}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
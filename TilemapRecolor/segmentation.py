@@ -0,0 +1,212 @@
+import argparse
+import sys
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from color_utils import pack_colors, unique_colors
+from palette_config import SpritePaletteConfig
+from quantize import quantize_array
+
+SEGMENT_MODES = ('background', 'color')
+
+
+@dataclass
+class SectionProposal:
+    name: str
+    x: int
+    y: int
+    width: int
+    height: int
+    area: int  # pixels in the component
+    mask: Optional[np.ndarray] = None  # (height, width) bool, the component inside its box
+
+
+def border_color(img_array):
+    """Most common color along the image border, the usual sheet background"""
+    border = np.concatenate([img_array[0], img_array[-1], img_array[:, 0], img_array[:, -1]])
+    unique, _, counts = unique_colors(pack_colors(border))
+    key = int(unique[np.argmax(counts)])
+    return key >> 16 & 0xFF, key >> 8 & 0xFF, key & 0xFF
+
+
+def dilate(mask, radius):
+    """Square dilation of a bool mask by radius pixels with shifted ORs"""
+    out = mask.copy()
+    for _ in range(radius):
+        grown = out.copy()
+        grown[1:] |= out[:-1]
+        grown[:-1] |= out[1:]
+        grown[:, 1:] |= grown[:, :-1].copy()
+        grown[:, :-1] |= grown[:, 1:].copy()
+        out = grown
+    return out
+
+
+def row_runs(classes):
+    """Horizontal runs of equal non-negative class values
+
+    Returns (run_map, count) where run_map holds the run id of every pixel
+    and -1 for background.
+    """
+    foreground = classes >= 0
+    starts = foreground.copy()
+    starts[:, 1:] &= classes[:, 1:] != classes[:, :-1]
+    run_map = np.cumsum(starts.ravel()).reshape(classes.shape) - 1
+    run_map[~foreground] = -1
+    return run_map, int(starts.sum())
+
+
+def union_components(count, a, b):
+    """Component id of every node of an undirected graph given as edge arrays
+
+    Vectorized hook-and-jump union-find: each round hooks every edge's
+    larger root under the smaller one, then compresses paths by pointer
+    jumping, so the number of rounds grows with log of the component size.
+    """
+    parent = np.arange(count)
+    while len(a):
+        ra, rb = parent[a], parent[b]
+        active = ra != rb
+        if not active.any():
+            break
+        a, b, ra, rb = a[active], b[active], ra[active], rb[active]
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+    return parent
+
+
+def label_components(classes, connectivity=8):
+    """Label connected regions of equal class; negative classes are background
+
+    Returns (labels, count) with labels 1..count and 0 for background.
+    Pixels are first grouped into horizontal runs, so the union-find works
+    on runs rather than single pixels.
+    """
+    classes = np.asarray(classes)
+    run_map, run_count = row_runs(classes)
+    if not run_count:
+        return np.zeros(classes.shape, dtype=np.int32), 0
+    upper, lower = run_map[:-1], run_map[1:]
+    same = classes[:-1] == classes[1:]
+    pairs = [(upper[same & (upper >= 0)], lower[same & (upper >= 0)])]
+    if connectivity == 8:
+        for du, dl, dsame in ((upper[:, :-1], lower[:, 1:], classes[:-1, :-1] == classes[1:, 1:]),
+                              (upper[:, 1:], lower[:, :-1], classes[:-1, 1:] == classes[1:, :-1])):
+            selected = dsame & (du >= 0)
+            pairs.append((du[selected], dl[selected]))
+    elif connectivity != 4:
+        raise ValueError(f"Connectivity must be 4 or 8, got {connectivity}")
+    a = np.concatenate([p[0] for p in pairs])
+    b = np.concatenate([p[1] for p in pairs])
+    roots = union_components(run_count, a, b)
+    _, run_labels = np.unique(roots, return_inverse=True)
+    count = int(run_labels.max()) + 1
+    lookup = np.concatenate([[0], run_labels.astype(np.int32) + 1])
+    return lookup[run_map + 1], count
+
+
+def component_boxes(labels, count):
+    """(count, 4) x0, y0, x1, y1 boxes and (count,) areas of labels 1..count"""
+    ys, xs = np.nonzero(labels)
+    ids = labels[ys, xs] - 1
+    boxes = np.empty((count, 4), dtype=np.int64)
+    boxes[:, :2] = np.iinfo(np.int64).max
+    boxes[:, 2:] = -1
+    np.minimum.at(boxes[:, 0], ids, xs)
+    np.minimum.at(boxes[:, 1], ids, ys)
+    np.maximum.at(boxes[:, 2], ids, xs + 1)
+    np.maximum.at(boxes[:, 3], ids, ys + 1)
+    return boxes, np.bincount(ids, minlength=count)
+
+
+def segment_classes(img_array, mode='background', background=None, clusters=8):
+    """Per-pixel class map for label_components: -1 for background
+
+    'background' makes every non-background pixel one class; 'color'
+    quantizes the sheet to clusters colors and keeps each cluster apart.
+    background defaults to the most common border color.
+    """
+    if mode not in SEGMENT_MODES:
+        raise ValueError(f"Unknown segmentation mode: {mode}")
+    background = border_color(img_array) if background is None else tuple(background)
+    is_background = pack_colors(img_array) == int(pack_colors(np.array(background, dtype=np.uint8)))
+    if mode == 'background':
+        classes = np.zeros(img_array.shape[:2], dtype=np.int32)
+    else:
+        _, index_map = quantize_array(img_array, clusters)
+        classes = index_map.astype(np.int32)
+    classes[is_background] = -1
+    return classes
+
+
+def segment(img_array, mode='background', background=None, clusters=8, connectivity=8,
+            min_area=4, gap=0, masks=False, prefix='section'):
+    """Propose one section per connected region of a sheet
+
+    gap > 0 joins pieces that are at most that many pixels apart (e.g. a
+    sprite's detached weapon) by labeling a dilated mask; boxes and masks
+    still cover only the original pixels. Components smaller than
+    min_area pixels are dropped. Proposals are ordered top to bottom,
+    left to right.
+    """
+    img_array = np.asarray(img_array)
+    classes = segment_classes(img_array, mode, background, clusters)
+    if gap > 0:
+        if mode != 'background':
+            raise ValueError("gap is only supported in background mode")
+        joined = np.where(dilate(classes >= 0, gap), 0, -1)
+        labels, count = label_components(joined, connectivity)
+        labels[classes < 0] = 0
+    else:
+        labels, count = label_components(classes, connectivity)
+    if not count:
+        return []
+    boxes, areas = component_boxes(labels, count)
+    keep = np.flatnonzero(areas >= max(1, min_area))
+    keep = keep[np.lexsort((boxes[keep, 0], boxes[keep, 1]))]
+    proposals = []
+    for i, component in enumerate(keep):
+        x0, y0, x1, y1 = (int(v) for v in boxes[component])
+        mask = labels[y0:y1, x0:x1] == component + 1 if masks else None
+        proposals.append(SectionProposal(f"{prefix}_{i}", x0, y0, x1 - x0, y1 - y0, int(areas[component]), mask))
+    return proposals
+
+
+def proposals_to_config(proposals, config=None):
+    """Add proposals as sections to a (new) SpritePaletteConfig; proposals with a mask become mask sections"""
+    config = config if config is not None else SpritePaletteConfig()
+    for proposal in proposals:
+        config.add_section(proposal.name, proposal.x, proposal.y, proposal.width, proposal.height,
+                           mask=proposal.mask)
+    return config
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Propose palette config sections from the connected regions of a sheet')
+    parser.add_argument('sheet', help='sprite sheet to segment')
+    parser.add_argument('--out', required=True, help='palette config to write (.json or .palcfg)')
+    parser.add_argument('--mode', default='background', choices=SEGMENT_MODES)
+    parser.add_argument('--clusters', type=int, default=8, help='color clusters in color mode')
+    parser.add_argument('--min-area', type=int, default=4, help='drop regions with fewer pixels')
+    parser.add_argument('--gap', type=int, default=0, help='join regions at most this many pixels apart')
+    parser.add_argument('--connectivity', type=int, default=8, choices=(4, 8))
+    parser.add_argument('--masks', action='store_true', help='store pixel masks, not just bounding boxes')
+    args = parser.parse_args(argv)
+
+    img_array = np.array(Image.open(args.sheet).convert('RGB'))
+    proposals = segment(img_array, args.mode, clusters=args.clusters, connectivity=args.connectivity,
+                        min_area=args.min_area, gap=args.gap, masks=args.masks)
+    proposals_to_config(proposals).save_to_file(args.out)
+    print(f"{len(proposals)} sections written to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from color_utils import pack_colors, unpack_colors, unique_colors
+
+# Below this many distinct tile color sets extra processes cost more than they save
+PARALLEL_MIN_SETS = 64
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+@dataclass
+class PackResult:
+    palettes: List[List[Tuple[int, int, int]]]  # each padded to colors_per_palette
+    tile_palettes: np.ndarray  # (rows, columns) sub-palette index per tile
+    index_sheet: np.ndarray  # (H, W) uint8 color index 0..colors_per_palette-1
+    palette_limit: int
+    tile_size: int = 8
+
+    @property
+    def fits(self):
+        return len(self.palettes) <= self.palette_limit
+
+    def to_4bpp(self):
+        """Pack the index sheet as 4bpp tile data (row-major tiles, low nibble first)"""
+        if self.index_sheet.max(initial=0) > 15:
+            raise ValueError("Index sheet does not fit in 4 bits per pixel")
+        size = self.tile_size
+        rows, columns = self.tile_palettes.shape
+        tiles = self.index_sheet.reshape(rows, size, columns, size).swapaxes(1, 2).reshape(-1, size * size)
+        return (tiles[:, 0::2] | (tiles[:, 1::2] << 4)).astype(np.uint8).tobytes()
+
+    def save(self, index_path, palette_path, tiles_path=None):
+        """Write the index sheet (grayscale), the sub-palettes (one row each) and optional 4bpp tiles"""
+        Image.fromarray(self.index_sheet, 'L').save(index_path)
+        Image.fromarray(np.array(self.palettes, dtype=np.uint8), 'RGB').save(palette_path)
+        if tiles_path:
+            with open(tiles_path, 'wb') as f:
+                f.write(self.to_4bpp())
+
+
+def tile_color_sets(img_array, tile_size=8, transparent=None):
+    """Color set of every tile as a bitset over the sheet's colors
+
+    Returns (colors, tile_sets, inverse) where colors is the (C, 3) array of
+    opaque colors, tile_sets a list of Python int bitsets (bit i = colors[i])
+    in row-major tile order and inverse the per-pixel color id (-1 for the
+    transparent color).
+    """
+    height, width = img_array.shape[:2]
+    if height % tile_size or width % tile_size:
+        raise ValueError(f"Sheet size {width}x{height} is not a multiple of {tile_size}")
+    keys = pack_colors(img_array)
+    unique, inverse, _ = unique_colors(keys)
+    inverse = inverse.reshape(height, width).astype(np.int64)
+    if transparent is not None:
+        transparent_key = int(pack_colors(np.array(transparent, dtype=np.uint8)))
+        hit = np.flatnonzero(unique == transparent_key)
+        if len(hit):
+            # Drop the transparent color and shift the ids above it down
+            inverse = np.where(inverse == hit[0], -1, inverse - (inverse > hit[0]))
+            unique = np.delete(unique, hit[0])
+    rows, columns = height // tile_size, width // tile_size
+    tile_ids = (np.arange(rows)[:, None, None, None] * columns
+                + np.arange(columns)[None, None, :, None])
+    tile_ids = np.broadcast_to(tile_ids, (rows, tile_size, columns, tile_size)).reshape(height, width)
+    present = np.zeros((rows * columns, max(1, len(unique))), dtype=bool)
+    opaque = inverse >= 0
+    present[tile_ids[opaque], inverse[opaque]] = True
+    packed = np.packbits(present, axis=1, bitorder='little')
+    tile_sets = [int.from_bytes(row.tobytes(), 'little') for row in packed]
+    return unpack_colors(unique), tile_sets, inverse
+
+
+def _greedy_pack(sets, capacity, order):
+    palettes = []
+    assignment = {}
+    for s in order:
+        best, best_cost = None, None
+        for i, palette in enumerate(palettes):
+            union = palette | sets[s]
+            size = _popcount(union)
+            if size > capacity:
+                continue
+            cost = (size - _popcount(palette), size)
+            if best_cost is None or cost < best_cost:
+                best, best_cost = i, cost
+        if best is None:
+            palettes.append(sets[s])
+            best = len(palettes) - 1
+        else:
+            palettes[best] |= sets[s]
+        assignment[s] = best
+    return palettes, assignment
+
+
+def _rebuild(sets, assignment, count):
+    palettes = [0] * count
+    for s, p in assignment.items():
+        palettes[p] |= sets[s]
+    return palettes
+
+
+def _eliminate_palettes(sets, capacity, palettes, assignment):
+    """Local search: try to empty the smallest palettes into the others"""
+    improved = True
+    while improved and len(palettes) > 1:
+        improved = False
+        members = [[] for _ in palettes]
+        for s, p in assignment.items():
+            members[p].append(s)
+        for victim in sorted(range(len(palettes)), key=lambda p: (len(members[p]), _popcount(palettes[p]))):
+            trial = list(palettes)
+            trial[victim] = 0
+            moved = {}
+            for s in sorted(members[victim], key=lambda s: -_popcount(sets[s])):
+                best, best_cost = None, None
+                for i, palette in enumerate(trial):
+                    if i == victim:
+                        continue
+                    size = _popcount(palette | sets[s])
+                    if size <= capacity and (best_cost is None or size - _popcount(palette) < best_cost):
+                        best, best_cost = i, size - _popcount(palette)
+                if best is None:
+                    break
+                trial[best] |= sets[s]
+                moved[s] = best
+            else:
+                for s, p in moved.items():
+                    assignment[s] = p
+                # Renumber palettes without the emptied one
+                remap = {old: new for new, old in enumerate(i for i in range(len(palettes)) if i != victim)}
+                for s in assignment:
+                    assignment[s] = remap[assignment[s]]
+                palettes = _rebuild(sets, assignment, len(palettes) - 1)
+                improved = True
+                break
+    return palettes, assignment
+
+
+def _solve(sets, capacity, seed):
+    """One greedy-merge plus local-search run; seed 0 is the deterministic order"""
+    order = sorted(range(len(sets)), key=lambda s: -_popcount(sets[s]))
+    if seed:
+        rng = random.Random(seed)
+        # Keep large sets early but shuffle within similar sizes
+        order.sort(key=lambda s: -_popcount(sets[s]) + rng.random() * 3)
+    palettes, assignment = _greedy_pack(sets, capacity, order)
+    palettes, assignment = _eliminate_palettes(sets, capacity, palettes, assignment)
+    return palettes, assignment
+
+
+def pack_subpalettes(img_array, colors_per_palette=16, max_palettes=16, tile_size=8,
+                     transparent=None, restarts=None, workers=None):
+    """Assign every tile to a sub-palette of at most colors_per_palette colors
+
+    When transparent is given, slot 0 of every sub-palette is reserved for it
+    and pixels of that color get index 0. Several randomized restarts run on
+    separate processes and the solution with the fewest sub-palettes (then
+    fewest colors) wins.
+    """
+    capacity = colors_per_palette - (1 if transparent is not None else 0)
+    colors, tile_sets, inverse = tile_color_sets(img_array, tile_size, transparent)
+    too_big = [i for i, bits in enumerate(tile_sets) if _popcount(bits) > capacity]
+    if too_big:
+        columns = img_array.shape[1] // tile_size
+        where = ', '.join(f"({i % columns}, {i // columns})" for i in too_big[:5])
+        raise ValueError(f"{len(too_big)} tiles use more than {capacity} colors, e.g. tiles {where}")
+
+    distinct = sorted(set(tile_sets))
+    set_index = {bits: i for i, bits in enumerate(distinct)}
+    workers = workers or os.cpu_count() or 1
+    restarts = restarts if restarts is not None else max(4, workers)
+    seeds = list(range(restarts))
+    if workers > 1 and len(distinct) >= PARALLEL_MIN_SETS:
+        with ProcessPoolExecutor(max_workers=min(workers, restarts)) as pool:
+            solutions = list(pool.map(_solve, [distinct] * restarts, [capacity] * restarts, seeds))
+    else:
+        solutions = [_solve(distinct, capacity, seed) for seed in seeds]
+    palettes, assignment = min(solutions, key=lambda sol: (len(sol[0]), sum(_popcount(p) for p in sol[0])))
+
+    # Slot tables: global color id -> index within its sub-palette
+    slot_table = np.zeros((len(palettes), max(1, len(colors))), dtype=np.uint8)
+    sub_palettes = []
+    first_slot = 1 if transparent is not None else 0
+    for p, bits in enumerate(palettes):
+        members = [c for c in range(len(colors)) if bits >> c & 1]
+        slot_table[p, members] = np.arange(first_slot, first_slot + len(members))
+        entries = [tuple(int(v) for v in colors[c]) for c in members]
+        if transparent is not None:
+            entries.insert(0, tuple(transparent))
+        entries += [(0, 0, 0)] * (colors_per_palette - len(entries))
+        sub_palettes.append(entries)
+
+    rows, columns = img_array.shape[0] // tile_size, img_array.shape[1] // tile_size
+    tile_palettes = np.array([assignment[set_index[bits]] for bits in tile_sets], dtype=np.int32).reshape(rows, columns)
+    pixel_palettes = np.repeat(np.repeat(tile_palettes, tile_size, axis=0), tile_size, axis=1)
+    index_sheet = np.where(inverse >= 0, slot_table[pixel_palettes, np.maximum(inverse, 0)], 0).astype(np.uint8)
+    return PackResult(sub_palettes, tile_palettes, index_sheet, max_palettes, tile_size)
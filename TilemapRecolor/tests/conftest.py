@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules live flat in TilemapRecolor/ and import each other by bare name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
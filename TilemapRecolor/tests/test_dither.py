@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from color_utils import nearest_colors, nearest_colors_grid, palette_candidates
+import dither
+from dither import dither_array
+
+
+@pytest.mark.parametrize('palette_size', [1, 5, 64, 300])
+def test_grid_nearest_matches_full_search(palette_size):
+    rng = np.random.default_rng(palette_size)
+    palette = rng.integers(0, 256, size=(palette_size, 3), dtype=np.uint8)
+    colors = rng.random((50000, 3)).astype(np.float32) * 255
+    colors[:10] = [0, 0, 0]
+    colors[10:20] = [255, 255, 255]
+    np.testing.assert_array_equal(nearest_colors_grid(colors, palette), nearest_colors(colors, palette))
+
+
+def test_candidates_cover_duplicate_entries_in_palette_order():
+    palette = np.array([[10, 10, 10], [10, 10, 10], [200, 0, 0]], dtype=np.uint8)
+    table = palette_candidates(palette)
+    assert (table[:, 0] != 1).all()  # the first of two equal entries always comes first
+
+
+@pytest.mark.parametrize('method', ['bayer', 'blue_noise'])
+def test_dither_large_palette_matches_full_search(method, monkeypatch):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, size=(300, 257, 3), dtype=np.uint8)
+    palette = rng.integers(0, 256, size=(96, 3), dtype=np.uint8)
+    index_map, rgb = dither_array(img, palette, method)
+    monkeypatch.setattr(dither, 'GRID_MIN_PALETTE', 1 << 30)
+    reference_map, reference_rgb = dither_array(img, palette, method)
+    np.testing.assert_array_equal(index_map, reference_map)
+    np.testing.assert_array_equal(rgb, reference_rgb)
+    np.testing.assert_array_equal(rgb, palette[index_map])
+
+
+def test_zero_strength_is_plain_nearest():
+    rng = np.random.default_rng(1)
+    img = rng.integers(0, 256, size=(40, 30, 3), dtype=np.uint8)
+    palette = rng.integers(0, 256, size=(12, 3), dtype=np.uint8)
+    index_map, _ = dither_array(img, palette, strength=0.0)
+    np.testing.assert_array_equal(index_map.ravel(), nearest_colors(img.reshape(-1, 3), palette))
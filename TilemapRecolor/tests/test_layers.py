@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from layers import LayerDocument, LayerLockedError
+
+
+def make_document(seed=0):
+    rng = np.random.default_rng(seed)
+    document = LayerDocument.from_rgb(rng.integers(0, 256, size=(21, 17, 3), dtype=np.uint8))
+    document.paint_block(1, 3, 4, rng.integers(0, 256, size=(5, 6, 4), dtype=np.uint8))
+    document.paint(2, 10, 12, (255, 0, 0, 128))
+    return document
+
+
+def reference_composite(document):
+    """Blend the whole stack per pixel in float, like recomposite"""
+    out = np.empty((document.height, document.width, 3), dtype=np.float32)
+    out[:] = document.background
+    for layer in document.layers:
+        if not layer.visible or layer.pixels is None:
+            continue
+        alpha = layer.pixels[..., 3:4].astype(np.float32) * (layer.opacity / 255.0)
+        out += (layer.pixels[..., :3] - out) * alpha
+    return np.rint(out).astype(np.uint8)
+
+
+def test_layers_are_allocated_on_first_paint():
+    document = LayerDocument.from_rgb(np.zeros((4, 5, 3), dtype=np.uint8))
+    assert [layer.pixels is None for layer in document.layers] == [False, True, True, True]
+    assert document.pixel(3, 1, 1) == (0, 0, 0, 0)
+    assert document.paint(3, 1, 1, (1, 2, 3, 255)) == (0, 0, 0, 0)
+    assert document.layers[3].pixels is not None
+
+
+def test_composite_matches_reference_after_edits():
+    document = make_document()
+    document.set_opacity(1, 0.4)
+    document.set_visible(2, False)
+    np.testing.assert_array_equal(document.composite, reference_composite(document))
+
+
+def test_locked_layer_rejects_paint():
+    document = make_document()
+    document.set_locked(1, True)
+    with pytest.raises(LayerLockedError):
+        document.paint(1, 0, 0, (1, 1, 1, 255))
+
+
+def test_save_round_trip_leaves_document_untouched(tmp_path):
+    document = make_document()
+    # Erase everything painted on layer 2: it still has a bbox and a buffer
+    document.paint(2, 10, 12, (0, 0, 0, 0))
+    bboxes = [layer.bbox for layer in document.layers]
+    buffers = [layer.pixels for layer in document.layers]
+    path = str(tmp_path / 'doc.npz')
+    document.save(path)
+    assert [layer.bbox for layer in document.layers] == bboxes
+    assert all(layer.pixels is buffer for layer, buffer in zip(document.layers, buffers))
+
+    loaded = LayerDocument.load(path)
+    np.testing.assert_array_equal(loaded.composite, document.composite)
+    assert loaded.layers[2].bbox is None and loaded.layers[2].pixels is None
+    assert loaded.layers[1].bbox == (3, 4, 9, 9)
+    for layer, original in zip(loaded.layers, document.layers):
+        if layer.pixels is not None:
+            np.testing.assert_array_equal(layer.pixels, original.pixels)
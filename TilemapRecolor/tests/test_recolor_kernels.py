@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import recolor_kernels
+
+# Odd sizes on both sides of DENSE_UNIQUE_THRESHOLD cover the sorting and histogram paths
+SIZES = [(1, 1), (7, 13), (257, 311), (1031, 1031)]
+
+
+def random_sheet(size, colors=40, seed=0):
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, size=(colors, 3), dtype=np.uint8)
+    img = base[rng.integers(0, colors, size=size)]
+    mapping = {tuple(int(v) for v in c): tuple(int(v) for v in rng.integers(0, 256, 3)) for c in base[::2]}
+    index_map = rng.integers(0, colors, size=size).astype(np.int32)
+    return base, img, mapping, index_map
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_numba_matches_numpy(size):
+    pytest.importorskip('numba')
+    base, img, mapping, index_map = random_sheet(size)
+    np.testing.assert_array_equal(recolor_kernels.recolor(img, mapping, 'numba'),
+                                  recolor_kernels.recolor(img, mapping, 'numpy'))
+    for expected, actual in zip(recolor_kernels.count_colors(img, 'numpy'), recolor_kernels.count_colors(img, 'numba')):
+        np.testing.assert_array_equal(actual, expected)
+    np.testing.assert_array_equal(recolor_kernels.remap(index_map, base, 'numba'),
+                                  recolor_kernels.remap(index_map, base, 'numpy'))
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_numpy_backend_matches_reference(size):
+    base, img, mapping, index_map = random_sheet(size, seed=1)
+    expected = img.copy()
+    for source, target in mapping.items():
+        expected[(img == source).all(axis=-1)] = target
+    np.testing.assert_array_equal(recolor_kernels.recolor(img, mapping, 'numpy'), expected)
+    colors, counts = recolor_kernels.count_colors(img, 'numpy')
+    reference, reference_counts = np.unique(img.reshape(-1, 3), axis=0, return_counts=True)
+    np.testing.assert_array_equal(colors, reference)
+    np.testing.assert_array_equal(counts, reference_counts)
+    np.testing.assert_array_equal(recolor_kernels.remap(index_map, base, 'numpy'), base[index_map])
+
+
+def test_empty_mapping_returns_copy():
+    _, img, _, _ = random_sheet((5, 9))
+    out = recolor_kernels.recolor(img, {}, 'numpy')
+    np.testing.assert_array_equal(out, img)
+    assert out is not img
+
+
+def test_numba_falls_back_to_numpy_when_missing(monkeypatch):
+    monkeypatch.setattr(recolor_kernels, 'numba', None)
+    assert recolor_kernels.resolve_backend('numba') == 'numpy'
+    assert recolor_kernels.resolve_backend('auto') == 'numpy'
+    assert recolor_kernels.available_backends() == ['numpy']
+    base, img, mapping, index_map = random_sheet((33, 17))
+    np.testing.assert_array_equal(recolor_kernels.recolor(img, mapping, 'numba'),
+                                  recolor_kernels.recolor(img, mapping, 'numpy'))
+    np.testing.assert_array_equal(recolor_kernels.remap(index_map, base, 'numba'), base[index_map])
+    assert recolor_kernels.verify_backends(sizes=((9, 11),)) == []
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        recolor_kernels.resolve_backend('cuda')
@@ -0,0 +1,115 @@
+import base64
+import http.client
+import io
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from palette_config import SpritePaletteConfig
+from recolor_service import RecolorService, RequestError, TOKEN_HEADER, make_server
+
+TOKEN = 'test-token'
+
+
+@pytest.fixture(scope='module')
+def service(tmp_path_factory):
+    service = RecolorService(workers=2, root=str(tmp_path_factory.mktemp('root')))
+    yield service
+    service.shutdown()
+
+
+@pytest.fixture(scope='module')
+def server(service):
+    server = make_server(service, TOKEN, 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def png_base64(img_array):
+    buffer = io.BytesIO()
+    Image.fromarray(img_array).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def sheet():
+    img = np.zeros((8, 6, 3), dtype=np.uint8)
+    img[:4] = (10, 20, 30)
+    return img
+
+
+def post(server, body, headers=None):
+    """Send a raw POST /recolor; returns (status, decoded JSON)"""
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+    try:
+        connection.putrequest('POST', '/recolor')
+        sent = {'Content-Type': 'application/json', TOKEN_HEADER: TOKEN, 'Content-Length': str(len(body))}
+        sent.update(headers or {})
+        for name, value in sent.items():
+            if value is not None:
+                connection.putheader(name, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_mapping_recolor(server):
+    status, response = post(server, json.dumps({'image': png_base64(sheet()),
+                                                'mapping': [[[10, 20, 30], [1, 2, 3]]]}).encode())
+    assert status == 200
+    result = np.array(Image.open(io.BytesIO(base64.b64decode(response['image']))))
+    assert tuple(result[0, 0]) == (1, 2, 3) and tuple(result[7, 0]) == (0, 0, 0)
+
+
+@pytest.mark.parametrize('headers, status', [
+    ({TOKEN_HEADER: None}, 401),
+    ({TOKEN_HEADER: 'wrong'}, 401),
+    ({'Content-Type': 'text/plain'}, 415),
+    ({'Content-Length': None}, 411),
+    ({'Content-Length': 'abc'}, 400),
+    ({'Content-Length': '-5'}, 400),
+])
+def test_rejected_headers(server, headers, status):
+    assert post(server, b'{}', headers)[0] == status
+
+
+@pytest.mark.parametrize('request_body', [
+    {'image': 12345, 'mapping': []},
+    {'image': 'not base64!!', 'mapping': []},
+    {'image': png_base64(sheet()), 'mapping': [[[1, 2], [3, 4, 5]]]},
+    {'image': png_base64(sheet()), 'mapping': [[[1, 2, 300], [3, 4, 5]]]},
+    {'image': png_base64(sheet()), 'mapping': [], 'compress_level': 12},
+    {'image': png_base64(sheet()), 'mapping': [], 'output_path': 'missing/out.png'},
+    {'path': '../outside.png', 'mapping': []},
+])
+def test_bad_requests_are_400(server, request_body):
+    status, response = post(server, json.dumps(request_body).encode())
+    assert status == 400, response
+
+
+def test_decompression_bomb_is_a_request_error(service, monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 10)
+    with pytest.raises(RequestError):
+        service.recolor({'image': png_base64(np.zeros((64, 64, 3), dtype=np.uint8)), 'mapping': []})
+
+
+def test_config_is_parsed_only_on_a_miss(service, monkeypatch):
+    root = service.root
+    Image.fromarray(sheet()).save(os.path.join(root, 'sheet.png'))
+    config = {'sections': {'top': {'x': 0, 'y': 0, 'width': 6, 'height': 4, 'palettes': [
+        {'name': 'base', 'colors': [[10, 20, 30]]}, {'name': 'alt', 'colors': [[9, 9, 9]]}]}}}
+    request = {'path': 'sheet.png', 'config': config, 'palette': 'alt', 'output_path': 'out.png'}
+    assert service.recolor(request)['path'] == os.path.join(root, 'out.png')
+    monkeypatch.setattr(SpritePaletteConfig, 'from_dict',
+                        classmethod(lambda cls, data: pytest.fail("config parsed on a cache hit")))
+    service.recolor(request)
+    result = np.array(Image.open(os.path.join(root, 'out.png')))
+    assert tuple(result[0, 0]) == (9, 9, 9) and tuple(result[7, 0]) == (0, 0, 0)
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from tilemap import EMPTY_TILE, TileMap, TileMapRenderer
+
+TILE = 4
+TRANSPARENT = (255, 0, 255)
+
+
+def make_tileset(rows=3, cols=4, seed=0):
+    """rows x cols tiles of random colors, with some transparent pixels"""
+    rng = np.random.default_rng(seed)
+    tileset = rng.integers(0, 200, size=(rows * TILE, cols * TILE, 3), dtype=np.uint8)
+    tileset[rng.random(tileset.shape[:2]) < 0.25] = TRANSPARENT
+    return tileset
+
+
+def make_map(width=37, height=23, layers=2, seed=0):
+    rng = np.random.default_rng(seed)
+    tilemap = TileMap(width, height, TILE, TILE, 0)
+    for _ in range(layers):
+        tilemap.add_layer(data=rng.integers(EMPTY_TILE, 12, size=(height, width)))
+    return tilemap
+
+
+def reference_render(tilemap, tileset, level=0, transparent_color=TRANSPARENT):
+    """Compose the map one tile and one layer at a time"""
+    step = 2 ** level
+    cols = tileset.shape[1] // TILE
+    th, tw = -(-TILE // step), -(-TILE // step)
+    out = np.zeros((tilemap.height * th, tilemap.width * tw, 3), dtype=np.uint8)
+    for y in range(tilemap.height):
+        for x in range(tilemap.width):
+            cell = out[y * th:(y + 1) * th, x * tw:(x + 1) * tw]
+            for layer in tilemap.layers:
+                index = int(layer[y, x])
+                if index < 0:
+                    continue
+                row, col = divmod(index, cols)
+                block = tileset[row * TILE:(row + 1) * TILE:step, col * TILE:(col + 1) * TILE:step]
+                opaque = np.any(block != transparent_color, axis=-1)
+                cell[opaque] = block[opaque]
+    return out
+
+
+@pytest.mark.parametrize('level', [0, 1, 2])
+def test_render_matches_reference(level):
+    tilemap, tileset = make_map(), make_tileset()
+    renderer = TileMapRenderer(tilemap, tileset, chunk_size=8, transparent_color=TRANSPARENT)
+    np.testing.assert_array_equal(renderer.render_region(0, 0, tilemap.width, tilemap.height, level),
+                                  reference_render(tilemap, tileset, level))
+
+
+def test_render_subregion():
+    tilemap, tileset = make_map(), make_tileset()
+    renderer = TileMapRenderer(tilemap, tileset, chunk_size=8, transparent_color=TRANSPARENT)
+    full = reference_render(tilemap, tileset)
+    np.testing.assert_array_equal(renderer.render_region(5, 3, 20, 17),
+                                  full[3 * TILE:17 * TILE, 5 * TILE:20 * TILE])
+
+
+def test_set_tile_recomposes_only_its_chunk():
+    tilemap, tileset = make_map(), make_tileset()
+    renderer = TileMapRenderer(tilemap, tileset, chunk_size=8, transparent_color=TRANSPARENT)
+    renderer.render_region(0, 0, tilemap.width, tilemap.height)
+    renderer.render_region(0, 0, tilemap.width, tilemap.height, 1)
+    before = dict(renderer._cache)
+    previous = tilemap.get_tile(1, 10, 12)
+    assert renderer.set_tile(1, 10, 12, (previous + 1) % 12) == previous
+    assert set(before) - set(renderer._cache) == {(0, 1, 1), (1, 1, 1)}
+    for key, chunk in renderer._cache.items():
+        assert chunk is before[key]
+    np.testing.assert_array_equal(renderer.render_region(0, 0, tilemap.width, tilemap.height),
+                                  reference_render(tilemap, tileset))
+
+
+def test_fill_rect_invalidates_overlapping_chunks():
+    tilemap, tileset = make_map(), make_tileset()
+    renderer = TileMapRenderer(tilemap, tileset, chunk_size=8, transparent_color=TRANSPARENT)
+    renderer.render_region(0, 0, tilemap.width, tilemap.height)
+    renderer.fill_rect(0, 6, 2, 12, 9, 3)
+    assert (tilemap.layers[0][2:11, 6:18] == 3).all()
+    assert {key[1:] for key in renderer._cache}.isdisjoint({(cx, cy) for cx in range(0, 3) for cy in range(0, 2)})
+    np.testing.assert_array_equal(renderer.render_region(0, 0, tilemap.width, tilemap.height),
+                                  reference_render(tilemap, tileset))
+
+
+def test_cache_is_bounded_by_bytes():
+    tilemap, tileset = make_map(64, 64, 1), make_tileset()
+    renderer = TileMapRenderer(tilemap, tileset, chunk_size=8, cache_bytes=renderer_bytes(8, 4))
+    for cy in range(8):
+        for cx in range(8):
+            renderer.get_chunk(cx, cy)
+    assert len(renderer._cache) == 4
+    assert renderer._cached_bytes == sum(chunk.nbytes for chunk in renderer._cache.values())
+    renderer.reserve(16)
+    assert renderer.max_bytes == 32 * renderer.chunk_bytes()
+    renderer.reserve(1)
+    assert renderer.max_bytes == renderer.cache_bytes
+
+
+def renderer_bytes(chunk_size, chunks):
+    return chunks * chunk_size * chunk_size * TILE * TILE * 3
+
+
+@pytest.mark.parametrize('extension', ['.json', '.csv'])
+def test_save_load_round_trip(tmp_path, extension):
+    tilemap = make_map(layers=1 if extension == '.csv' else 3)
+    tilemap.layer_names[0] = 'ground'
+    path = str(tmp_path / f"level{extension}")
+    tilemap.save(path)
+    loaded = TileMap.load(path, TILE, TILE)
+    assert (loaded.width, loaded.height, loaded.tile_width, loaded.tile_height) == (37, 23, TILE, TILE)
+    assert len(loaded.layers) == len(tilemap.layers)
+    for expected, actual in zip(tilemap.layers, loaded.layers):
+        np.testing.assert_array_equal(actual, expected)
+    if extension == '.json':
+        assert loaded.layer_names == tilemap.layer_names
+
+
+def test_layer_shape_is_checked():
+    tilemap = TileMap(4, 3)
+    with pytest.raises(ValueError):
+        tilemap.add_layer(data=np.zeros((4, 3)))
@@ -0,0 +1,295 @@
+import csv
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+EMPTY_TILE = -1
+# Composed chunks kept by a renderer unless the current view needs more
+DEFAULT_CACHE_BYTES = 128 << 20
+
+
+class TileMap:
+    """Layered 2D grid of tile indices referencing a tileset"""
+
+    def __init__(self, width, height, tile_width=16, tile_height=16, layer_count=1):
+        if width <= 0 or height <= 0:
+            raise ValueError("Map size must be positive")
+        if tile_width <= 0 or tile_height <= 0:
+            raise ValueError("Tile size must be positive")
+        self.width = width
+        self.height = height
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.layers = []
+        self.layer_names = []
+        for _ in range(layer_count):
+            self.add_layer()
+
+    def add_layer(self, name=None, data=None):
+        """Add a layer on top of the stack and return its index"""
+        if data is None:
+            data = np.full((self.height, self.width), EMPTY_TILE, dtype=np.int32)
+        else:
+            data = np.asarray(data, dtype=np.int32)
+            if data.shape != (self.height, self.width):
+                raise ValueError(f"Layer shape {data.shape} does not match map size {(self.height, self.width)}")
+        self.layers.append(data)
+        self.layer_names.append(name or f"Layer {len(self.layers)}")
+        return len(self.layers) - 1
+
+    def remove_layer(self, index):
+        """Remove a layer from the stack"""
+        if len(self.layers) == 1:
+            raise ValueError("A map must have at least one layer")
+        del self.layers[index]
+        del self.layer_names[index]
+
+    def get_tile(self, layer, x, y):
+        return int(self.layers[layer][y, x])
+
+    def set_tile(self, layer, x, y, tile_index):
+        """Set a cell and return its previous tile index"""
+        old = int(self.layers[layer][y, x])
+        self.layers[layer][y, x] = tile_index
+        return old
+
+    def fill_rect(self, layer, x, y, width, height, tile_index):
+        """Fill a rectangle of cells with one tile"""
+        self.layers[layer][y:y + height, x:x + width] = tile_index
+
+    def to_dict(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "tile_width": self.tile_width,
+            "tile_height": self.tile_height,
+            "layers": [
+                {"name": name, "data": layer.tolist()}
+                for name, layer in zip(self.layer_names, self.layers)
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        tilemap = cls(data["width"], data["height"], data.get("tile_width", 16), data.get("tile_height", 16), 0)
+        for layer in data["layers"]:
+            tilemap.add_layer(layer.get("name"), layer["data"])
+        if not tilemap.layers:
+            tilemap.add_layer()
+        return tilemap
+
+    def save_json(self, filename):
+        """Save all layers to a JSON map file"""
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+
+    @classmethod
+    def load_json(cls, filename):
+        """Load a map from a JSON map file"""
+        with open(filename, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+    def save_csv(self, filename, layer=0):
+        """Save a single layer as CSV, one map row per line"""
+        with open(filename, 'w', newline='') as f:
+            csv.writer(f).writerows(self.layers[layer].tolist())
+
+    @classmethod
+    def load_csv(cls, filename, tile_width=16, tile_height=16):
+        """Load a single-layer map from CSV"""
+        with open(filename, 'r', newline='') as f:
+            rows = [[int(value) for value in row] for row in csv.reader(f) if row]
+        if not rows:
+            raise ValueError("Empty map file")
+        data = np.array(rows, dtype=np.int32)
+        tilemap = cls(data.shape[1], data.shape[0], tile_width, tile_height, 0)
+        tilemap.add_layer(os.path.splitext(os.path.basename(filename))[0], data)
+        return tilemap
+
+    def save(self, filename):
+        """Save using the format implied by the file extension"""
+        if filename.lower().endswith('.csv'):
+            self.save_csv(filename)
+        else:
+            self.save_json(filename)
+
+    @classmethod
+    def load(cls, filename, tile_width=16, tile_height=16):
+        """Load using the format implied by the file extension"""
+        if filename.lower().endswith('.csv'):
+            return cls.load_csv(filename, tile_width, tile_height)
+        return cls.load_json(filename)
+
+
+class TileMapRenderer:
+    """Composes a TileMap into cached RGB chunks from the tileset
+
+    Chunks are built with a single numpy gather of tile blocks per layer and
+    kept in an LRU cache bounded by bytes. Editing cells only evicts the chunks that contain
+    them, so the next paint recomposes those chunks alone; edits must go
+    through set_tile/fill_rect here, not the TileMap. Zoomed-out views use
+    subsampled tiles (level n keeps every 2**n-th pixel) so the whole map can
+    be shown without composing it at full resolution.
+    """
+
+    def __init__(self, tilemap, tileset_array, chunk_size=32, background=(0, 0, 0),
+                 transparent_color=None, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.tilemap = tilemap
+        self.chunk_size = chunk_size
+        self.background = np.array(background, dtype=np.uint8)
+        self.transparent_color = transparent_color
+        self.cache_bytes = cache_bytes
+        self.max_bytes = cache_bytes  # raised by reserve() while a view needs more
+        self._cache = OrderedDict()  # (level, cx, cy) -> chunk
+        self._cached_bytes = 0
+        self.set_tileset(tileset_array)
+
+    def set_tileset(self, tileset_array):
+        """Use a new tileset image (H, W, 3) and drop all cached chunks"""
+        tw, th = self.tilemap.tile_width, self.tilemap.tile_height
+        rows = tileset_array.shape[0] // th
+        cols = tileset_array.shape[1] // tw
+        if rows == 0 or cols == 0:
+            raise ValueError("Tileset is smaller than one tile")
+        self.tileset = tileset_array
+        # View of the sheet as (rows, cols, th, tw, 3); no copy, so in-place
+        # sheet edits are picked up after invalidate().
+        self.tiles = (tileset_array[:rows * th, :cols * tw]
+                      .reshape(rows, th, cols, tw, 3)
+                      .swapaxes(1, 2))
+        self.tileset_columns = cols
+        self.tile_count = rows * cols
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop every cached chunk"""
+        self._cache.clear()
+        self._cached_bytes = 0
+
+    def max_level(self):
+        """Coarsest subsampling level that still keeps one pixel per tile"""
+        level = 0
+        while (2 ** (level + 1)) <= min(self.tilemap.tile_width, self.tilemap.tile_height):
+            level += 1
+        return level
+
+    def chunk_grid(self):
+        """Number of chunk columns and rows covering the map"""
+        cs = self.chunk_size
+        return (self.tilemap.width + cs - 1) // cs, (self.tilemap.height + cs - 1) // cs
+
+    def chunk_bytes(self, level=0):
+        """Size of a full chunk at a subsampling level"""
+        step = 2 ** level
+        th = -(-self.tilemap.tile_height // step)
+        tw = -(-self.tilemap.tile_width // step)
+        return self.chunk_size * self.chunk_size * th * tw * 3
+
+    def reserve(self, visible_chunks, level=0):
+        """Budget the cache for the current view
+
+        The byte cap becomes twice what the visible chunks take at level, so
+        a repaint cannot evict itself, but never less than cache_bytes; it
+        drops back as soon as a smaller view is reserved.
+        """
+        self.max_bytes = max(self.cache_bytes, 2 * visible_chunks * self.chunk_bytes(level))
+        self._trim()
+
+    def _trim(self):
+        while self._cached_bytes > self.max_bytes and self._cache:
+            _, chunk = self._cache.popitem(last=False)
+            self._cached_bytes -= chunk.nbytes
+
+    def _evict(self, key):
+        chunk = self._cache.pop(key, None)
+        if chunk is not None:
+            self._cached_bytes -= chunk.nbytes
+
+    def mark_rect_dirty(self, x0, y0, x1, y1):
+        """Evict the chunks overlapping cells [x0, x1) x [y0, y1) at every level"""
+        cs = self.chunk_size
+        cols, rows = self.chunk_grid()
+        cx0, cy0 = max(0, x0) // cs, max(0, y0) // cs
+        cx1, cy1 = min(cols - 1, (x1 - 1) // cs), min(rows - 1, (y1 - 1) // cs)
+        if cx0 > cx1 or cy0 > cy1:
+            return
+        levels = self.max_level() + 1
+        if levels * (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cache):
+            # Büyük alanlarda önbelleği taramak daha ucuz
+            keys = [key for key in self._cache if cx0 <= key[1] <= cx1 and cy0 <= key[2] <= cy1]
+        else:
+            keys = [(level, cx, cy) for level in range(levels)
+                    for cy in range(cy0, cy1 + 1) for cx in range(cx0, cx1 + 1)]
+        for key in keys:
+            self._evict(key)
+
+    def mark_cell_dirty(self, x, y):
+        """Evict the chunk containing a cell at every level"""
+        self.mark_rect_dirty(x, y, x + 1, y + 1)
+
+    def set_tile(self, layer, x, y, tile_index):
+        """Edit a cell through the renderer so its chunk gets recomposed"""
+        old = self.tilemap.set_tile(layer, x, y, tile_index)
+        if old != tile_index:
+            self.mark_cell_dirty(x, y)
+        return old
+
+    def fill_rect(self, layer, x, y, width, height, tile_index):
+        """Fill cells through the renderer so the chunks they touch get recomposed"""
+        self.tilemap.fill_rect(layer, x, y, width, height, tile_index)
+        self.mark_rect_dirty(x, y, x + width, y + height)
+
+    def get_chunk(self, cx, cy, level=0):
+        """Return the composed RGB array of a chunk, recomposing if dirty"""
+        key = (level, cx, cy)
+        chunk = self._cache.get(key)
+        if chunk is not None:
+            self._cache.move_to_end(key)
+            return chunk
+        chunk = self._compose_chunk(cx, cy, level)
+        self._cache[key] = chunk
+        self._cached_bytes += chunk.nbytes
+        self._trim()
+        return chunk
+
+    def _compose_chunk(self, cx, cy, level):
+        cs = self.chunk_size
+        x0, y0 = cx * cs, cy * cs
+        x1 = min(x0 + cs, self.tilemap.width)
+        y1 = min(y0 + cs, self.tilemap.height)
+        step = 2 ** level
+        tiles = self.tiles[:, :, ::step, ::step]
+        th, tw = tiles.shape[2], tiles.shape[3]
+        out = np.empty((y1 - y0, x1 - x0, th, tw, 3), dtype=np.uint8)
+        out[:] = self.background
+        for layer in self.tilemap.layers:
+            indices = layer[y0:y1, x0:x1]
+            valid = (indices >= 0) & (indices < self.tile_count)
+            if not valid.any():
+                continue
+            safe = np.where(valid, indices, 0)
+            blocks = tiles[safe // self.tileset_columns, safe % self.tileset_columns]
+            mask = np.broadcast_to(valid[:, :, None, None], blocks.shape[:4])
+            if self.transparent_color is not None:
+                mask = mask & np.any(blocks != self.transparent_color, axis=-1)
+            out[mask] = blocks[mask]
+        return out.swapaxes(1, 2).reshape((y1 - y0) * th, (x1 - x0) * tw, 3)
+
+    def render_region(self, x0, y0, x1, y1, level=0):
+        """Compose the map cells in [x0, x1) x [y0, y1) into one RGB array"""
+        cs = self.chunk_size
+        step = 2 ** level
+        th = -(-self.tilemap.tile_height // step)
+        tw = -(-self.tilemap.tile_width // step)
+        out = np.empty(((y1 - y0) * th, (x1 - x0) * tw, 3), dtype=np.uint8)
+        self.reserve(((x1 - 1) // cs - x0 // cs + 1) * ((y1 - 1) // cs - y0 // cs + 1), level)
+        for cy in range(y0 // cs, (y1 - 1) // cs + 1):
+            for cx in range(x0 // cs, (x1 - 1) // cs + 1):
+                chunk = self.get_chunk(cx, cy, level)
+                sx0, sy0 = max(x0, cx * cs), max(y0, cy * cs)
+                sx1, sy1 = min(x1, cx * cs + cs), min(y1, cy * cs + cs)
+                out[(sy0 - y0) * th:(sy1 - y0) * th, (sx0 - x0) * tw:(sx1 - x0) * tw] = \
+                    chunk[(sy0 - cy * cs) * th:(sy1 - cy * cs) * th, (sx0 - cx * cs) * tw:(sx1 - cx * cs) * tw]
+        return out
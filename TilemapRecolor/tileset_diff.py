@@ -0,0 +1,174 @@
+import argparse
+import json
+import sys
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from color_utils import pack_colors, unpack_colors
+from palette_config import BINARY_EXTENSION, SpritePaletteConfig
+
+
+@dataclass
+class ChangedTile:
+    column: int
+    row: int
+    bbox: Tuple[int, int, int, int]  # x0, y0, x1, y1 in sheet pixels, exclusive end
+    changed_pixels: int
+
+
+@dataclass
+class OffPaletteColor:
+    color: Tuple[int, int, int]
+    count: int
+    locations: List[Tuple[int, int]]  # first few (x, y) positions
+
+
+@dataclass
+class TilesetDiff:
+    tile_width: int
+    tile_height: int
+    changed_tiles: List[ChangedTile] = field(default_factory=list)
+    off_palette: List[OffPaletteColor] = field(default_factory=list)
+
+    @property
+    def changed_pixels(self):
+        return sum(tile.changed_pixels for tile in self.changed_tiles)
+
+    def is_clean(self):
+        return not self.off_palette
+
+    def to_dict(self):
+        return {
+            "tile_width": self.tile_width,
+            "tile_height": self.tile_height,
+            "changed_pixels": self.changed_pixels,
+            "changed_tiles": [
+                {"column": t.column, "row": t.row, "bbox": list(t.bbox), "changed_pixels": t.changed_pixels}
+                for t in self.changed_tiles
+            ],
+            "off_palette": [
+                {"color": list(c.color), "count": c.count, "locations": [list(p) for p in c.locations]}
+                for c in self.off_palette
+            ]
+        }
+
+
+def tile_change_mask(old, new, tile_width, tile_height):
+    """Per-pixel change mask and per-tile changed-pixel counts
+
+    Sheets are padded to whole tiles, so the count array has shape
+    (rows, columns) covering partial edge tiles too.
+    """
+    if old.shape != new.shape:
+        raise ValueError(f"Image sizes differ: {old.shape[1]}x{old.shape[0]} vs {new.shape[1]}x{new.shape[0]}")
+    changed = np.any(old != new, axis=-1)
+    height, width = changed.shape
+    rows = -(-height // tile_height)
+    columns = -(-width // tile_width)
+    padded = np.zeros((rows * tile_height, columns * tile_width), dtype=bool)
+    padded[:height, :width] = changed
+    blocks = padded.reshape(rows, tile_height, columns, tile_width)
+    return changed, blocks, blocks.sum(axis=(1, 3))
+
+
+def diff_arrays(old, new, tile_width=16, tile_height=16, palette=None, max_locations=10):
+    """Compare two (H, W, 3) arrays tile by tile
+
+    When palette (a list of RGB colors) is given, every color of new that is
+    not in it is reported with its count and first locations.
+    """
+    result = TilesetDiff(tile_width, tile_height)
+    _, blocks, counts = tile_change_mask(old, new, tile_width, tile_height)
+    rows, columns = np.nonzero(counts)
+    if len(rows):
+        dirty = blocks[rows, :, columns, :]  # (n, tile_height, tile_width)
+        any_y = dirty.any(axis=2)
+        any_x = dirty.any(axis=1)
+        y0 = any_y.argmax(axis=1)
+        y1 = tile_height - any_y[:, ::-1].argmax(axis=1)
+        x0 = any_x.argmax(axis=1)
+        x1 = tile_width - any_x[:, ::-1].argmax(axis=1)
+        for i in range(len(rows)):
+            ox, oy = int(columns[i]) * tile_width, int(rows[i]) * tile_height
+            result.changed_tiles.append(ChangedTile(
+                int(columns[i]), int(rows[i]),
+                (ox + int(x0[i]), oy + int(y0[i]), ox + int(x1[i]), oy + int(y1[i])),
+                int(counts[rows[i], columns[i]])))
+
+    if palette is not None:
+        result.off_palette = off_palette_colors(new, palette, max_locations)
+    return result
+
+
+def off_palette_colors(img_array, palette, max_locations=10):
+    """List colors of an image that are not in palette, most frequent first"""
+    keys = pack_colors(img_array)
+    allowed = np.unique(pack_colors(np.array(palette, dtype=np.uint8).reshape(-1, 3)))
+    outside = ~np.isin(keys, allowed, assume_unique=False)
+    if not outside.any():
+        return []
+    ys, xs = np.nonzero(outside)
+    bad = keys[ys, xs]
+    order = np.argsort(bad, kind='stable')
+    bad, ys, xs = bad[order], ys[order], xs[order]
+    starts = np.flatnonzero(np.r_[True, bad[1:] != bad[:-1]])
+    counts = np.diff(np.r_[starts, len(bad)])
+    colors = unpack_colors(bad[starts])
+    report = []
+    for i in np.argsort(-counts, kind='stable'):
+        start = starts[i]
+        end = start + min(int(counts[i]), max_locations)
+        report.append(OffPaletteColor(
+            tuple(int(c) for c in colors[i]), int(counts[i]),
+            [(int(x), int(y)) for x, y in zip(xs[start:end], ys[start:end])]))
+    return report
+
+
+def diff_files(old_path, new_path, tile_width=16, tile_height=16, palette=None, max_locations=10):
+    """Diff two sheet files; see diff_arrays"""
+    old = np.array(Image.open(old_path).convert('RGB'))
+    new = np.array(Image.open(new_path).convert('RGB'))
+    return diff_arrays(old, new, tile_width, tile_height, palette, max_locations)
+
+
+def load_palette(path):
+    """Approved colors from a palette image or a SpritePaletteConfig file (JSON or binary)"""
+    if path.lower().endswith(('.json', BINARY_EXTENSION)):
+        config = SpritePaletteConfig.load_from_file(path)
+        return [color for section in config.sections.values() for palette in section.palettes for color in palette.colors]
+    colors = np.array(Image.open(path).convert('RGB')).reshape(-1, 3)
+    return [tuple(int(c) for c in color) for color in np.unique(colors, axis=0)]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Diff tileset sheets tile by tile and check palette drift')
+    parser.add_argument('pairs', nargs='+', help='old and new sheet paths, alternating (old1 new1 old2 new2 ...)')
+    parser.add_argument('--tile', type=int, nargs=2, default=[16, 16], metavar=('W', 'H'))
+    parser.add_argument('--palette', help='approved palette image or palette config JSON')
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    args = parser.parse_args(argv)
+    if len(args.pairs) % 2:
+        parser.error('sheet paths must come in old/new pairs')
+
+    palette = load_palette(args.palette) if args.palette else None
+    reports = {}
+    clean = True
+    for old_path, new_path in zip(args.pairs[::2], args.pairs[1::2]):
+        diff = diff_files(old_path, new_path, args.tile[0], args.tile[1], palette)
+        reports[new_path] = diff.to_dict()
+        clean = clean and diff.is_clean()
+        if not args.json:
+            print(f"{new_path}: {len(diff.changed_tiles)} tiles changed, "
+                  f"{diff.changed_pixels} pixels, {len(diff.off_palette)} off-palette colors")
+            for entry in diff.off_palette:
+                print(f"  off-palette {entry.color} x{entry.count} at {entry.locations[:3]}")
+    if args.json:
+        json.dump(reports, sys.stdout, indent=2)
+    return 0 if clean else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,29 +1,44 @@
 import logging
 import numpy as np
 from PIL import Image
+from profiling import profiler
+from quantize import quantize_array
+from palette_lut import build_palette_lut
+from color_utils import pack_colors, unpack_colors, unique_colors
+from tileset_diff import diff_arrays
+import recolor_kernels
+from subpalette_packer import pack_subpalettes
+from palette_animation import PaletteAnimator
+from dither import dither_array, section_strength_map
+from autotile import autotile_sets
+from upscale import upscale
+from segmentation import segment
+
+UNASSIGNED_SECTION = '<unassigned>'
 
 class TilesetRecolor:
-    def __init__(self):
+    def __init__(self, backend='auto'):
         self.tileset = None
+        # 'numba' runs fused single-pass kernels when numba is installed
+        self.backend = recolor_kernels.resolve_backend(backend)
 
+    @profiler.timed('load')
     def load_tileset(self, file_path):
         """Load a tileset image"""
         self.tileset = Image.open(file_path).convert('RGB')
 
+    @profiler.timed('extract')
     def extract_palette_from_image(self, image):
         """Extract unique colors from an image"""
         try:
             # Convert image to numpy array
-            img_array = np.array(image)
-            
-            # Reshape to 2D array of pixels
-            pixels = img_array.reshape(-1, 3)
+            img_array = np.array(image.convert('RGB'))
             
             # Get unique colors
-            unique_colors = np.unique(pixels, axis=0)
+            colors, _ = recolor_kernels.count_colors(img_array, self.backend)
             
             # Convert to list of tuples
-            palette = [tuple(color) for color in unique_colors]
+            palette = [tuple(int(c) for c in color) for color in colors]
             
             # Sort colors by brightness (you can change this sorting if needed)
             palette.sort(key=lambda c: sum(c))
@@ -39,12 +54,167 @@ class TilesetRecolor:
             return []
         return self.extract_palette_from_image(self.tileset)
 
+    @profiler.timed('quantize')
+    def quantize_image(self, image, n_colors, method='median_cut', sample_size=None):
+        """Reduce an image to n_colors colors using median cut or k-means
+
+        Returns (palette, index_map) where index_map holds a palette index
+        for every pixel.
+        """
+        return quantize_array(np.array(image.convert('RGB')), n_colors, method, sample_size)
+
+    def quantize(self, n_colors, method='median_cut', sample_size=None):
+        """Reduce the loaded tileset to n_colors colors"""
+        if not self.tileset:
+            raise ValueError("No tileset loaded")
+        return self.quantize_image(self.tileset, n_colors, method, sample_size)
+
+    @profiler.timed('dither')
+    def dither(self, palette, method='bayer', strength=1.0, config=None, image=None):
+        """Map the tileset onto palette with Bayer or blue-noise ordered dithering
+
+        With a config, sections that set dither_strength override strength
+        inside their rectangles. Returns (index_map, dithered image).
+        """
+        image = image if image is not None else self.tileset
+        if image is None:
+            raise ValueError("No tileset loaded")
+        img_array = np.array(image.convert('RGB'))
+        if config is not None:
+            strength = section_strength_map(config, img_array.shape[1], img_array.shape[0], strength, img_array)
+        index_map, dithered = dither_array(img_array, palette, method, strength)
+        return index_map, Image.fromarray(dithered)
+
+    @profiler.timed('extract_sections')
+    def extract_section_palettes(self, config, image=None):
+        """Count colors for every section of a config in one grouped pass
+
+        Returns {section name: [(color, count), ...]} sorted by brightness,
+        with pixels outside every section under UNASSIGNED_SECTION.
+        """
+        image = image if image is not None else self.tileset
+        if image is None:
+            raise ValueError("No tileset loaded")
+        img_array = np.array(image.convert('RGB'))
+        height, width = img_array.shape[:2]
+        labels, names = config.label_map(width, height, img_array)
+        unique, inverse, _ = unique_colors(pack_colors(img_array))
+        # Group by (label, color) with one histogram or one sort
+        group_keys = labels.ravel().astype(np.int64) * len(unique) + inverse
+        group_count = (len(names) + 1) * len(unique)
+        if group_count <= 1 << 25:
+            counts = np.bincount(group_keys, minlength=group_count)
+            groups = np.flatnonzero(counts)
+            counts = counts[groups]
+        else:
+            groups, counts = np.unique(group_keys, return_counts=True)
+        group_labels = groups // len(unique)
+        group_colors = unpack_colors(unique[groups % len(unique)])
+        brightness = group_colors.astype(np.int32).sum(axis=1)
+        order = np.lexsort((brightness, group_labels))
+
+        result = {name: [] for name in [UNASSIGNED_SECTION] + names}
+        keys = [UNASSIGNED_SECTION] + names
+        for i in order:
+            result[keys[group_labels[i]]].append((tuple(int(c) for c in group_colors[i]), int(counts[i])))
+        return result
+
+    def shared_section_colors(self, section_palettes):
+        """Map each color used by more than one section to those section names"""
+        owners = {}
+        for name, entries in section_palettes.items():
+            if name == UNASSIGNED_SECTION:
+                continue
+            for color, _ in entries:
+                owners.setdefault(color, []).append(name)
+        return {color: names for color, names in owners.items() if len(names) > 1}
+
+    @profiler.timed('diff')
+    def diff_tileset(self, new_image, tile_width=16, tile_height=16, palette=None):
+        """Compare the loaded tileset against a re-exported version
+
+        Returns a TilesetDiff with changed tiles and, when palette is given,
+        the colors of new_image outside it.
+        """
+        if not self.tileset:
+            raise ValueError("No tileset loaded")
+        return diff_arrays(np.array(self.tileset), np.array(new_image.convert('RGB')),
+                           tile_width, tile_height, palette)
+
+    @profiler.timed('pack_subpalettes')
+    def pack_subpalettes(self, colors_per_palette=16, max_palettes=16, tile_size=8, transparent=None, workers=None):
+        """Split the tileset into per-tile sub-palettes for 4bpp tile hardware"""
+        if not self.tileset:
+            raise ValueError("No tileset loaded")
+        return pack_subpalettes(np.array(self.tileset), colors_per_palette, max_palettes, tile_size,
+                                transparent, workers=workers)
+
+    def palette_animator(self, image=None):
+        """Index the tileset for palette cycling and day/night frame rendering"""
+        image = image if image is not None else self.tileset
+        if image is None:
+            raise ValueError("No tileset loaded")
+        return PaletteAnimator.from_array(np.array(image.convert('RGB')))
+
+    @profiler.timed('autotile')
+    def build_autotiles(self, tile_size=16, palettes=None, image=None):
+        """Compose a 47-tile blob autotile set from the loaded 5-tile template
+
+        palettes is an optional {name: color mapping}; each one adds a
+        recolored variant of the generated sheet.
+        """
+        image = image if image is not None else self.tileset
+        if image is None:
+            raise ValueError("No tileset loaded")
+        return autotile_sets(np.array(image.convert('RGB'))[None], tile_size, palettes, self.backend)[0]
+
+    @profiler.timed('segment')
+    def segment_sections(self, mode='background', image=None, **options):
+        """Propose sections from the connected regions of the tileset
+
+        mode is 'background' (everything but the background color) or
+        'color' (regions of one color cluster); options go to
+        segmentation.segment. Returns a list of SectionProposal.
+        """
+        image = image if image is not None else self.tileset
+        if image is None:
+            raise ValueError("No tileset loaded")
+        return segment(np.array(image.convert('RGB')), mode, **options)
+
+    def build_palette_lut(self, config, image=None):
+        """Build an index map and a per-palette LUT from a SpritePaletteConfig"""
+        image = image if image is not None else self.tileset
+        if image is None:
+            raise ValueError("No tileset loaded")
+        return build_palette_lut(np.array(image.convert('RGB')), config)
+
+    @profiler.timed('recolor_sections')
+    def recolor_sections(self, config, palette_name, image=None):
+        """Recolor every section of a config with its palette named palette_name
+
+        Rectangle, mask and color-set sections are resolved into one index
+        map first, so the recolor itself is a single pass however many
+        sections there are. Sections without that palette keep their colors.
+        """
+        return Image.fromarray(self.build_palette_lut(config, image).render(palette_name))
+
+    def export_palette_lut(self, config, index_path, lut_path, metadata_path=None, image=None):
+        """Save an index texture and a palette LUT for runtime palette swapping
+
+        The LUT has one row per palette name in the config; a shader looks up
+        lut[row, index] to swap palettes without baking recolored sheets.
+        """
+        palette_lut = self.build_palette_lut(config, image)
+        palette_lut.save(index_path, lut_path, metadata_path)
+        return palette_lut
+
     def create_color_mapping(self, original_palette, new_palette):
         """Create a mapping from original colors to new colors"""
         if len(original_palette) != len(new_palette):
             raise ValueError("Original and new palettes must have the same number of colors")
         return dict(zip(original_palette, new_palette))
 
+    @profiler.timed('recolor')
     def recolor_tileset(self, color_mapping):
         """Recolor the tileset using the color mapping"""
         if not self.tileset:
@@ -53,19 +223,26 @@ class TilesetRecolor:
         # Convert image to numpy array
         img_array = np.array(self.tileset)
         
-        # Create a copy of the array
-        recolored = img_array.copy()
-        
-        # Apply color mapping
-        for old_color, new_color in color_mapping.items():
-            mask = np.all(img_array == old_color, axis=-1)
-            recolored[mask] = new_color
+        # Apply color mapping in a single pass over the pixels
+        recolored = recolor_kernels.recolor(img_array, color_mapping, self.backend)
         
         return Image.fromarray(recolored)
 
-    def save_recolored_tileset(self, recolored_image, file_path):
-        """Save the recolored tileset"""
-        recolored_image.save(file_path)
+    @profiler.timed('save')
+    def save_recolored_tileset(self, recolored_image, file_path, compress_level=None, format=None,
+                               upscale_method=None, upscale_factor=None):
+        """Save the recolored tileset
+
+        compress_level (0-9) trades PNG file size for encoding speed.
+        upscale_method ('nearest', 'scale2x', 'epx' or 'scale3x') enlarges
+        the image on export by upscale_factor (default: the method's scale).
+        """
+        if upscale_method:
+            recolored_image = Image.fromarray(upscale(np.array(recolored_image.convert('RGB')), upscale_method, upscale_factor))
+        options = {}
+        if compress_level is not None:
+            options['compress_level'] = compress_level
+        recolored_image.save(file_path, format=format, **options)
 
     def save_palette_as_image(self, palette, file_path):
         """Save a palette as an image"""
@@ -4,13 +4,26 @@ import logging
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QPushButton, QLabel, QFileDialog, 
                             QColorDialog, QScrollArea, QGridLayout, QMessageBox,
-                            QComboBox, QGroupBox, QSpinBox, QSizePolicy)
+                            QComboBox, QGroupBox, QSpinBox, QSizePolicy, QTabWidget,
+                            QDockWidget, QTableWidget, QTableWidgetItem, QCheckBox,
+                            QHeaderView, QProgressBar, QListWidget, QListWidgetItem)
 from PyQt5.QtGui import QPixmap, QImage, QColor, QPainter, QPen, QPalette
-from PyQt5.QtCore import Qt, QRect, QPoint
+from PyQt5.QtCore import Qt, QRect, QPoint, QTimer, QThreadPool
 from PIL import Image
 import numpy as np
+from collections import OrderedDict
 from tileset_recolor import TilesetRecolor
+from quantize import QUANTIZE_METHODS
+from upscale import UPSCALE_METHODS
+from segmentation import SEGMENT_MODES, proposals_to_config
 from palette_config import SpritePaletteConfig, SpriteSection, ColorPalette
+from tilemap import TileMap, TileMapRenderer, EMPTY_TILE
+from profiling import profiler
+from workers import Worker, load_tileset_job, load_layers_job, reduce_colors_job, save_tileset_job, render_variant_job
+from palette_stats import ColorUsage
+from overview import Overview
+from layers import LayerDocument, LayerLockedError
+from color_utils import pack_colors, slot_index_map
 
 # Set up logging
 logging.basicConfig(
@@ -22,6 +35,9 @@ logging.basicConfig(
     ]
 )
 
+# Above this many colors the palette grid gets unusable; offer a reduction
+MAX_PALETTE_BUTTONS = 256
+
 class ColorButton(QPushButton):
     def __init__(self, color, main_window, parent=None):
         super().__init__(parent)
@@ -121,6 +137,12 @@ class InteractiveSpriteView(QLabel):
         painter.end()
 
 class TileMapView(QWidget):
+    # Cached zoom tiles are about this many screen pixels wide
+    CACHE_TILE_SCREEN_SIZE = 256
+    MAX_CACHED_TILES = 256
+    # Rendered palette variants are full sheet copies; the cache is bounded by bytes
+    VARIANT_CACHE_BYTES = 256 << 20
+
     def __init__(self, main_window, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.main_window = main_window
@@ -129,34 +151,305 @@ class TileMapView(QWidget):
         self.offset = QPoint(0, 0)
         self.dragging = False
         self.last_mouse_pos = None
-        self.tileset_img = None  # numpy array (H, W, 3)
-        self.selected_color = (0, 0, 0)
+        self.tileset_img = None  # numpy array (H, W, 3), displayed colors
+        self.document = None  # LayerDocument, painted in palette key colors
+        self.current_layer = 0
+        # Pixels are palette indices: the document stores one unique key color
+        # per palette slot, index_map holds the slot of every pixel and
+        # display_lut turns slots into the active palette's colors. Colors
+        # outside the palette (e.g. layer blends) get extra slots that
+        # always display as themselves.
+        self.palette_size = 0
+        self.index_colors = np.zeros((0, 3), dtype=np.uint8)  # key color per slot
+        self.index_of = {}  # packed key color -> slot
+        self.display_lut = np.zeros((0, 3), dtype=np.uint8)
+        self.index_map = None
+        self.selected_color = (0, 0, 0)  # key color painted by edits
         self.undo_stack = []
+        self.section_rects = []  # (name, QRect) in source pixels, drawn over the sheet
+        self.tile_cache = OrderedDict()  # (zoom, bx, by) -> (array, QImage)
+        # Rendered palette variants: (image_version, palette hash) -> (lut, array)
+        self.image_version = 0
+        self.variant_cache = OrderedDict()
+        # Flat pixel indices per slot for palette entry edits, valid for slot_pixels_version
+        self.slot_pixel_cache = {}
+        self.slot_pixels_version = -1
+        self.color_usage = ColorUsage()
+
+    def set_tileset(self, img_array, keys=(), indexed=None):
+        self.set_document(LayerDocument.from_rgb(img_array), keys, indexed)
+
+    def set_document(self, document, keys=(), indexed=None):
+        self.document = document
+        self.current_layer = 0
+        self.undo_stack = []
+        self.section_rects = []
+        self.tileset_img = document.composite.copy()
+        # Tek seferlik sayım; sonrasında düzenlemelerle güncellenir
+        self.color_usage = ColorUsage.from_array(document.composite)
+        self.set_palette_keys(keys, indexed=indexed)
+
+    def set_palette_keys(self, keys, display=None, indexed=None):
+        """Index the document against palette key colors and display them as display (default: keys)
+
+        indexed is a (slot colors, index map) pair from slot_index_map that
+        was already built off the GUI thread, e.g. by load_tileset_job.
+        """
+        keys = np.array(keys, dtype=np.uint8).reshape(-1, 3)
+        self.palette_size = len(keys)
+        if indexed is None:
+            indexed = slot_index_map(keys, self.document.composite)
+        self.index_colors, self.index_map = indexed
+        packed = pack_colors(self.index_colors).tolist()
+        # İlk slot kazanır, slot_index_map ile aynı
+        self.index_of = dict(zip(reversed(packed), range(len(packed) - 1, -1, -1)))
+        self.display_lut = self.index_colors.copy()
+        self.bump_image_version()
+        self.set_display_palette(keys if display is None else display)
+
+    def index_region(self, colors):
+        """Slots of an (h, w, 3) block of key colors, adding slots for unknown colors"""
+        count = len(self.index_colors)
+        slot_colors, index_map = slot_index_map(self.index_colors, colors)
+        if len(slot_colors) > count:
+            added = slot_colors[count:]
+            self.index_of.update(zip(pack_colors(added).tolist(), range(count, len(slot_colors))))
+            self.display_lut = np.concatenate([self.display_lut, added])
+            self.index_colors = slot_colors
+        return index_map
+
+    def color_slot(self, key):
+        """Slot of a packed key color; unseen colors get a new slot that displays unchanged"""
+        slot = self.index_of.get(key)
+        if slot is None:
+            slot = len(self.index_colors)
+            color = np.array([[key >> 16 & 0xFF, key >> 8 & 0xFF, key & 0xFF]], dtype=np.uint8)
+            self.index_colors = np.concatenate([self.index_colors, color])
+            self.display_lut = np.concatenate([self.display_lut, color])
+            self.index_of[key] = slot
+        return slot
+
+    def bump_image_version(self):
+        """Mark the index map as changed in a way cached variants cannot follow"""
+        self.image_version += 1
+        self.variant_cache.clear()
+
+    def variant_lut(self, colors):
+        """Full display LUT for a palette: its colors, then the extra slots unchanged"""
+        colors = np.array(colors, dtype=np.uint8).reshape(-1, 3)[:self.palette_size]
+        lut = self.display_lut.copy()
+        lut[:len(colors)] = colors
+        return lut
+
+    def variant_key(self, lut):
+        return self.image_version, hash(lut.tobytes())
+
+    def cached_variant(self, key):
+        entry = self.variant_cache.get(key)
+        if entry is not None:
+            self.variant_cache.move_to_end(key)
+        return entry
+
+    def variant_cache_bytes(self):
+        return sum(array.nbytes for _, array in self.variant_cache.values())
 
-    def set_tileset(self, img_array):
-        self.tileset_img = img_array.copy()
+    def variant_capacity(self):
+        """How many sheet-sized variants fit in the cache budget"""
+        if self.tileset_img is None:
+            return 0
+        return self.VARIANT_CACHE_BYTES // max(1, self.tileset_img.nbytes)
+
+    def store_variant(self, key, lut, array):
+        if key[0] != self.image_version:
+            return  # Arka planda render edilirken görsel değişti
+        self.variant_cache.pop(key, None)
+        if array.nbytes > self.VARIANT_CACHE_BYTES:
+            return
+        # En eskiler, yenisi bütçeye sığana kadar atılır
+        used = self.variant_cache_bytes()
+        while self.variant_cache and used + array.nbytes > self.VARIANT_CACHE_BYTES:
+            _, (_, evicted) = self.variant_cache.popitem(last=False)
+            used -= evicted.nbytes
+        self.variant_cache[key] = (lut, array)
+
+    def patch_variants(self, x0, y0, x1, y1):
+        """Carry cached variants over an edit of the index map inside a rect"""
+        old_version = self.image_version
+        self.image_version += 1
+        slots = self.index_map[y0:y1, x0:x1]
+        for (version, palette_hash), (lut, array) in list(self.variant_cache.items()):
+            del self.variant_cache[(version, palette_hash)]
+            if version != old_version:
+                continue
+            if len(lut) < len(self.display_lut):
+                # Yeni ekstra slotlar her palette kendi renginde görünür
+                lut = np.concatenate([lut, self.display_lut[len(lut):]])
+            array[y0:y1, x0:x1] = lut[slots]
+            self.variant_cache[(self.image_version, palette_hash)] = (lut, array)
+
+    def set_display_palette(self, colors):
+        """Show the document through another palette
+
+        A cached variant is copied in; otherwise it is one LUT gather, no
+        pixel edits, and the result is cached for flipping back.
+        """
+        lut = self.variant_lut(colors)
+        key = self.variant_key(lut)
+        self.display_lut = lut
+        entry = self.cached_variant(key)
+        # Yerinde güncelleme: harita ve önizleme aynı diziyi kullanır
+        if entry is not None:
+            np.copyto(self.tileset_img, entry[1])
+        else:
+            np.take(self.display_lut, self.index_map, axis=0, out=self.tileset_img)
+            self.store_variant(key, lut.copy(), self.tileset_img.copy())
+        self.invalidate_cache()
         self.update()
+        self.main_window.update_tileset_from_grid(self.tileset_img)
+
+    def slot_pixels(self, index):
+        """Flat indices of the pixels in a slot, cached until the index map changes"""
+        if self.slot_pixels_version != self.image_version:
+            self.slot_pixel_cache = {}
+            self.slot_pixels_version = self.image_version
+        pixels = self.slot_pixel_cache.get(index)
+        if pixels is None:
+            pixels = np.flatnonzero(self.index_map == index)
+            self.slot_pixel_cache[index] = pixels
+        return pixels
+
+    def set_palette_entry(self, index, color):
+        """Change how one palette slot is displayed; only that slot's pixels are written"""
+        old_key = self.variant_key(self.display_lut)
+        self.display_lut[index] = color
+        pixels = self.slot_pixels(index)
+        self.tileset_img.reshape(-1, 3)[pixels] = color
+        # Eski palet artık yok; önbellekteki kopyası yamanıp yeni anahtarla saklanır
+        entry = self.variant_cache.pop(old_key, None)
+        if entry is not None:
+            lut, array = entry
+            lut[index] = color
+            array.reshape(-1, 3)[pixels] = color
+            self.store_variant(self.variant_key(self.display_lut), lut, array)
+        self.invalidate_cache()
+        self.update()
+        self.main_window.update_tileset_from_grid(self.tileset_img)
+
+    def add_palette_key(self, color):
+        """Append a palette slot displayed as color and return its key color
+
+        Keys must be unique, so a color that already has a slot is nudged to
+        the nearest unused 24-bit value; no pixel uses the new key yet.
+        """
+        key = int(pack_colors(np.array(color, dtype=np.uint8)))
+        while key in self.index_of:
+            key = (key + 1) & 0xFFFFFF
+        entry = np.array([[key >> 16 & 0xFF, key >> 8 & 0xFF, key & 0xFF]], dtype=np.uint8)
+        size = self.palette_size
+        self.index_colors = np.concatenate([self.index_colors[:size], entry, self.index_colors[size:]])
+        self.display_lut = np.concatenate([self.display_lut[:size], np.array([color], dtype=np.uint8), self.display_lut[size:]])
+        # Ekstra slotlar bir kaydırılır
+        self.index_map[self.index_map >= size] += 1
+        self.index_of = {k: (i + 1 if i >= size else i) for k, i in self.index_of.items()}
+        self.index_of[key] = size
+        self.palette_size += 1
+        self.bump_image_version()
+        return tuple(int(c) for c in entry[0])
+
+    def cache_block_size(self, zoom):
+        """Source pixels per cached tile side at a zoom level"""
+        return max(1, self.CACHE_TILE_SCREEN_SIZE // zoom)
+
+    def invalidate_cache(self, x0=None, y0=None, x1=None, y1=None):
+        """Drop cached zoom tiles overlapping a source rect, or all of them"""
+        if x0 is None:
+            self.tile_cache.clear()
+            return
+        for key in list(self.tile_cache):
+            zoom, bx, by = key
+            block = self.cache_block_size(zoom)
+            if bx * block < x1 and (bx + 1) * block > x0 and by * block < y1 and (by + 1) * block > y0:
+                del self.tile_cache[key]
+
+    def cached_tile(self, bx, by):
+        key = (self.zoom, bx, by)
+        entry = self.tile_cache.get(key)
+        if entry is not None:
+            self.tile_cache.move_to_end(key)
+            return entry[1]
+        block = self.cache_block_size(self.zoom)
+        source = self.tileset_img[by * block:(by + 1) * block, bx * block:(bx + 1) * block]
+        # Tam sayı en yakın komşu büyütme
+        scaled = np.ascontiguousarray(np.repeat(np.repeat(source, self.zoom, axis=0), self.zoom, axis=1))
+        h, w, _ = scaled.shape
+        qim = QImage(scaled.data, w, h, 3 * w, QImage.Format_RGB888)
+        self.tile_cache[key] = (scaled, qim)
+        while len(self.tile_cache) > self.MAX_CACHED_TILES:
+            self.tile_cache.popitem(last=False)
+        return qim
+
+    def visible_source_rect(self, rect):
+        """Source pixel range [x0, x1) x [y0, y1) covered by a widget rect"""
+        h, w, _ = self.tileset_img.shape
+        x0 = max(0, (rect.left() - self.offset.x()) // self.zoom)
+        y0 = max(0, (rect.top() - self.offset.y()) // self.zoom)
+        x1 = min(w, (rect.right() - self.offset.x()) // self.zoom + 1)
+        y1 = min(h, (rect.bottom() - self.offset.y()) // self.zoom + 1)
+        return x0, y0, x1, y1
+
+    def source_to_widget_rect(self, x0, y0, x1, y1):
+        return QRect(self.offset.x() + x0 * self.zoom, self.offset.y() + y0 * self.zoom,
+                     (x1 - x0) * self.zoom + 1, (y1 - y0) * self.zoom + 1)
+
+    def viewport_source_rect(self):
+        """Visible part of the sheet as (x, y, width, height) in source pixels"""
+        return (-self.offset.x() / self.zoom, -self.offset.y() / self.zoom,
+                self.width() / self.zoom, self.height() / self.zoom)
+
+    def center_on(self, x, y):
+        """Pan so that source point (x, y) is in the middle of the view"""
+        self.offset = QPoint(int(self.width() / 2 - x * self.zoom), int(self.height() / 2 - y * self.zoom))
+        self.update()
+        self.main_window.update_minimap_viewport()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.main_window.update_minimap_viewport()
 
     def set_selected_color(self, color):
         self.selected_color = color
 
+    def set_section_rects(self, sections):
+        self.section_rects = [(s.name, QRect(s.x, s.y, s.width, s.height)) for s in sections]
+        self.update()
+
+    @profiler.timed('paint')
     def paintEvent(self, event):
         if self.tileset_img is None:
             return
         painter = QPainter(self)
-        h, w, _ = self.tileset_img.shape
-        # NumPy array'den QImage oluştur
-        qim = QImage(self.tileset_img.data, w, h, 3 * w, QImage.Format_RGB888)
-        # Zoom ve offset uygula
-        target_rect = QRect(self.offset.x(), self.offset.y(), w * self.zoom, h * self.zoom)
-        painter.drawImage(target_rect, qim)
-        # Grid çizgileri
-        pen = QPen(Qt.gray, 1)
-        painter.setPen(pen)
-        for y in range(h + 1):
-            painter.drawLine(self.offset.x(), self.offset.y() + y * self.zoom, self.offset.x() + w * self.zoom, self.offset.y() + y * self.zoom)
-        for x in range(w + 1):
-            painter.drawLine(self.offset.x() + x * self.zoom, self.offset.y(), self.offset.x() + x * self.zoom, self.offset.y() + h * self.zoom)
+        x0, y0, x1, y1 = self.visible_source_rect(event.rect())
+        if x0 < x1 and y0 < y1:
+            # Sadece görünen, önbellekteki büyütülmüş parçaları çiz
+            block = self.cache_block_size(self.zoom)
+            for by in range(y0 // block, (y1 - 1) // block + 1):
+                for bx in range(x0 // block, (x1 - 1) // block + 1):
+                    painter.drawImage(self.offset.x() + bx * block * self.zoom,
+                                      self.offset.y() + by * block * self.zoom,
+                                      self.cached_tile(bx, by))
+            # Grid çizgileri (görünen alan için)
+            pen = QPen(Qt.gray, 1)
+            painter.setPen(pen)
+            left, right = self.offset.x() + x0 * self.zoom, self.offset.x() + x1 * self.zoom
+            top, bottom = self.offset.y() + y0 * self.zoom, self.offset.y() + y1 * self.zoom
+            for y in range(y0, y1 + 1):
+                painter.drawLine(left, self.offset.y() + y * self.zoom, right, self.offset.y() + y * self.zoom)
+            for x in range(x0, x1 + 1):
+                painter.drawLine(self.offset.x() + x * self.zoom, top, self.offset.x() + x * self.zoom, bottom)
+        # Önerilen bölümler
+        painter.setPen(QPen(Qt.green, 2))
+        for name, rect in self.section_rects:
+            painter.drawRect(self.source_to_widget_rect(rect.left(), rect.top(), rect.right() + 1, rect.bottom() + 1))
         painter.end()
 
     def mousePressEvent(self, event):
@@ -172,6 +465,7 @@ class TileMapView(QWidget):
             self.offset += delta
             self.last_mouse_pos = event.pos()
             self.update()
+            self.main_window.update_minimap_viewport()
         elif event.buttons() & Qt.LeftButton:
             self.edit_pixel(event.pos())
 
@@ -197,6 +491,7 @@ class TileMapView(QWidget):
                 int(mouse_pos.y() - rel_y * self.zoom)
             )
         self.update()
+        self.main_window.update_minimap_viewport()
 
     def edit_pixel(self, pos):
         if self.tileset_img is None:
@@ -205,25 +500,466 @@ class TileMapView(QWidget):
         y = (pos.y() - self.offset.y()) // self.zoom
         h, w, _ = self.tileset_img.shape
         if 0 <= x < w and 0 <= y < h:
+            layer = self.current_layer
+            rgba = tuple(self.selected_color) + (255,)
+            if self.document.pixel(layer, x, y) == rgba:
+                return
+            try:
+                # Sadece bu pikselin katman yığını yeniden karıştırılır
+                old_rgba = self.paint_layer_pixel(layer, x, y, rgba)
+            except LayerLockedError as e:
+                self.main_window.statusBar().showMessage(str(e), 3000)
+                return
             # Undo stack
-            self.undo_stack.append((x, y, tuple(self.tileset_img[y, x])))
-            self.tileset_img[y, x] = self.selected_color
-            self.update()
-            self.main_window.update_tileset_from_grid(self.tileset_img)
+            self.undo_stack.append((layer, x, y, old_rgba))
 
     def undo(self):
         if self.undo_stack:
-            x, y, old_color = self.undo_stack.pop()
-            self.tileset_img[y, x] = old_color
+            layer, x, y, old_rgba = self.undo_stack.pop()
+            try:
+                self.paint_layer_pixel(layer, x, y, old_rgba)
+            except LayerLockedError as e:
+                self.undo_stack.append((layer, x, y, old_rgba))
+                self.main_window.statusBar().showMessage(str(e), 3000)
+
+    def paint_layer_pixel(self, layer, x, y, rgba):
+        """Paint one layer pixel and refresh everything that shows the composite"""
+        composite = self.document.composite
+        old_color = tuple(int(c) for c in composite[y, x])
+        old_rgba = self.document.paint(layer, x, y, rgba)
+        new_color = tuple(int(c) for c in composite[y, x])
+        if new_color != old_color:
+            self.color_usage.replace(old_color, new_color)
+            slot = self.color_slot(int(pack_colors(composite[y, x])))
+            self.index_map[y, x] = slot
+            self.tileset_img[y, x] = self.display_lut[slot]
+            self.patch_variants(x, y, x + 1, y + 1)
+            self.invalidate_cache(x, y, x + 1, y + 1)
+            self.update(self.source_to_widget_rect(x, y, x + 1, y + 1))
+            self.main_window.update_tileset_from_grid(self.tileset_img, (x, y, x + 1, y + 1))
+            self.main_window.update_palette_usage((old_color, new_color))
+        return old_rgba
+
+    def composite_changed(self, rect):
+        """Refresh after a layer property change recomposited rect (x0, y0, x1, y1)"""
+        x0, y0, x1, y1 = rect
+        # Slot key colors are the composite colors from before the change
+        old_colors = self.index_colors[self.index_map[y0:y1, x0:x1]]
+        new_colors = self.document.composite[y0:y1, x0:x1]
+        self.index_map[y0:y1, x0:x1] = self.index_region(new_colors)
+        self.tileset_img[y0:y1, x0:x1] = self.display_lut[self.index_map[y0:y1, x0:x1]]
+        self.patch_variants(x0, y0, x1, y1)
+        self.invalidate_cache(*rect)
+        self.color_usage.replace_many(old_colors, new_colors)
+        self.update()
+        self.main_window.update_tileset_from_grid(self.tileset_img, rect)
+        self.main_window.update_palette_usage()
+
+class TileMapCanvas(QWidget):
+    ZOOM_LEVELS = [1 / 16, 1 / 8, 1 / 4, 1 / 2, 1, 2, 3, 4, 6, 8]
+
+    def __init__(self, main_window, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.main_window = main_window
+        self.setMouseTracking(True)
+        self.zoom_index = self.ZOOM_LEVELS.index(1)
+        self.offset = QPoint(0, 0)
+        self.dragging = False
+        self.last_mouse_pos = None
+        self.tilemap = None
+        self.renderer = None
+        self.current_layer = 0
+        self.current_tile = 0
+        self.undo_stack = []
+
+    @property
+    def zoom(self):
+        return self.ZOOM_LEVELS[self.zoom_index]
+
+    def set_map(self, tilemap, tileset_img):
+        self.tilemap = tilemap
+        self.renderer = TileMapRenderer(tilemap, tileset_img) if tileset_img is not None else None
+        self.current_layer = 0
+        self.undo_stack = []
+        self.update()
+
+    def set_tileset(self, tileset_img):
+        if self.tilemap is None or tileset_img is None:
+            return
+        if self.renderer is None or self.renderer.tileset is not tileset_img:
+            self.renderer = TileMapRenderer(self.tilemap, tileset_img)
+        else:
+            self.renderer.invalidate()
+        self.update()
+
+    def cell_size(self):
+        return self.tilemap.tile_width * self.zoom, self.tilemap.tile_height * self.zoom
+
+    @profiler.timed('map_paint')
+    def paintEvent(self, event):
+        if self.tilemap is None or self.renderer is None:
+            return
+        painter = QPainter(self)
+        painter.fillRect(event.rect(), Qt.darkGray)
+        cell_w, cell_h = self.cell_size()
+        cs = self.renderer.chunk_size
+        chunk_w, chunk_h = cell_w * cs, cell_h * cs
+        # Uzaklaştırınca seyreltilmiş tile'lar kullanılır
+        level = 0
+        while level < self.renderer.max_level() and 2 ** (level + 1) <= 1 / self.zoom:
+            level += 1
+        rect = event.rect()
+        cols, rows = self.renderer.chunk_grid()
+        # Uzak seviyelerde ekranda çok daha fazla chunk görünür
+        self.renderer.reserve(min(cols, int(self.width() // chunk_w) + 2) *
+                              min(rows, int(self.height() // chunk_h) + 2), level)
+        cx0 = max(0, int((rect.left() - self.offset.x()) // chunk_w))
+        cy0 = max(0, int((rect.top() - self.offset.y()) // chunk_h))
+        cx1 = min(cols - 1, int((rect.right() - self.offset.x()) // chunk_w))
+        cy1 = min(rows - 1, int((rect.bottom() - self.offset.y()) // chunk_h))
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                chunk = self.renderer.get_chunk(cx, cy, level)
+                h, w, _ = chunk.shape
+                qim = QImage(chunk.data, w, h, 3 * w, QImage.Format_RGB888)
+                cells_x = min(cs, self.tilemap.width - cx * cs)
+                cells_y = min(cs, self.tilemap.height - cy * cs)
+                target = QRect(int(self.offset.x() + cx * chunk_w), int(self.offset.y() + cy * chunk_h),
+                               int(round(cells_x * cell_w)), int(round(cells_y * cell_h)))
+                painter.drawImage(target, qim)
+        painter.end()
+
+    def cell_at(self, pos):
+        cell_w, cell_h = self.cell_size()
+        x = int((pos.x() - self.offset.x()) // cell_w)
+        y = int((pos.y() - self.offset.y()) // cell_h)
+        if 0 <= x < self.tilemap.width and 0 <= y < self.tilemap.height:
+            return x, y
+        return None
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.paint_tile(event.pos())
+        elif event.button() == Qt.RightButton:
+            self.dragging = True
+            self.last_mouse_pos = event.pos()
+
+    def mouseMoveEvent(self, event):
+        if self.dragging and self.last_mouse_pos:
+            self.offset += event.pos() - self.last_mouse_pos
+            self.last_mouse_pos = event.pos()
             self.update()
-            self.main_window.update_tileset_from_grid(self.tileset_img)
+        elif event.buttons() & Qt.LeftButton:
+            self.paint_tile(event.pos())
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.RightButton:
+            self.dragging = False
+            self.last_mouse_pos = None
+
+    def wheelEvent(self, event):
+        if self.tilemap is None:
+            return
+        old_zoom = self.zoom
+        if event.angleDelta().y() > 0:
+            self.zoom_index = min(len(self.ZOOM_LEVELS) - 1, self.zoom_index + 1)
+        else:
+            self.zoom_index = max(0, self.zoom_index - 1)
+        if old_zoom != self.zoom:
+            mouse_pos = event.pos()
+            rel_x = (mouse_pos.x() - self.offset.x()) / old_zoom
+            rel_y = (mouse_pos.y() - self.offset.y()) / old_zoom
+            self.offset = QPoint(int(mouse_pos.x() - rel_x * self.zoom), int(mouse_pos.y() - rel_y * self.zoom))
+        self.update()
+
+    def paint_tile(self, pos):
+        if self.tilemap is None or self.renderer is None:
+            return
+        cell = self.cell_at(pos)
+        if cell is None:
+            return
+        x, y = cell
+        old = self.renderer.set_tile(self.current_layer, x, y, self.current_tile)
+        if old != self.current_tile:
+            self.undo_stack.append((self.current_layer, x, y, old))
+            self.update_cell(x, y)
+
+    def update_cell(self, x, y):
+        cell_w, cell_h = self.cell_size()
+        cs = self.renderer.chunk_size
+        # Sadece değişen chunk'ı yeniden çiz
+        cx, cy = x // cs * cs, y // cs * cs
+        self.update(QRect(int(self.offset.x() + cx * cell_w), int(self.offset.y() + cy * cell_h),
+                          int(cs * cell_w) + 1, int(cs * cell_h) + 1))
+
+    def undo(self):
+        if self.undo_stack:
+            layer, x, y, old = self.undo_stack.pop()
+            self.renderer.set_tile(layer, x, y, old)
+            self.update_cell(x, y)
+
+class StatsPanel(QDockWidget):
+    COLUMNS = ['Span', 'Count', 'p50 ms', 'p95 ms', 'Max ms', 'Total ms']
+
+    def __init__(self, parent=None):
+        super().__init__('Stats', parent)
+        self.setObjectName('stats_panel')
+        container = QWidget()
+        layout = QVBoxLayout(container)
+        controls = QHBoxLayout()
+        self.enabled_check = QCheckBox('Enabled')
+        self.enabled_check.setChecked(profiler.enabled)
+        self.enabled_check.toggled.connect(self.set_enabled)
+        controls.addWidget(self.enabled_check)
+        reset_btn = QPushButton('Reset')
+        reset_btn.clicked.connect(self.reset)
+        controls.addWidget(reset_btn)
+        json_btn = QPushButton('Export JSON')
+        json_btn.clicked.connect(self.export_json)
+        controls.addWidget(json_btn)
+        trace_btn = QPushButton('Export Trace')
+        trace_btn.clicked.connect(self.export_trace)
+        controls.addWidget(trace_btn)
+        layout.addLayout(controls)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.table)
+        self.setWidget(container)
+        # Sadece panel görünürken yenile
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+
+    def on_visibility_changed(self, visible):
+        if visible:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def set_enabled(self, enabled):
+        profiler.enabled = enabled
+
+    def reset(self):
+        profiler.reset()
+        self.refresh()
+
+    def refresh(self):
+        stats = profiler.stats()
+        self.table.setRowCount(len(stats))
+        for row, name in enumerate(sorted(stats)):
+            entry = stats[name]
+            values = [name, str(entry['count'])] + [f"{entry[key]:.2f}" for key in ('p50_ms', 'p95_ms', 'max_ms', 'total_ms')]
+            for col, value in enumerate(values):
+                self.table.setItem(row, col, QTableWidgetItem(value))
+
+    def export_json(self):
+        try:
+            file_path, _ = QFileDialog.getSaveFileName(self, 'Export Stats', '', 'JSON Files (*.json)')
+            if file_path:
+                profiler.dump_json(file_path)
+        except Exception as e:
+            logging.error("Error exporting stats", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error exporting stats: {str(e)}")
+
+    def export_trace(self):
+        try:
+            file_path, _ = QFileDialog.getSaveFileName(self, 'Export Chrome Trace', '', 'Trace Files (*.json)')
+            if file_path:
+                profiler.dump_chrome_trace(file_path)
+        except Exception as e:
+            logging.error("Error exporting trace", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error exporting trace: {str(e)}")
+
+class MinimapWidget(QWidget):
+    def __init__(self, view, parent=None):
+        super().__init__(parent)
+        self.view = view  # TileMapView
+        self.overview = None
+        self.overview_image = None
+        self.setMinimumSize(160, 160)
+
+    def set_image(self, img_array):
+        self.overview = Overview(img_array) if img_array is not None else None
+        self.refresh_image()
+
+    def patch(self, img_array, dirty_rect):
+        if self.overview is None:
+            return
+        # Sadece değişen bloklar yeniden ortalanır
+        self.overview.patch(img_array, *dirty_rect)
+        self.refresh_image()
+
+    def refresh_image(self):
+        if self.overview is None:
+            self.overview_image = None
+        else:
+            w, h = self.overview.size
+            self.overview_image = QImage(self.overview.array.data, w, h, 3 * w, QImage.Format_RGB888)
+        self.update()
+
+    def target_rect(self):
+        """Widget rect the overview is drawn into and its scale in widget pixels per source pixel"""
+        src_w, src_h = self.overview.source_size
+        scale = min(self.width() / src_w, self.height() / src_h)
+        w, h = int(src_w * scale), int(src_h * scale)
+        return QRect((self.width() - w) // 2, (self.height() - h) // 2, w, h), scale
+
+    def paintEvent(self, event):
+        if self.overview_image is None:
+            return
+        painter = QPainter(self)
+        rect, scale = self.target_rect()
+        painter.drawImage(rect, self.overview_image)
+        x, y, w, h = self.view.viewport_source_rect()
+        painter.setPen(QPen(Qt.red, 2))
+        painter.drawRect(QRect(int(rect.x() + x * scale), int(rect.y() + y * scale), int(w * scale), int(h * scale)))
+        painter.end()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.jump_to(event.pos())
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton:
+            self.jump_to(event.pos())
+
+    def jump_to(self, pos):
+        if self.overview is None:
+            return
+        rect, scale = self.target_rect()
+        self.view.center_on((pos.x() - rect.x()) / scale, (pos.y() - rect.y()) / scale)
+
+class MinimapPanel(QDockWidget):
+    def __init__(self, view, parent=None):
+        super().__init__('Navigator', parent)
+        self.setObjectName('minimap_panel')
+        self.minimap = MinimapWidget(view)
+        self.setWidget(self.minimap)
+
+class LayersPanel(QDockWidget):
+    def __init__(self, view, parent=None):
+        super().__init__('Layers', parent)
+        self.setObjectName('layers_panel')
+        self.view = view  # TileMapView
+        container = QWidget()
+        layout = QVBoxLayout(container)
+        self.layer_list = QListWidget()
+        self.layer_list.currentRowChanged.connect(self.on_row_changed)
+        self.layer_list.itemChanged.connect(self.on_item_changed)
+        layout.addWidget(self.layer_list)
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel('Opacity'))
+        self.opacity_spin = QSpinBox()
+        self.opacity_spin.setRange(0, 100)
+        self.opacity_spin.setSuffix('%')
+        self.opacity_spin.valueChanged.connect(self.on_opacity_changed)
+        controls.addWidget(self.opacity_spin)
+        self.lock_check = QCheckBox('Locked')
+        self.lock_check.toggled.connect(self.on_lock_toggled)
+        controls.addWidget(self.lock_check)
+        layout.addLayout(controls)
+        buttons = QHBoxLayout()
+        save_btn = QPushButton('Save Layers')
+        save_btn.clicked.connect(self.save_layers)
+        buttons.addWidget(save_btn)
+        load_btn = QPushButton('Load Layers')
+        load_btn.clicked.connect(self.load_layers)
+        buttons.addWidget(load_btn)
+        layout.addLayout(buttons)
+        self.setWidget(container)
+
+    def layer_for_row(self, row):
+        # Liste üstten alta gösterir, katmanlar alttan üste saklanır
+        return len(self.view.document.layers) - 1 - row
+
+    def refresh(self):
+        document = self.view.document
+        self.layer_list.blockSignals(True)
+        self.layer_list.clear()
+        if document is not None:
+            for layer in reversed(document.layers):
+                item = QListWidgetItem(layer.name)
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                item.setCheckState(Qt.Checked if layer.visible else Qt.Unchecked)
+                self.layer_list.addItem(item)
+            self.layer_list.setCurrentRow(len(document.layers) - 1 - self.view.current_layer)
+        self.layer_list.blockSignals(False)
+        self.update_controls()
+
+    def update_controls(self):
+        document = self.view.document
+        enabled = document is not None
+        self.opacity_spin.setEnabled(enabled)
+        self.lock_check.setEnabled(enabled)
+        if not enabled:
+            return
+        layer = document.layers[self.view.current_layer]
+        for widget, setter, value in ((self.opacity_spin, self.opacity_spin.setValue, round(layer.opacity * 100)),
+                                      (self.lock_check, self.lock_check.setChecked, layer.locked)):
+            widget.blockSignals(True)
+            setter(value)
+            widget.blockSignals(False)
+
+    def on_row_changed(self, row):
+        if self.view.document is not None and row >= 0:
+            self.view.current_layer = self.layer_for_row(row)
+            self.update_controls()
+
+    def on_item_changed(self, item):
+        index = self.layer_for_row(self.layer_list.row(item))
+        rect = self.view.document.set_visible(index, item.checkState() == Qt.Checked)
+        if rect is not None:
+            self.view.composite_changed(rect)
+
+    def on_opacity_changed(self, value):
+        if self.view.document is None:
+            return
+        rect = self.view.document.set_opacity(self.view.current_layer, value / 100)
+        if rect is not None:
+            self.view.composite_changed(rect)
+
+    def on_lock_toggled(self, locked):
+        if self.view.document is not None:
+            self.view.document.set_locked(self.view.current_layer, locked)
+
+    def save_layers(self):
+        try:
+            if self.view.document is None:
+                return
+            file_path, _ = QFileDialog.getSaveFileName(self, 'Save Layers', '', 'Layer Files (*.npz)')
+            if file_path:
+                self.view.document.save(file_path)
+        except Exception as e:
+            logging.error("Error saving layers", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error saving layers: {str(e)}")
+
+    def load_layers(self):
+        try:
+            file_path, _ = QFileDialog.getOpenFileName(self, 'Load Layers', '', 'Layer Files (*.npz)')
+            if file_path:
+                self.parent().load_layer_document(file_path)
+        except Exception as e:
+            logging.error("Error loading layers", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error loading layers: {str(e)}")
 
 class TilesetRecolorGUI(QMainWindow):
+    PREFETCH_NEIGHBORS = 2  # palettes on each side of the current one rendered in the background
+
     def __init__(self):
         super().__init__()
         self.recolorer = TilesetRecolor()
         self.palette = []
         self.current_palette_color = (0, 0, 0)
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(max(2, QThreadPool.globalInstance().maxThreadCount() // 2))
+        self.load_worker = None
+        self.active_workers = []
+        self.prefetch_workers = {}  # variant key -> Worker
         self.init_ui()
 
     def init_ui(self):
@@ -244,6 +980,21 @@ class TilesetRecolorGUI(QMainWindow):
             save_btn = QPushButton('Save Sprite')
             save_btn.clicked.connect(self.save_tileset)
             left_layout.addWidget(save_btn)
+            compress_layout = QHBoxLayout()
+            compress_layout.addWidget(QLabel('PNG Level'))
+            self.compress_level_spin = QSpinBox()
+            self.compress_level_spin.setRange(0, 9)
+            self.compress_level_spin.setValue(6)
+            self.compress_level_spin.setToolTip('0 = fastest save, 9 = smallest file')
+            compress_layout.addWidget(self.compress_level_spin)
+            left_layout.addLayout(compress_layout)
+            upscale_layout = QHBoxLayout()
+            upscale_layout.addWidget(QLabel('Export Scale'))
+            self.upscale_combo = QComboBox()
+            self.upscale_combo.addItem('none')
+            self.upscale_combo.addItems(list(UPSCALE_METHODS))
+            upscale_layout.addWidget(self.upscale_combo)
+            left_layout.addLayout(upscale_layout)
             undo_btn = QPushButton('Undo')
             undo_btn.clicked.connect(self.undo)
             left_layout.addWidget(undo_btn)
@@ -254,6 +1005,32 @@ class TilesetRecolorGUI(QMainWindow):
             add_palette_btn = QPushButton('Add New Palette')
             add_palette_btn.clicked.connect(self.add_new_palette)
             left_layout.addWidget(add_palette_btn)
+            # Color reduction
+            reduce_layout = QHBoxLayout()
+            self.reduce_count_spin = QSpinBox()
+            self.reduce_count_spin.setRange(2, MAX_PALETTE_BUTTONS)
+            self.reduce_count_spin.setValue(64)
+            reduce_layout.addWidget(self.reduce_count_spin)
+            self.reduce_method_combo = QComboBox()
+            self.reduce_method_combo.addItems(QUANTIZE_METHODS)
+            reduce_layout.addWidget(self.reduce_method_combo)
+            left_layout.addLayout(reduce_layout)
+            reduce_btn = QPushButton('Reduce Colors')
+            reduce_btn.clicked.connect(self.reduce_colors)
+            left_layout.addWidget(reduce_btn)
+            export_lut_btn = QPushButton('Export Palette LUT')
+            export_lut_btn.clicked.connect(self.export_palette_lut)
+            left_layout.addWidget(export_lut_btn)
+            # Automatic sections
+            segment_layout = QHBoxLayout()
+            self.segment_mode_combo = QComboBox()
+            self.segment_mode_combo.addItems(SEGMENT_MODES)
+            self.segment_mode_combo.setToolTip('background: regions apart from the background color, color: regions of one color cluster')
+            segment_layout.addWidget(self.segment_mode_combo)
+            auto_sections_btn = QPushButton('Auto Sections')
+            auto_sections_btn.clicked.connect(self.auto_sections)
+            segment_layout.addWidget(auto_sections_btn)
+            left_layout.addLayout(segment_layout)
             # Palette grid in a scroll area (max height)
             self.palette_grid_widget = QWidget()
             self.palette_grid = QGridLayout(self.palette_grid_widget)
@@ -264,6 +1041,18 @@ class TilesetRecolorGUI(QMainWindow):
             palette_scroll.setWidget(self.palette_grid_widget)
             palette_scroll.setMaximumHeight(180)
             left_layout.addWidget(palette_scroll)
+            # Live palette usage
+            budget_layout = QHBoxLayout()
+            budget_layout.addWidget(QLabel('Color Budget'))
+            self.color_budget_spin = QSpinBox()
+            self.color_budget_spin.setRange(1, 4096)
+            self.color_budget_spin.setValue(MAX_PALETTE_BUTTONS)
+            self.color_budget_spin.valueChanged.connect(lambda _: self.update_palette_usage())
+            budget_layout.addWidget(self.color_budget_spin)
+            left_layout.addLayout(budget_layout)
+            self.usage_label = QLabel()
+            self.usage_label.setWordWrap(True)
+            left_layout.addWidget(self.usage_label)
             left_panel.setLayout(left_layout)
 
             # Right panel for grid
@@ -273,45 +1062,361 @@ class TilesetRecolorGUI(QMainWindow):
             self.tilemap_scroll = QScrollArea()
             self.tilemap_scroll.setWidgetResizable(True)
             self.tilemap_scroll.setWidget(self.tilemap_view)
-            right_layout.addWidget(self.tilemap_scroll)
+            self.view_tabs = QTabWidget()
+            self.view_tabs.addTab(self.tilemap_scroll, 'Sprite')
+            self.view_tabs.addTab(self.create_map_panel(), 'Map')
+            self.view_tabs.currentChanged.connect(self.on_view_tab_changed)
+            right_layout.addWidget(self.view_tabs)
             right_panel.setLayout(right_layout)
 
             main_layout.addWidget(left_panel, 0)
             main_layout.addWidget(right_panel, 1)
 
+            # Background job status
+            self.job_label = QLabel()
+            self.job_progress = QProgressBar()
+            self.job_progress.setMaximumWidth(200)
+            self.job_cancel_btn = QPushButton('Cancel')
+            self.job_cancel_btn.clicked.connect(self.cancel_jobs)
+            for widget in (self.job_label, self.job_progress, self.job_cancel_btn):
+                self.statusBar().addPermanentWidget(widget)
+            self.update_job_status()
+
+            # Dockable panels
+            self.stats_panel = StatsPanel(self)
+            self.addDockWidget(Qt.RightDockWidgetArea, self.stats_panel)
+            self.stats_panel.hide()
+            self.minimap_panel = MinimapPanel(self.tilemap_view, self)
+            self.addDockWidget(Qt.RightDockWidgetArea, self.minimap_panel)
+            self.layers_panel = LayersPanel(self.tilemap_view, self)
+            self.addDockWidget(Qt.RightDockWidgetArea, self.layers_panel)
+            self.layers_panel.refresh()
+            view_menu = self.menuBar().addMenu('View')
+            view_menu.addAction(self.minimap_panel.toggleViewAction())
+            view_menu.addAction(self.layers_panel.toggleViewAction())
+            view_menu.addAction(self.stats_panel.toggleViewAction())
+
             # Palette data
+            self.palette_buttons = {}  # color -> [QPushButton]
             self.palettes = []  # List[List[Tuple[int, int, int]]]
             self.current_palette_index = 0
         except Exception as e:
             logging.error("Error initializing UI", exc_info=True)
             QMessageBox.critical(self, "Error", f"Error initializing UI: {str(e)}")
 
+    def create_map_panel(self):
+        map_panel = QWidget()
+        map_layout = QVBoxLayout(map_panel)
+        toolbar = QHBoxLayout()
+        self.map_width_spin = QSpinBox()
+        self.map_width_spin.setRange(1, 4096)
+        self.map_width_spin.setValue(64)
+        self.map_height_spin = QSpinBox()
+        self.map_height_spin.setRange(1, 4096)
+        self.map_height_spin.setValue(64)
+        self.map_tile_size_spin = QSpinBox()
+        self.map_tile_size_spin.setRange(1, 256)
+        self.map_tile_size_spin.setValue(16)
+        for label, widget in (('W', self.map_width_spin), ('H', self.map_height_spin), ('Tile Size', self.map_tile_size_spin)):
+            toolbar.addWidget(QLabel(label))
+            toolbar.addWidget(widget)
+        new_map_btn = QPushButton('New Map')
+        new_map_btn.clicked.connect(self.new_map)
+        toolbar.addWidget(new_map_btn)
+        load_map_btn = QPushButton('Load Map')
+        load_map_btn.clicked.connect(self.load_map)
+        toolbar.addWidget(load_map_btn)
+        save_map_btn = QPushButton('Save Map')
+        save_map_btn.clicked.connect(self.save_map)
+        toolbar.addWidget(save_map_btn)
+        self.map_layer_combo = QComboBox()
+        self.map_layer_combo.currentIndexChanged.connect(self.on_map_layer_changed)
+        toolbar.addWidget(self.map_layer_combo)
+        add_layer_btn = QPushButton('Add Layer')
+        add_layer_btn.clicked.connect(self.add_map_layer)
+        toolbar.addWidget(add_layer_btn)
+        toolbar.addWidget(QLabel('Tile'))
+        self.map_tile_spin = QSpinBox()
+        self.map_tile_spin.setRange(EMPTY_TILE, 65535)
+        self.map_tile_spin.setSpecialValueText('Empty')
+        self.map_tile_spin.setValue(0)
+        self.map_tile_spin.valueChanged.connect(self.on_map_tile_changed)
+        toolbar.addWidget(self.map_tile_spin)
+        toolbar.addStretch(1)
+        map_layout.addLayout(toolbar)
+        self.map_canvas = TileMapCanvas(self)
+        map_layout.addWidget(self.map_canvas, 1)
+        return map_panel
+
+    def new_map(self):
+        try:
+            tile_size = self.map_tile_size_spin.value()
+            tilemap = TileMap(self.map_width_spin.value(), self.map_height_spin.value(), tile_size, tile_size)
+            self.set_map(tilemap)
+        except Exception as e:
+            logging.error("Error creating map", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error creating map: {str(e)}")
+
+    def load_map(self):
+        try:
+            file_path, _ = QFileDialog.getOpenFileName(self, 'Load Map', '', 'Map Files (*.json *.csv)')
+            if file_path:
+                tile_size = self.map_tile_size_spin.value()
+                self.set_map(TileMap.load(file_path, tile_size, tile_size))
+        except Exception as e:
+            logging.error("Error loading map", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error loading map: {str(e)}")
+
+    def save_map(self):
+        try:
+            if self.map_canvas.tilemap is None:
+                return
+            file_path, _ = QFileDialog.getSaveFileName(self, 'Save Map', '', 'JSON Map (*.json);;CSV Layer (*.csv)')
+            if file_path:
+                if file_path.lower().endswith('.csv'):
+                    self.map_canvas.tilemap.save_csv(file_path, self.map_canvas.current_layer)
+                else:
+                    self.map_canvas.tilemap.save_json(file_path)
+        except Exception as e:
+            logging.error("Error saving map", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error saving map: {str(e)}")
+
+    def set_map(self, tilemap):
+        self.map_canvas.set_map(tilemap, self.tilemap_view.tileset_img)
+        self.map_width_spin.setValue(tilemap.width)
+        self.map_height_spin.setValue(tilemap.height)
+        self.update_map_layer_combo()
+
+    def update_map_layer_combo(self):
+        tilemap = self.map_canvas.tilemap
+        self.map_layer_combo.blockSignals(True)
+        self.map_layer_combo.clear()
+        if tilemap is not None:
+            self.map_layer_combo.addItems(tilemap.layer_names)
+            self.map_layer_combo.setCurrentIndex(self.map_canvas.current_layer)
+        self.map_layer_combo.blockSignals(False)
+
+    def add_map_layer(self):
+        if self.map_canvas.tilemap is None:
+            return
+        self.map_canvas.current_layer = self.map_canvas.tilemap.add_layer()
+        if self.map_canvas.renderer is not None:
+            self.map_canvas.renderer.invalidate()
+        self.update_map_layer_combo()
+        self.map_canvas.update()
+
+    def on_map_layer_changed(self, idx):
+        if idx >= 0:
+            self.map_canvas.current_layer = idx
+
+    def on_map_tile_changed(self, value):
+        self.map_canvas.current_tile = value
+
+    def on_view_tab_changed(self, idx):
+        # Harita sekmesine geçerken sprite üzerindeki düzenlemeleri yansıt
+        if self.view_tabs.widget(idx) is not self.tilemap_scroll:
+            self.map_canvas.set_tileset(self.tilemap_view.tileset_img)
+
     def load_tileset(self):
         try:
             file_path, _ = QFileDialog.getOpenFileName(self, 'Load Sprite', '', 'Image Files (*.png *.jpg *.bmp)')
             if file_path:
-                self.recolorer.load_tileset(file_path)
-                img_array = np.array(self.recolorer.tileset)
-                self.tilemap_view.set_tileset(img_array)
-                palette = self.recolorer.extract_palette()
-                self.palettes = [palette]
-                self.current_palette_index = 0
-                self.update_palette_combo()
-                self.update_palette_buttons()
+                if self.load_worker is not None:
+                    self.load_worker.cancel()
+                worker = Worker(load_tileset_job, file_path)
+                worker.signals.finished.connect(self.on_tileset_loaded)
+                worker.signals.error.connect(lambda message: self.on_job_error("Error loading sprite", message))
+                self.load_worker = worker
+                self.start_worker(worker)
+        except Exception as e:
+            logging.error("Error loading sprite", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error loading sprite: {str(e)}")
+
+    def on_tileset_loaded(self, result):
+        try:
+            if self.load_worker is None or self.sender() is not self.load_worker.signals:
+                return  # Yerine yenisi başlatılmış eski bir yükleme
+            if self.load_worker.is_cancelled():
+                return  # İş bittikten sonra iptal edildi; on_job_done temizler
+            self.load_worker = None
+            self.recolorer.tileset = result['image']
+            palette = result['palette']
+            self.tilemap_view.set_tileset(result['array'], palette, result['indexed'])
+            self.map_canvas.set_tileset(self.tilemap_view.tileset_img)
+            if len(palette) > MAX_PALETTE_BUTTONS:
+                answer = QMessageBox.question(
+                    self, "Too Many Colors",
+                    f"This sprite has {len(palette)} colors. Reduce it to {self.reduce_count_spin.value()} colors?")
+                if answer == QMessageBox.Yes:
+                    self.reduce_colors()
+                    return
+            self.palettes = [palette]
+            self.current_palette_index = 0
+            self.update_palette_combo()
+            self.update_palette_buttons()
         except Exception as e:
             logging.error("Error loading sprite", exc_info=True)
             QMessageBox.critical(self, "Error", f"Error loading sprite: {str(e)}")
 
+    def load_layer_document(self, file_path):
+        """Load a layer file on the thread pool; it replaces the sheet like a load"""
+        if self.load_worker is not None:
+            self.load_worker.cancel()
+        worker = Worker(load_layers_job, file_path)
+        worker.signals.finished.connect(self.on_layers_loaded)
+        worker.signals.error.connect(lambda message: self.on_job_error("Error loading layers", message))
+        self.load_worker = worker
+        self.start_worker(worker)
+
+    def on_layers_loaded(self, result):
+        try:
+            if self.load_worker is None or self.sender() is not self.load_worker.signals:
+                return  # Yerine yenisi başlatılmış eski bir yükleme
+            if self.load_worker.is_cancelled():
+                return
+            self.load_worker = None
+            self.recolorer.tileset = result['image']
+            self.set_layer_document(result['document'], result['palette'], result['indexed'])
+        except Exception as e:
+            logging.error("Error loading layers", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error loading layers: {str(e)}")
+
+    def set_layer_document(self, document, palette, indexed=None):
+        """Install a layer document whose composite has palette (indexed as from load_layers_job)"""
+        self.tilemap_view.set_document(document, palette, indexed)
+        self.map_canvas.set_tileset(self.tilemap_view.tileset_img)
+        self.palettes = [palette]
+        self.current_palette_index = 0
+        self.update_palette_combo()
+        self.update_palette_buttons()
+
+    def reduce_colors(self):
+        """Quantize the sheet on the thread pool; the result is installed like a loaded sheet"""
+        try:
+            if self.tilemap_view.tileset_img is None:
+                return
+            if self.load_worker is not None:
+                self.load_worker.cancel()
+            worker = Worker(reduce_colors_job, self.tilemap_view.tileset_img.copy(),
+                            self.reduce_count_spin.value(), self.reduce_method_combo.currentText())
+            worker.signals.finished.connect(self.on_tileset_loaded)
+            worker.signals.error.connect(lambda message: self.on_job_error("Error reducing colors", message))
+            self.load_worker = worker
+            self.start_worker(worker)
+        except Exception as e:
+            logging.error("Error reducing colors", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error reducing colors: {str(e)}")
+
+    def export_palette_lut(self):
+        try:
+            if self.tilemap_view.tileset_img is None:
+                return
+            config_path, _ = QFileDialog.getOpenFileName(self, 'Palette Config', '', 'Palette Configs (*.json *.palcfg)')
+            if not config_path:
+                return
+            index_path, _ = QFileDialog.getSaveFileName(self, 'Save Index Texture', '', 'PNG Files (*.png)')
+            if not index_path:
+                return
+            config = SpritePaletteConfig.load_from_file(config_path)
+            stem = os.path.splitext(index_path)[0]
+            palette_lut = self.recolorer.export_palette_lut(
+                config, index_path, stem + '_lut.png', stem + '_lut.json',
+                image=Image.fromarray(self.tilemap_view.tileset_img))
+            self.statusBar().showMessage(
+                f"Exported {palette_lut.width}-color LUT with {len(palette_lut.row_names)} palettes", 5000)
+        except Exception as e:
+            logging.error("Error exporting palette LUT", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error exporting palette LUT: {str(e)}")
+
     def save_tileset(self):
         try:
+            if self.tilemap_view.tileset_img is None:
+                return
             file_path, _ = QFileDialog.getSaveFileName(self, 'Save Sprite', '', 'PNG Files (*.png)')
             if file_path:
-                img = Image.fromarray(self.tilemap_view.tileset_img)
-                img.save(file_path)
+                # Kuyruktaki kayıt, düzenlemeye devam edilirken değişmeyen bir kopyayı yazar
+                snapshot = self.tilemap_view.tileset_img.copy()
+                # Aynı dosyaya giden eski kayıtlar artık geçersiz
+                for pending in self.active_workers:
+                    if getattr(pending, 'file_path', None) == file_path:
+                        pending.cancel()
+                upscale_method = self.upscale_combo.currentText()
+                worker = Worker(save_tileset_job, snapshot, file_path, self.compress_level_spin.value(),
+                                None if upscale_method == 'none' else upscale_method)
+                worker.file_path = file_path
+                worker.signals.error.connect(lambda message: self.on_job_error("Error saving sprite", message))
+                self.start_worker(worker)
         except Exception as e:
             logging.error("Error saving sprite", exc_info=True)
             QMessageBox.critical(self, "Error", f"Error saving sprite: {str(e)}")
 
+    def start_worker(self, worker):
+        self.active_workers.append(worker)
+        worker.signals.progress.connect(lambda percent, message: self.on_job_progress(worker, percent, message))
+        for signal in (worker.signals.finished, worker.signals.error, worker.signals.cancelled):
+            signal.connect(lambda *_: self.on_job_done(worker))
+        self.thread_pool.start(worker)
+        self.update_job_status()
+
+    def on_job_progress(self, worker, percent, message):
+        if self.active_workers and worker is self.active_workers[0]:
+            self.job_progress.setValue(percent)
+            self.job_label.setText(message)
+
+    def on_job_done(self, worker):
+        if worker in self.active_workers:
+            self.active_workers.remove(worker)
+        if worker is self.load_worker and worker.is_cancelled():
+            self.load_worker = None
+        self.update_job_status()
+
+    def on_job_error(self, title, message):
+        QMessageBox.critical(self, "Error", f"{title}: {message}")
+
+    def cancel_jobs(self):
+        for worker in list(self.active_workers):
+            worker.cancel()
+            # Henüz başlamamış işler kuyruktan doğrudan çıkarılır
+            if self.thread_pool.tryTake(worker):
+                self.on_job_done(worker)
+
+    def update_job_status(self):
+        busy = bool(self.active_workers)
+        self.job_progress.setVisible(busy)
+        self.job_cancel_btn.setVisible(busy)
+        if not busy:
+            self.job_label.setText('')
+            self.job_progress.setValue(0)
+        elif len(self.active_workers) > 1:
+            self.job_label.setText(f"{len(self.active_workers)} jobs queued")
+
+    def closeEvent(self, event):
+        # Bekleyen kayıtların yarım kalmaması için bitmelerini bekle
+        if self.load_worker is not None:
+            self.load_worker.cancel()
+        for worker in self.prefetch_workers.values():
+            worker.cancel()
+        self.thread_pool.waitForDone()
+        super().closeEvent(event)
+
+    def auto_sections(self):
+        try:
+            if self.tilemap_view.tileset_img is None:
+                return
+            proposals = self.recolorer.segment_sections(
+                self.segment_mode_combo.currentText(), image=Image.fromarray(self.tilemap_view.tileset_img))
+            self.tilemap_view.set_section_rects(proposals)
+            self.statusBar().showMessage(f"Found {len(proposals)} sections", 5000)
+            if not proposals:
+                return
+            file_path, _ = QFileDialog.getSaveFileName(
+                self, 'Save Sections', '', 'JSON Files (*.json);;Binary Config (*.palcfg)')
+            if file_path:
+                proposals_to_config(proposals).save_to_file(file_path)
+        except Exception as e:
+            logging.error("Error detecting sections", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Error detecting sections: {str(e)}")
+
     def update_palette_combo(self):
         self.palette_combo.blockSignals(True)
         self.palette_combo.clear()
@@ -319,6 +1424,7 @@ class TilesetRecolorGUI(QMainWindow):
             self.palette_combo.addItem(f"Palette {i+1}")
         self.palette_combo.setCurrentIndex(self.current_palette_index)
         self.palette_combo.blockSignals(False)
+        self.prefetch_palette_variants()
 
     def add_new_palette(self):
         # Yeni palet: ilk paletin renklerinin kopyasıyla başlasın
@@ -334,8 +1440,40 @@ class TilesetRecolorGUI(QMainWindow):
     def on_palette_changed(self, idx):
         if 0 <= idx < len(self.palettes):
             self.current_palette_index = idx
+            # Pikseller değişmez; yalnızca görüntüleme tablosu değişir
+            self.tilemap_view.set_display_palette(self.palettes[idx])
             self.update_palette_buttons()
+            self.prefetch_palette_variants()
 
+    def prefetch_palette_variants(self):
+        """Render the palettes next to the current one in the combo on the thread pool"""
+        view = self.tilemap_view
+        if view.index_map is None:
+            return
+        # Eski görsel için bekleyen işler artık işe yaramaz
+        for key, worker in list(self.prefetch_workers.items()):
+            if key[0] != view.image_version:
+                worker.cancel()
+                if self.thread_pool.tryTake(worker):
+                    del self.prefetch_workers[key]
+        # Aktif varyant dışında önbelleğe sığacak kadar komşu hazırlanır
+        room = view.variant_capacity() - 1
+        for distance in range(1, self.PREFETCH_NEIGHBORS + 1):
+            for idx in (self.current_palette_index + distance, self.current_palette_index - distance):
+                if not 0 <= idx < len(self.palettes) or len(self.prefetch_workers) >= room:
+                    continue
+                lut = view.variant_lut(self.palettes[idx])
+                key = view.variant_key(lut)
+                if key in view.variant_cache or key in self.prefetch_workers:
+                    continue
+                worker = Worker(render_variant_job, lut, view.index_map)
+                worker.signals.finished.connect(lambda array, k=key, l=lut: view.store_variant(k, l, array))
+                for signal in (worker.signals.finished, worker.signals.error, worker.signals.cancelled):
+                    signal.connect(lambda *_, k=key: self.prefetch_workers.pop(k, None))
+                self.prefetch_workers[key] = worker
+                self.thread_pool.start(worker)
+
+    @profiler.timed('palette_rebuild')
     def update_palette_buttons(self):
         # Remove old buttons
         for i in reversed(range(self.palette_grid.count())):
@@ -344,12 +1482,18 @@ class TilesetRecolorGUI(QMainWindow):
                 widget.deleteLater()
         # Yatayda mevcut renkler (tek satır)
         palette = self.palettes[self.current_palette_index] if self.palettes else []
-        for i, color in enumerate(palette):
+        view = self.tilemap_view
+        self.palette_buttons = {}  # key color -> [QPushButton]
+        keys = [tuple(int(c) for c in key) for key in view.index_colors[:min(len(palette), view.palette_size)]]
+        for i, key in enumerate(keys):
             btn = QPushButton()
             btn.setFixedSize(24, 24)
-            btn.setStyleSheet(f"background-color: rgb({color[0]}, {color[1]}, {color[2]}); border: 1px solid black;")
-            btn.clicked.connect(lambda _, c=color: self.select_palette_color(c))
+            btn.clicked.connect(lambda _, k=key: self.select_palette_color(k))
+            btn.setContextMenuPolicy(Qt.CustomContextMenu)
+            btn.customContextMenuRequested.connect(lambda _, idx=i: self.edit_palette_entry(idx))
             self.palette_grid.addWidget(btn, 0, i)
+            self.palette_buttons.setdefault(key, []).append(btn)
+        self.update_palette_usage()
         # Dikeyde boş kutular (örnek: 4 adet)
         empty_slots = 4
         for j in range(empty_slots):
@@ -358,27 +1502,78 @@ class TilesetRecolorGUI(QMainWindow):
             empty_btn.setStyleSheet("background-color: #eee; border: 1px dashed #888;")
             empty_btn.clicked.connect(lambda _, idx=j: self.add_new_palette_color())
             self.palette_grid.addWidget(empty_btn, j + 1, 0)
-        if palette:
-            self.select_palette_color(palette[0])
+        if keys:
+            self.select_palette_color(keys[0])
 
     def add_new_palette_color(self):
         color = QColorDialog.getColor()
         if color.isValid():
             rgb = (color.red(), color.green(), color.blue())
             if self.palettes:
-                self.palettes[self.current_palette_index].append(rgb)
+                self.tilemap_view.add_palette_key(rgb)
+                # Paletler aynı slot sırasını paylaşır; diğerlerine de eklenir
+                for palette in self.palettes:
+                    palette.append(rgb)
                 self.update_palette_buttons()
 
+    def edit_palette_entry(self, index):
+        """Change one entry of the active palette; every pixel using it follows"""
+        palette = self.palettes[self.current_palette_index]
+        color = QColorDialog.getColor(QColor(*palette[index]), self)
+        if color.isValid():
+            palette[index] = (color.red(), color.green(), color.blue())
+            self.tilemap_view.set_palette_entry(index, palette[index])
+            self.update_palette_usage()
+
     def select_palette_color(self, color):
         self.current_palette_color = color
         self.tilemap_view.set_selected_color(color)
 
-    def update_tileset_from_grid(self, img_array):
+    def update_tileset_from_grid(self, img_array, dirty_rect=None):
         # Anında güncelleme için (ileride başka görsel alanlar eklenirse buradan yapılabilir)
-        pass
+        # dirty_rect: değişen kaynak alanı (x0, y0, x1, y1); None ise tüm görsel
+        if not hasattr(self, 'minimap_panel'):
+            return
+        if dirty_rect is None:
+            self.minimap_panel.minimap.set_image(img_array)
+            self.layers_panel.refresh()
+        else:
+            self.minimap_panel.minimap.patch(img_array, dirty_rect)
+
+    def update_minimap_viewport(self):
+        if hasattr(self, 'minimap_panel') and self.minimap_panel.isVisible():
+            self.minimap_panel.minimap.update()
+
+    def update_palette_usage(self, changed_colors=None):
+        """Refresh usage tooltips and markers from the incremental color counts"""
+        usage = self.tilemap_view.color_usage
+        colors = self.palette_buttons if changed_colors is None else changed_colors
+        view = self.tilemap_view
+        for color in colors:
+            count = usage.count(color)
+            buttons = self.palette_buttons.get(tuple(color), [])
+            if not buttons:
+                continue
+            # Butonlar anahtar rengi değil, aktif paletteki rengi gösterir
+            shown = tuple(int(c) for c in view.display_lut[view.index_of[int(pack_colors(np.array(color, dtype=np.uint8)))]])
+            for btn in buttons:
+                border = "1px solid black" if count else "2px dashed red"
+                btn.setStyleSheet(f"background-color: rgb({shown[0]}, {shown[1]}, {shown[2]}); border: {border};")
+                btn.setToolTip(f"RGB{shown}: {count} px" if count else f"RGB{shown}: unused")
+        budget = self.color_budget_spin.value()
+        in_use = usage.colors_in_use()
+        unused = sum(1 for color in self.palette_buttons if usage.count(color) == 0)
+        text = f"Colors in use: {in_use} / {budget}"
+        if unused:
+            text += f", {unused} unused in palette"
+        self.usage_label.setText(text)
+        self.usage_label.setStyleSheet("color: red;" if usage.over_budget(budget) else "")
 
     def undo(self):
-        self.tilemap_view.undo()
+        if self.view_tabs.currentWidget() is self.tilemap_scroll:
+            self.tilemap_view.undo()
+        else:
+            self.map_canvas.undo()
 
 def main():
     try:
@@ -0,0 +1,212 @@
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import recolor_kernels
+from palette_config import SpritePaletteConfig
+from tileset_diff import tile_change_mask
+
+
+def file_signature(path):
+    """(mtime_ns, size) of a file, or None while it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def variant_mappings(config):
+    """Color mapping per variant and section: {variant: {section: {base: color}}}
+
+    Variants are the palette names of the config, in first-seen order. A
+    section's first palette holds its base colors; sections without a
+    palette of the variant's name keep them.
+    """
+    variants = {}
+    for section in config.sections.values():
+        for palette in section.palettes:
+            variants.setdefault(palette.name, {})
+    for section in config.sections.values():
+        if not section.palettes:
+            continue
+        base = section.palettes[0].colors
+        for palette in section.palettes[1:]:
+            if len(palette.colors) != len(base):
+                raise ValueError(f"Palette {palette.name} of section {section.name} has {len(palette.colors)} colors, expected {len(base)}")
+            mapping = {tuple(b): tuple(c) for b, c in zip(base, palette.colors) if tuple(b) != tuple(c)}
+            if mapping:
+                variants[palette.name][section.name] = mapping
+    return variants
+
+
+def render_pixels(pixels, labels, names, mappings, backend='auto'):
+    """Recolor (N, 3) pixels whose section labels are given (see label_map)"""
+    out = pixels.copy()
+    for label, name in enumerate(names, start=1):
+        mapping = mappings.get(name)
+        if not mapping:
+            continue
+        selected = labels == label
+        if selected.any():
+            out[selected] = recolor_kernels.recolor(pixels[selected][:, None], mapping, backend)[:, 0]
+    return out
+
+
+def save_atomic(img_array, file_path, compress_level=1):
+    """Write a PNG next to its target and move it into place, so readers never see half a file"""
+    fd, temp_path = tempfile.mkstemp(suffix='.part', dir=os.path.dirname(os.path.abspath(file_path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            Image.fromarray(img_array).save(f, format='PNG', compress_level=compress_level)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+@dataclass
+class WatchedSheet:
+    path: str
+    signature: Optional[Tuple[int, int]] = None
+    array: Optional[np.ndarray] = None
+    outputs: Dict[str, np.ndarray] = field(default_factory=dict)  # variant -> rendered sheet
+
+
+class RecolorWatcher:
+    """Keeps recolored variants of source sheets up to date by polling
+
+    Every poll only stats the watched files. A sheet whose signature changed
+    is re-read (a half-written file fails to decode and is retried on the
+    next poll), diffed tile by tile against the previous version, and only
+    the changed tiles are re-rendered into each variant. A config change
+    re-renders everything.
+    """
+
+    def __init__(self, sheet_paths, config_path, output_dir, tile_width=16, tile_height=16,
+                 backend='auto', compress_level=1):
+        self.sheets = [WatchedSheet(path) for path in sheet_paths]
+        self.config_path = config_path
+        self.config_signature = None
+        self.output_dir = output_dir
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.backend = recolor_kernels.resolve_backend(backend)
+        self.compress_level = compress_level
+        self.config = None
+        self.mappings = {}
+        self._labels = {}  # (width, height) -> (labels, names)
+
+    def output_path(self, sheet, variant):
+        stem = os.path.splitext(os.path.basename(sheet.path))[0]
+        return os.path.join(self.output_dir, f"{stem}_{variant}.png")
+
+    def labels_for(self, width, height, img_array=None):
+        if self.config.uses_color_sets:
+            # Color-set sections follow the pixels, so they cannot be cached by size
+            return self.config.label_map(width, height, img_array)
+        key = (width, height)
+        if key not in self._labels:
+            self._labels[key] = self.config.label_map(width, height)
+        return self._labels[key]
+
+    def poll(self):
+        """Check every watched file once; returns the output paths written"""
+        written = []
+        signature = file_signature(self.config_path)
+        if signature is not None and signature != self.config_signature:
+            try:
+                self.config = SpritePaletteConfig.load_from_file(self.config_path)
+                self.mappings = variant_mappings(self.config)
+            except (OSError, ValueError, KeyError) as e:
+                logging.error(f"Could not load palette config {self.config_path}: {str(e)}")
+                return written
+            self.config_signature = signature
+            self._labels.clear()
+            for sheet in self.sheets:
+                sheet.outputs.clear()
+                if sheet.array is not None:
+                    written += self.render(sheet, sheet.array)
+        if self.config is None:
+            return written
+        for sheet in self.sheets:
+            signature = file_signature(sheet.path)
+            if signature is None or signature == sheet.signature:
+                continue
+            try:
+                with Image.open(sheet.path) as image:
+                    new_array = np.array(image.convert('RGB'))
+            except (OSError, ValueError) as e:
+                logging.error(f"Could not read {sheet.path}, retrying on the next poll: {str(e)}")
+                continue
+            sheet.signature = signature
+            written += self.render(sheet, new_array)
+        return written
+
+    def render(self, sheet, new_array):
+        """Bring every variant of a sheet up to date with new_array"""
+        height, width = new_array.shape[:2]
+        labels, names = self.labels_for(width, height, new_array)
+        full = sheet.array is None or sheet.array.shape != new_array.shape or set(sheet.outputs) != set(self.mappings)
+        if full:
+            dirty = np.ones((height, width), dtype=bool)
+        else:
+            _, _, counts = tile_change_mask(sheet.array, new_array, self.tile_width, self.tile_height)
+            if not counts.any():
+                sheet.array = new_array
+                return []
+            # Whole dirty tiles, cropped back to the sheet size
+            dirty = np.repeat(np.repeat(counts > 0, self.tile_height, axis=0), self.tile_width, axis=1)[:height, :width]
+        sheet.array = new_array
+        pixels, dirty_labels = new_array[dirty], labels[dirty]
+        written = []
+        for variant, mappings in self.mappings.items():
+            output = sheet.outputs.get(variant)
+            if full or output is None:
+                output = sheet.outputs[variant] = new_array.copy()
+            output[dirty] = render_pixels(pixels, dirty_labels, names, mappings, self.backend)
+            path = self.output_path(sheet, variant)
+            save_atomic(output, path, self.compress_level)
+            written.append(path)
+        logging.info(f"{sheet.path}: {'rendered' if full else 're-rendered'} {int(dirty.sum())} pixels into {len(written)} variants")
+        return written
+
+    def run(self, interval=0.5, stop_event=None):
+        """Poll every interval seconds until stop_event is set"""
+        stop_event = stop_event or threading.Event()
+        os.makedirs(self.output_dir, exist_ok=True)
+        while not stop_event.is_set():
+            self.poll()
+            stop_event.wait(interval)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Re-render palette variants of sheets whenever they change')
+    parser.add_argument('sheets', nargs='+', help='source sheet paths')
+    parser.add_argument('--config', required=True, help='palette config JSON')
+    parser.add_argument('--out', required=True, help='output directory for <sheet>_<palette>.png files')
+    parser.add_argument('--tile', type=int, nargs=2, default=[16, 16], metavar=('W', 'H'))
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between polls')
+    parser.add_argument('--backend', default='auto', choices=('auto',) + recolor_kernels.BACKENDS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    watcher = RecolorWatcher(args.sheets, args.config, args.out, args.tile[0], args.tile[1], args.backend)
+    try:
+        watcher.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
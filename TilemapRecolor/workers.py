@@ -0,0 +1,134 @@
+import logging
+import os
+import tempfile
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+from PIL import Image
+import numpy as np
+
+from color_utils import slot_index_map
+from layers import LayerDocument
+from tileset_recolor import TilesetRecolor
+
+
+class WorkerCancelled(Exception):
+    pass
+
+
+class WorkerSignals(QObject):
+    progress = pyqtSignal(int, str)
+    finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """Runs func(worker, *args) on a QThreadPool
+
+    The job reports progress through worker.report(), which also raises
+    WorkerCancelled once cancel() has been called, so jobs stop at their
+    next checkpoint.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        super().__init__()
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self._cancel_event = threading.Event()
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def report(self, percent, message=''):
+        if self._cancel_event.is_set():
+            raise WorkerCancelled()
+        self.signals.progress.emit(percent, message)
+
+    def run(self):
+        try:
+            if self._cancel_event.is_set():
+                raise WorkerCancelled()
+            result = self.func(self, *self.args, **self.kwargs)
+        except WorkerCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            logging.error("Background job failed", exc_info=True)
+            self.signals.error.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+
+def load_tileset_job(worker, file_path):
+    """Decode a sheet and extract its palette off the GUI thread"""
+    recolorer = TilesetRecolor()
+    worker.report(5, 'Decoding')
+    recolorer.load_tileset(file_path)
+    worker.report(60, 'Converting')
+    img_array = np.array(recolorer.tileset)
+    worker.report(75, 'Extracting palette')
+    palette = recolorer.extract_palette()
+    worker.report(85, 'Indexing')
+    indexed = slot_index_map(palette, img_array)
+    worker.signals.progress.emit(100, 'Loaded')
+    return {'path': file_path, 'image': recolorer.tileset, 'array': img_array, 'palette': palette,
+            'indexed': indexed}
+
+
+def load_layers_job(worker, file_path):
+    """Load a layer document and index its composite off the GUI thread"""
+    worker.report(5, f'Loading {os.path.basename(file_path)}')
+    document = LayerDocument.load(file_path)
+    worker.report(60, 'Extracting palette')
+    image = Image.fromarray(document.composite)
+    palette = TilesetRecolor().extract_palette_from_image(image)
+    worker.report(85, 'Indexing')
+    indexed = slot_index_map(palette, document.composite)
+    worker.signals.progress.emit(100, 'Loaded')
+    return {'document': document, 'image': image, 'palette': palette, 'indexed': indexed}
+
+
+def reduce_colors_job(worker, img_array, n_colors, method):
+    """Quantize a snapshot of the sheet; returns a result shaped like load_tileset_job's
+
+    The quantizer's index map already is the slot map of the reduced sheet.
+    """
+    worker.report(5, 'Reducing colors')
+    palette, index_map = TilesetRecolor().quantize_image(Image.fromarray(img_array), n_colors, method)
+    worker.report(90, 'Building image')
+    palette_array = np.array(palette, dtype=np.uint8)
+    reduced = palette_array[index_map]
+    worker.signals.progress.emit(100, 'Reduced')
+    return {'image': Image.fromarray(reduced), 'array': reduced, 'palette': palette,
+            'indexed': (palette_array, index_map.astype(np.int32))}
+
+
+def save_tileset_job(worker, img_array, file_path, compress_level=None, upscale_method=None):
+    """Encode a snapshot of the sheet and move it into place atomically"""
+    worker.report(5, f'Encoding {os.path.basename(file_path)}')
+    recolorer = TilesetRecolor()
+    fd, temp_path = tempfile.mkstemp(suffix='.part', dir=os.path.dirname(os.path.abspath(file_path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            recolorer.save_recolored_tileset(Image.fromarray(img_array), f, compress_level, format='PNG',
+                                             upscale_method=upscale_method)
+        worker.report(95, 'Writing')
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    worker.signals.progress.emit(100, 'Saved')
+    return file_path
+
+
+def render_variant_job(worker, lut, index_map):
+    """Render the sheet through one palette's display LUT for the variant cache"""
+    worker.report(0, 'Rendering palette')
+    return np.take(lut, index_map, axis=0)